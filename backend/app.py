@@ -1,20 +1,55 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, send_file
 from flask_cors import CORS
+import io
 import tempfile
 import os
+import json
+import time
 import uuid
-from openai import AzureOpenAI
-import chromadb
-from chromadb.config import Settings
 from modules import config
-from modules.extract import process_pdf_for_rag
-from modules.qna import answer_question
+from modules import metrics
+from modules.documents import (
+    spool_upload, store_pdf_file, register_document, add_document_tags, UploadTooLarge, DEFAULT_MAX_UPLOAD_BYTES
+)
+from modules.singleflight import coalesce
+
+# PyMuPDF, ChromaDB, OpenAI and NumPy (modules.extract, qna, render and vision) are
+# imported by the routes that use them, so the app starts serving /test without
+# them. warm_up() loads them ahead of the first request instead.
 
 app = Flask(__name__)
 CORS(app)
+metrics.configure(config)
+
+# Reject oversized requests before the multipart body is parsed; the per-file
+# limit is enforced again while the upload is spooled to disk.
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+app.config["MAX_CONTENT_LENGTH"] = int(getattr(config, "MAX_UPLOAD_BYTES", DEFAULT_MAX_UPLOAD_BYTES)) + MULTIPART_OVERHEAD_BYTES
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    return jsonify({"status": "error", "message": "Upload is too large"}), 413
+
+@app.before_request
+def start_request_trace():
+    g.request_start = time.perf_counter()
+    g.trace_id = metrics.start_trace(request.headers.get("X-Trace-Id"))
+
+@app.after_request
+def record_request_metrics(response):
+    if hasattr(g, "request_start"):
+        duration = time.perf_counter() - g.request_start
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("docuwrangler_http_request_seconds", duration, route=route, status=response.status_code)
+        metrics.trace_event({"route": route, "status": response.status_code, "duration_ms": round(duration * 1000, 3)})
+        response.headers["X-Trace-Id"] = g.trace_id
+    return response
 
 # Initialize clients
 def initialize_clients():
+    from openai import AzureOpenAI
+    from modules.vector_store import get_chroma_client
+    
     # Initialize Azure OpenAI client
     azure_client = AzureOpenAI(
         api_key=config.AZURE_OPENAI_API_KEY,
@@ -22,18 +57,38 @@ def initialize_clients():
         api_version=config.AZURE_OPENAI_API_VERSION
     )
     
-    # Initialize ChromaDB client
-    chroma_client = chromadb.PersistentClient(
-        path=config.CHROMA_DB_PATH
-    )
+    # Shared ChromaDB client (embedded, or the vector-store server in CHROMA_SERVER_URL)
+    chroma_client = get_chroma_client(config)
     
     return azure_client, chroma_client
 
+def preload_modules():
+    """Import every route dependency. Safe before fork: no clients, threads or files are opened."""
+    import modules.extract
+    import modules.qna
+    import modules.render
+    import modules.vision
+
+def warm_up():
+    """
+    Prepare this process for traffic: route dependencies, clients and the vector
+    index. Runs before the worker serves requests when config.WARM_UP is set.
+    """
+    from modules.qna import warm_index
+    
+    with metrics.span("warm_up"):
+        preload_modules()
+        _, chroma_client = initialize_clients()
+        warm_index(chroma_client)
+
 @app.route('/process_pdf', methods=['POST'])
 def process_pdf():
     if 'file' not in request.files:
         return jsonify({"status": "error", "message": "No file provided"}), 400
     
+    from modules.extract import extract_and_embed_pdf, store_extracted_pdf
+    from modules.vision import schedule_backfill
+    
     pdf_file = request.files['file']
     
     if not pdf_file.filename.lower().endswith('.pdf'):
@@ -43,20 +98,35 @@ def process_pdf():
     pdf_id = request.form.get('pdf_id', str(uuid.uuid4()))
     
     try:
-        # Read the PDF file
-        pdf_bytes = pdf_file.read()
+        # Stream the upload to disk (hashing it on the way) instead of reading it into memory
+        try:
+            tmp_path, sha256, _ = spool_upload(config, pdf_file.stream)
+        except UploadTooLarge as e:
+            return jsonify({"status": "error", "message": str(e)}), 413
+        
+        # Keep the original in the content-addressed store for citation rendering
+        stored_path = store_pdf_file(config, tmp_path, sha256)
+        register_document(config, pdf_id, sha256, filename=pdf_file.filename)
+        add_document_tags(config, pdf_id, request.form.get('tags', '').split(','))
         
         # Initialize clients
         azure_client, chroma_client = initialize_clients()
         
-        # Process the PDF for RAG
-        result = process_pdf_for_rag(
-            pdf_bytes=pdf_bytes,
-            pdf_id=pdf_id,
-            client=azure_client,
-            chroma_client=chroma_client,
-            config=config
-        )
+        # Process the PDF for RAG. Concurrent uploads of the same content share one
+        # extraction; each stores it under its own pdf_id (identical requests share both).
+        def extract():
+            return extract_and_embed_pdf(stored_path, pdf_id, azure_client, config, sha256=sha256)
+        
+        def extract_and_store():
+            extracted = coalesce(config, "extract", sha256, extract)
+            return store_extracted_pdf({**extracted, "pdf_id": pdf_id}, chroma_client, config)
+        
+        result = coalesce(config, "upload", f"{sha256}:{pdf_id}", extract_and_store)
+        register_document(config, pdf_id, sha256, num_pages=result["num_pages"])
+        
+        # Describe deferred images in the background (lazy vision mode)
+        if result["num_deferred_images"] and getattr(config, "VISION_BACKFILL", True):
+            schedule_backfill(config, azure_client, chroma_client, pdf_id)
         
         # Return success response
         return jsonify({
@@ -76,23 +146,80 @@ def process_pdf():
 def test():
     return jsonify({"status": "success", "message": "API is working"})
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.snapshot())
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/ask', methods=['POST'])
 def ask():
+    from modules.qna import answer_question
+    from modules.render import prerender_pages
+    
     data = request.json
-    if not data or 'question' not in data:
+    if not isinstance(data, dict) or 'question' not in data:
         return jsonify({"status": "error", "message": "No question provided"}), 400
     
     question = data['question']
+    if not isinstance(question, str) or not question.strip():
+        return jsonify({"status": "error", "message": "question must be a non-empty string"}), 400
     pdf_id = data.get('pdf_id')  # Optional: to limit search to a specific PDF
+    pdf_ids = data.get('pdf_ids')  # Optional: several PDFs answered together
+    collection = data.get('collection')  # Optional: all PDFs tagged with this collection
+    
+    if pdf_ids is not None and not (isinstance(pdf_ids, list) and all(isinstance(p, str) for p in pdf_ids)):
+        return jsonify({"status": "error", "message": "pdf_ids must be a list of strings"}), 400
+    if collection is not None and not isinstance(collection, str):
+        return jsonify({"status": "error", "message": "collection must be a string"}), 400
     
-    # Call the answer_question function from qna.py
-    result = answer_question(question, pdf_id)
+    # Call the answer_question function from qna.py; identical concurrent questions share one answer
+    ask_key = json.dumps([" ".join(question.split()), pdf_id, pdf_ids, collection])
+    result = coalesce(config, "ask", ask_key,
+                      lambda: answer_question(question, pdf_id, pdf_ids=pdf_ids, collection=collection))
+    
+    # Warm the render cache for the pages the UI is about to offer as citations
+    if result.get("status") == "success":
+        pages_by_doc = {}
+        for ref in result["highlight_info"]:
+            if isinstance(ref["page"], int):
+                pages_by_doc.setdefault(ref.get("pdf_id") or result["pdf_id"], []).append(ref["page"])
+        for doc_id, pages in pages_by_doc.items():
+            prerender_pages(config, doc_id, pages)
     
     return jsonify(result)
 
+@app.route('/render/<pdf_id>/<int:page>', methods=['GET'])
+def render_page(pdf_id, page):
+    """
+    Render a page (or a bbox crop) of a stored PDF.
+    
+    Query parameters: zoom (default 1.5), format (png or webp), bbox=x0,y0,x1,y1 in PDF points.
+    Responses carry an ETag and honour If-None-Match.
+    """
+    from modules.render import render, RenderError, DocumentNotStored, FORMATS, DEFAULT_ZOOM
+    
+    try:
+        zoom = float(request.args.get('zoom', DEFAULT_ZOOM))
+        fmt = request.args.get('format', 'png').lower()
+        bbox = request.args.get('bbox')
+        bbox = tuple(float(v) for v in bbox.split(',')) if bbox else None
+        data, etag = render(config, pdf_id, page, zoom=zoom, fmt=fmt, bbox=bbox)
+    except DocumentNotStored as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except (RenderError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    response = send_file(io.BytesIO(data), mimetype=FORMATS[fmt], etag=etag, conditional=True, max_age=86400)
+    response.headers["Cache-Control"] = "public, max-age=86400, immutable"
+    return response
+
 # Ensure the ChromaDB directory exists
 if not os.path.exists(config.CHROMA_DB_PATH):
     os.makedirs(config.CHROMA_DB_PATH)
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Development server; production runs under gunicorn (see wsgi.py)
+    if getattr(config, "WARM_UP", False):
+        warm_up()
+    app.run(debug=getattr(config, "DEBUG", False))
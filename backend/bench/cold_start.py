@@ -0,0 +1,51 @@
+"""
+Cold-start probe for bench.run: times a fresh interpreter's app import, optional
+warm-up and first /ask.
+
+Imports nothing beyond the standard library at module level, so the measured
+startup includes every import the app itself pulls in. Reads a JSON request
+(settings, pdf_id, question, warm) on stdin and prints the timings as JSON on
+the last line of stdout:
+
+    python -m bench.cold_start < request.json
+"""
+import sys
+import json
+import time
+import types
+from typing import Dict, Any
+
+def install_config(settings: Dict[str, Any]):
+    """Register a generated modules.config so the app runs without a real config.py."""
+    import modules
+    config = types.ModuleType("modules.config")
+    config.__dict__.update(settings)
+    sys.modules["modules.config"] = config
+    modules.config = config
+
+def cold_start(settings: Dict[str, Any], pdf_id: str, question: str, warm: bool) -> Dict[str, Any]:
+    install_config(settings)
+    start = time.perf_counter()
+    import app as app_module
+
+    client = app_module.app.test_client()
+    if client.get("/test").status_code != 200:
+        raise RuntimeError("/test failed")
+    ready = time.perf_counter()
+    if warm:
+        app_module.warm_up()
+    warmed = time.perf_counter()
+
+    response = client.post("/ask", json={"question": question, "pdf_id": pdf_id})
+    if response.status_code != 200:
+        raise RuntimeError(f"/ask failed: {response.get_json()}")
+    return {"start_ms": (ready - start) * 1000, "warm_up_ms": (warmed - ready) * 1000,
+            "first_ask_ms": (time.perf_counter() - warmed) * 1000}
+
+def main():
+    request = json.load(sys.stdin)
+    result = cold_start(request["settings"], request["pdf_id"], request["question"], request["warm"])
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Recall-vs-size benchmark for the embedding storage modes in modules.embedding_store.
+
+Embeds a sample report once (or loads a cached .npz), then compares every storage
+configuration against exact full-precision search:
+
+    python -m bench.embedding_storage --pdf sample_report.pdf --cache report_embeddings.npz
+    python -m bench.embedding_storage --cache report_embeddings.npz --questions questions.txt
+
+Without --questions, a sample of the chunk embeddings is used as queries (each query
+excludes itself from the ground truth). Search is exact over the stored vectors, so the
+numbers isolate the loss from dimension reduction and quantization from HNSW effects.
+"""
+import argparse
+import types
+import numpy as np
+from typing import List, Dict, Any
+from modules import embedding_store
+
+def embed_pdf(pdf_path: str, questions: List[str]) -> Dict[str, np.ndarray]:
+    """Extract, chunk and embed a PDF with the configured Azure deployment."""
+    from modules import config
+    from modules.qna import initialize_clients
+    from modules.extract import (
+        split_pdf_bytes_to_pages, extract_text_and_images_from_pdf,
+        create_intelligent_chunks, generate_multimodal_embeddings
+    )
+
+    azure_client, _ = initialize_clients()
+    with open(pdf_path, "rb") as f:
+        pdf_bytes = f.read()
+
+    embeddings = []
+    for page_bytes in split_pdf_bytes_to_pages(pdf_bytes):
+        chunks = create_intelligent_chunks(extract_text_and_images_from_pdf(page_bytes))
+        # Full-size vectors regardless of the configured storage mode
+        full_config = types.SimpleNamespace(**{**vars(config), "EMBEDDING_STORAGE_MODE": "full"})
+        for block in generate_multimodal_embeddings(chunks, azure_client, full_config):
+            embeddings.append(block["embedding"])
+
+    result = {"embeddings": np.stack(embeddings).astype(np.float32)}
+    if questions:
+        response = azure_client.embeddings.create(
+            input=questions, model=config.AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT
+        )
+        result["queries"] = np.array([d.embedding for d in response.data], dtype=np.float32)
+    return result
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores per row, best first."""
+    idx = np.argpartition(-scores, kth=min(k, scores.shape[1] - 1), axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+def evaluate(embeddings: np.ndarray, queries: np.ndarray, self_ids: np.ndarray,
+             settings: Dict[str, Any], k: int) -> Dict[str, Any]:
+    """Recall@k of one storage configuration against exact full-precision search."""
+    cfg = types.SimpleNamespace(DATA_DIR=None, CHROMA_DB_PATH=".", **settings)
+    full = embedding_store.normalize_rows(embeddings)
+    q_full = embedding_store.normalize_rows(queries)
+
+    def mask_self(scores):
+        if self_ids is not None:
+            scores[np.arange(len(self_ids)), self_ids] = -np.inf
+        return scores
+
+    truth = top_k(mask_self(q_full @ full.T), k)
+
+    storage = embedding_store.get_storage_settings(cfg)
+    if storage["mode"] == "pca":
+        pca = embedding_store.fit_pca(embeddings, storage["dimensions"])
+        index = embedding_store.project_pca(embeddings, pca)
+        q_index = embedding_store.project_pca(queries, pca)
+    else:
+        index = embedding_store.to_index_vectors(embeddings, cfg)
+        q_index = embedding_store.to_index_vectors(queries, cfg)
+
+    # Chroma's cosine space compares normalized vectors
+    index = embedding_store.normalize_rows(index)
+    q_index = embedding_store.normalize_rows(q_index)
+
+    fetch = k * storage["overfetch"] if storage["exact_rerank"] else k
+    candidates = top_k(mask_self(q_index @ index.T), min(fetch, index.shape[0] - 1))
+
+    if storage["exact_rerank"]:
+        originals = embedding_store.normalize_rows(
+            embedding_store.dequantize(embedding_store.quantize(embeddings, storage["quantization"]))
+        )
+        reranked = []
+        for qi, cand in enumerate(candidates):
+            scores = originals[cand] @ q_full[qi]
+            reranked.append(cand[np.argsort(-scores)][:k])
+        candidates = np.array(reranked)
+    else:
+        candidates = candidates[:, :k]
+
+    hits = [len(set(t) & set(c)) / k for t, c in zip(truth, candidates)]
+    size = embedding_store.bytes_per_vector(cfg, embeddings.shape[1])
+    return {"recall": float(np.mean(hits)), **size}
+
+def storage_configurations(dims: List[int]) -> List[Dict[str, Any]]:
+    configurations = [{"EMBEDDING_STORAGE_MODE": "full"}]
+    for mode in ("dimensions", "pca"):
+        for d in dims:
+            configurations.append({"EMBEDDING_STORAGE_MODE": mode, "EMBEDDING_DIMENSIONS": d})
+            for quantization in embedding_store.QUANTIZATIONS:
+                configurations.append({
+                    "EMBEDDING_STORAGE_MODE": mode, "EMBEDDING_DIMENSIONS": d,
+                    "EMBEDDING_EXACT_RERANK": True, "EMBEDDING_QUANTIZATION": quantization
+                })
+    return configurations
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="Sample report to embed (requires modules/config.py)")
+    parser.add_argument("--cache", required=True, help=".npz file to read or write embeddings")
+    parser.add_argument("--questions", help="Text file with one question per line")
+    parser.add_argument("--dims", default="128,256,512,1024", help="Comma-separated reduced dimensions")
+    parser.add_argument("-k", type=int, default=5, help="Recall cut-off (matches query top_k)")
+    parser.add_argument("--num-queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.pdf:
+        questions = []
+        if args.questions:
+            with open(args.questions) as f:
+                questions = [line.strip() for line in f if line.strip()]
+        np.savez(args.cache, **embed_pdf(args.pdf, questions))
+
+    with np.load(args.cache) as data:
+        embeddings = data["embeddings"]
+        queries = data["queries"] if "queries" in data else None
+
+    self_ids = None
+    if queries is None:
+        rng = np.random.default_rng(0)
+        self_ids = rng.choice(len(embeddings), size=min(args.num_queries, len(embeddings)), replace=False)
+        queries = embeddings[self_ids]
+
+    dims = [d for d in (int(x) for x in args.dims.split(",")) if d < embeddings.shape[1]]
+    print(f"{len(embeddings)} chunks, {embeddings.shape[1]} dims, {len(queries)} queries, recall@{args.k}\n")
+    print(f"{'mode':<11}{'dims':>6}  {'rerank':<8}{'recall':>8}{'bytes/chunk':>13}{'vs full':>9}")
+
+    full_bytes = None
+    for settings in storage_configurations(dims):
+        if settings["EMBEDDING_STORAGE_MODE"] == "pca" and settings["EMBEDDING_DIMENSIONS"] > len(embeddings):
+            continue
+        result = evaluate(embeddings, queries, self_ids, settings, args.k)
+        full_bytes = full_bytes or result["total"]
+        rerank = settings.get("EMBEDDING_QUANTIZATION", "-") if settings.get("EMBEDDING_EXACT_RERANK") else "-"
+        print(f"{settings['EMBEDDING_STORAGE_MODE']:<11}"
+              f"{settings.get('EMBEDDING_DIMENSIONS', embeddings.shape[1]):>6}  "
+              f"{rerank:<8}{result['recall']:>8.3f}{result['total']:>13}"
+              f"{result['total'] / full_bytes:>8.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Local stand-in for the Azure OpenAI endpoints used by the backend.
+
+Serves deterministic embeddings, image descriptions and chat completions with
+configurable latency and 429 injection, and counts every call:
+
+    python -m bench.fake_azure --port 8799 --embed-latency-ms 40 --chat-latency-ms 800 --rate-429 0.05
+
+Point AZURE_OPENAI_ENDPOINT at http://127.0.0.1:8799 to use it. GET /stats returns
+the call counters; POST /stats/reset clears them.
+"""
+import re
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List
+
+DEFAULT_DIMENSIONS = 3072
+
+def fake_embedding(text: str, dimensions: int = DEFAULT_DIMENSIONS) -> np.ndarray:
+    """
+    Deterministic unit vector from hashed word unigrams and bigrams.
+
+    Texts sharing words get similar vectors, so retrieval over the fake index
+    still behaves like retrieval, just with lexical rather than semantic recall.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    words = re.findall(r"\w+", text.lower())
+    for gram in words + [" ".join(pair) for pair in zip(words, words[1:])]:
+        digest = hashlib.blake2b(gram.encode(), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def count_tokens(text: str) -> int:
+    """Rough token estimate (4 characters per token)."""
+    return max(1, len(text) // 4)
+
+class FakeAzureState:
+    """Latency, failure-injection settings and call counters shared by request handlers."""
+
+    def __init__(self, embed_latency_ms: float = 0.0, chat_latency_ms: float = 0.0,
+                 vision_latency_ms: float = 0.0, jitter: float = 0.1, rate_429: float = 0.0,
+                 retry_after_ms: int = 50, seed: int = 0):
+        self.latency_ms = {"embeddings": embed_latency_ms, "chat": chat_latency_ms, "vision": vision_latency_ms}
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after_ms = retry_after_ms
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {
+                "calls": {"embeddings": 0, "chat": 0, "vision": 0},
+                "inputs": {"embeddings": 0},
+                "throttled": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0
+            }
+
+    def should_throttle(self) -> bool:
+        with self.lock:
+            throttle = self.rate_429 > 0 and self.random.random() < self.rate_429
+            if throttle:
+                self.stats["throttled"] += 1
+            return throttle
+
+    def record(self, kind: str, prompt_tokens: int, completion_tokens: int = 0, inputs: int = 1):
+        with self.lock:
+            self.stats["calls"][kind] += 1
+            if kind == "embeddings":
+                self.stats["inputs"]["embeddings"] += inputs
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+
+    def sleep(self, kind: str):
+        latency = self.latency_ms[kind]
+        if latency > 0:
+            with self.lock:
+                factor = 1.0 + self.random.uniform(-self.jitter, self.jitter)
+            time.sleep(latency * factor / 1000.0)
+
+def embeddings_response(body: Dict[str, Any], state: FakeAzureState) -> Dict[str, Any]:
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    dimensions = body.get("dimensions") or DEFAULT_DIMENSIONS
+    data = []
+    for i, text in enumerate(inputs):
+        vector = fake_embedding(str(text), DEFAULT_DIMENSIONS)[:dimensions]
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        if body.get("encoding_format") == "base64":
+            embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+        else:
+            embedding = vector.tolist()
+        data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+    tokens = sum(count_tokens(str(text)) for text in inputs)
+    state.record("embeddings", tokens, inputs=len(inputs))
+    return {
+        "object": "list",
+        "data": data,
+        "model": "fake-embedding",
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    }
+
+def message_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(item.get("text", "") for item in content if item.get("type") == "text")
+    return "\n".join(parts)
+
+def has_image(messages: List[Dict[str, Any]]) -> bool:
+    return any(
+        isinstance(m.get("content"), list) and any(item.get("type") == "image_url" for item in m["content"])
+        for m in messages
+    )
+
+def chat_response(body: Dict[str, Any], state: FakeAzureState, kind: str) -> Dict[str, Any]:
+    messages = body.get("messages", [])
+    prompt = message_text(messages)
+
+    if kind == "vision":
+        image_url = next(
+            item["image_url"]["url"] for m in messages if isinstance(m.get("content"), list)
+            for item in m["content"] if item.get("type") == "image_url"
+        )
+        digest = hashlib.sha1(image_url.encode()).hexdigest()[:8]
+        content = f"A chart or photograph (image {digest}) showing financial performance figures and trends."
+    else:
+        pages = re.findall(r"page (\d+)", prompt)
+        cited = ", ".join(f"Page {p}" for p in dict.fromkeys(pages[:3])) or "Page 1"
+        content = (
+            "Based on the provided context, the report discusses the requested figures.\n\n"
+            "Confidence: 0.8\n\n"
+            f"References: {cited}"
+        )
+
+    prompt_tokens = count_tokens(prompt) + (765 if kind == "vision" else 0)  # high-detail image tiles
+    completion_tokens = count_tokens(content)
+    state.record(kind, prompt_tokens, completion_tokens)
+    return {
+        "id": f"chatcmpl-fake-{hashlib.sha1(prompt.encode()).hexdigest()[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "fake-gpt-4o",
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content}
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+def make_handler(state: FakeAzureState):
+    class FakeAzureHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.startswith("/stats"):
+                with state.lock:
+                    self._send_json(200, json.loads(json.dumps(state.stats)))
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+
+            if self.path.startswith("/stats/reset"):
+                state.reset()
+                return self._send_json(200, {"status": "ok"})
+
+            if self.path.split("?")[0].endswith("/embeddings"):
+                kind = "embeddings"
+            elif self.path.split("?")[0].endswith("/chat/completions"):
+                kind = "vision" if has_image(body.get("messages", [])) else "chat"
+            else:
+                return self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+            if state.should_throttle():
+                return self._send_json(
+                    429,
+                    {"error": {"code": "429", "message": "Rate limit is exceeded. Try again later."}},
+                    {"retry-after-ms": str(state.retry_after_ms)}
+                )
+
+            state.sleep(kind)
+            if kind == "embeddings":
+                self._send_json(200, embeddings_response(body, state))
+            else:
+                self._send_json(200, chat_response(body, state, kind))
+
+    return FakeAzureHandler
+
+class FakeAzureServer:
+    """Run the fake endpoint on a background thread (for use from the benchmark runner)."""
+
+    def __init__(self, port: int = 0, **state_kwargs):
+        self.state = FakeAzureState(**state_kwargs)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), make_handler(self.state))
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=0.0)
+    parser.add_argument("--vision-latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative latency jitter (0.1 = +/-10%%)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after-ms", type=int, default=50)
+    args = parser.parse_args()
+
+    server = FakeAzureServer(
+        port=args.port,
+        embed_latency_ms=args.embed_latency_ms,
+        chat_latency_ms=args.chat_latency_ms,
+        vision_latency_ms=args.vision_latency_ms,
+        jitter=args.jitter,
+        rate_429=args.rate_429,
+        retry_after_ms=args.retry_after_ms
+    )
+    print(f"Fake Azure OpenAI listening on {server.endpoint}")
+    server.httpd.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Synthetic annual-report PDFs for benchmarking.
+
+Each page mixes the layouts the extractor handles: a heading, two-column
+narrative text, a ruled financial table and (on most pages) an embedded chart
+image. Generation is deterministic so runs are comparable:
+
+    python -m bench.pdfs --out bench/generated --pages 5,40,200
+
+Real reports can be benchmarked too by placing them in bench/samples/.
+"""
+import os
+import glob
+import random
+import argparse
+import fitz  # PyMuPDF
+from typing import List, Dict
+
+SIZES = {"small": 5, "medium": 40, "large": 200}
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "samples")
+
+SEGMENTS = ["Retail Banking", "Wealth Management", "Digital Services", "Manufacturing", "Logistics"]
+METRICS = ["Revenue", "Operating profit", "Operating margin", "Net income", "Free cash flow", "Capital expenditure"]
+SENTENCES = [
+    "{segment} delivered {metric_l} growth of {pct}% compared with the prior year.",
+    "The Board remains focused on disciplined capital allocation and sustainable returns.",
+    "Our {segment} strategy prioritises customer experience, efficiency and risk management.",
+    "{metric} for the year reached {amount} million, reflecting strong demand across markets.",
+    "We continued to invest in technology, talent and responsible business practices.",
+    "Headwinds from inflation and supply constraints were partly offset by pricing actions.",
+    "The Group's liquidity position remained robust with ample headroom under covenants."
+]
+
+def paragraph(rng: random.Random, sentences: int = 6) -> str:
+    parts = []
+    for _ in range(sentences):
+        metric = rng.choice(METRICS)
+        parts.append(rng.choice(SENTENCES).format(
+            segment=rng.choice(SEGMENTS), metric=metric, metric_l=metric.lower(),
+            pct=rng.randint(1, 25), amount=f"{rng.randint(100, 9000):,}"
+        ))
+    return " ".join(parts)
+
+def chart_pixmap(rng: random.Random, width: int = 240, height: int = 140) -> fitz.Pixmap:
+    """A simple bar-chart-like raster image."""
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), False)
+    pixmap.set_rect(pixmap.irect, (250, 248, 240))
+    bar_width = width // 8
+    for i in range(6):
+        bar_height = rng.randint(height // 5, height - 10)
+        x0 = 10 + i * (bar_width + 6)
+        pixmap.set_rect(fitz.IRect(x0, height - bar_height, x0 + bar_width, height - 4),
+                        (40 + 30 * i, 90, 160 - 15 * i))
+    return pixmap
+
+def draw_table(page: fitz.Page, rng: random.Random, top: float) -> float:
+    """Draw a ruled metrics-by-period table and return its bottom y."""
+    periods = ["FY24", "FY23", "FY22"]
+    x_positions = [50, 250, 350, 450, 545]
+    row_height = 16
+    rows = [["(in millions)"] + periods] + [
+        [metric] + [f"{rng.randint(50, 9000):,}" if "margin" not in metric else f"{rng.uniform(5, 30):.1f}%"
+                    for _ in periods]
+        for metric in rng.sample(METRICS, 5)
+    ]
+    for r, row in enumerate(rows):
+        y = top + r * row_height
+        for c, cell in enumerate(row):
+            page.insert_text((x_positions[c] + 3, y + 12), cell, fontsize=8)
+        page.draw_line((x_positions[0], y), (x_positions[-1], y), width=0.5)
+    bottom = top + len(rows) * row_height
+    page.draw_line((x_positions[0], bottom), (x_positions[-1], bottom), width=0.5)
+    for x in x_positions:
+        page.draw_line((x, top), (x, bottom), width=0.5)
+    return bottom
+
+def make_report(path: str, num_pages: int, seed: int = 0):
+    """Write a synthetic annual report with num_pages pages to path."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_num in range(num_pages):
+        page = doc.new_page(width=595, height=842)  # A4
+        page.insert_text((50, 60), f"Annual Report {2024} - Section {page_num + 1}", fontsize=16)
+
+        column_width = (595 - 100 - 20) / 2
+        for column in range(2):
+            x0 = 50 + column * (column_width + 20)
+            page.insert_textbox(fitz.Rect(x0, 80, x0 + column_width, 420), paragraph(rng, 9), fontsize=9)
+
+        bottom = draw_table(page, rng, 440)
+
+        if page_num % 4 != 3:
+            page.insert_image(fitz.Rect(50, bottom + 20, 290, bottom + 160), pixmap=chart_pixmap(rng))
+            page.insert_textbox(fitz.Rect(300, bottom + 20, 545, bottom + 160),
+                                "Figure: " + paragraph(rng, 2), fontsize=8)
+
+    doc.save(path, deflate=True)
+    doc.close()
+
+def benchmark_pdfs(out_dir: str, sizes: Dict[str, int] = None) -> List[Dict[str, str]]:
+    """Generate (or reuse) the synthetic reports and list any real samples."""
+    os.makedirs(out_dir, exist_ok=True)
+    pdfs = []
+    for name, pages in (sizes or SIZES).items():
+        path = os.path.join(out_dir, f"synthetic_{name}_{pages}p.pdf")
+        if not os.path.exists(path):
+            make_report(path, pages)
+        pdfs.append({"name": f"synthetic-{name}", "path": path})
+    for path in sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.pdf"))):
+        pdfs.append({"name": os.path.splitext(os.path.basename(path))[0], "path": path})
+    return pdfs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(__file__), "generated"))
+    parser.add_argument("--pages", default=",".join(str(p) for p in SIZES.values()))
+    args = parser.parse_args()
+    for pages in (int(p) for p in args.pages.split(",")):
+        path = os.path.join(args.out, f"synthetic_{pages}p.pdf")
+        os.makedirs(args.out, exist_ok=True)
+        make_report(path, pages)
+        print(f"Wrote {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Offline evaluation of the reranking stage on question/page-label pairs.
+
+Labels are JSONL, one question per line:
+
+    {"question": "What was FY24 operating margin?", "pages": [42], "pdf_id": "report-2024"}
+
+Candidates are retrieved once through query_vector_db (wide top_k) and cached, so
+reranker weights and budgets can be tuned without further API calls:
+
+    python -m bench.rerank_eval --labels labels.jsonl --candidates candidates.json
+    python -m bench.rerank_eval --labels labels.jsonl --candidates candidates.json --reranker cross_encoder
+
+Reports page hit rate and MRR of the chunks that would be sent to the prompt, for
+similarity order vs the reranker, plus reranker latency against RERANK_BUDGET_MS.
+"""
+import os
+import json
+import time
+import types
+import argparse
+import numpy as np
+from typing import List, Dict, Any
+from modules.rerank import get_rerank_settings, rerank
+
+def load_labels(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def retrieve_candidates(labels: List[Dict[str, Any]], top_k: int) -> List[List[Dict[str, Any]]]:
+    """Run retrieval for every labeled question with the configured backend."""
+    from modules.qna import initialize_clients, query_vector_db
+    azure_client, chroma_client = initialize_clients()
+    return [
+        query_vector_db(label["question"], label.get("pdf_id"), azure_client, chroma_client, top_k=top_k)
+        for label in labels
+    ]
+
+def page_metrics(selected: List[Dict[str, Any]], pages: List[int]) -> Dict[str, float]:
+    """Hit (any labeled page selected) and reciprocal rank of the first labeled page."""
+    wanted = {int(p) for p in pages}
+    for rank, chunk in enumerate(selected, start=1):
+        if int(chunk["metadata"].get("page_num", -1)) in wanted:
+            return {"hit": 1.0, "rr": 1.0 / rank}
+    return {"hit": 0.0, "rr": 0.0}
+
+def summarize(name: str, rows: List[Dict[str, float]], latencies_ms: List[float], budget_ms: float):
+    hit = np.mean([r["hit"] for r in rows])
+    mrr = np.mean([r["rr"] for r in rows])
+    line = f"{name:<16}hit@n={hit:.3f}  mrr@n={mrr:.3f}"
+    if latencies_ms:
+        p50, p95 = np.percentile(latencies_ms, [50, 95])
+        over = sum(1 for l in latencies_ms if l > budget_ms)
+        line += f"  latency p50={p50:.2f}ms p95={p95:.2f}ms max={max(latencies_ms):.2f}ms  over budget={over}"
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", required=True, help="JSONL file of question/page labels")
+    parser.add_argument("--candidates", required=True, help="JSON cache of retrieved candidates")
+    parser.add_argument("--reranker", choices=["features", "cross_encoder"], default=None)
+    parser.add_argument("--top-n", type=int, default=None)
+    args = parser.parse_args()
+
+    from modules import config
+    overrides = {k: v for k, v in {"RERANKER": args.reranker, "RERANK_TOP_N": args.top_n}.items() if v}
+    eval_config = types.SimpleNamespace(**{**vars(config), **overrides})
+    settings = get_rerank_settings(eval_config)
+
+    labels = load_labels(args.labels)
+    if os.path.exists(args.candidates):
+        with open(args.candidates) as f:
+            all_candidates = json.load(f)
+    else:
+        all_candidates = retrieve_candidates(labels, settings["candidates"])
+        with open(args.candidates, "w") as f:
+            json.dump(all_candidates, f)
+
+    baseline, reranked, latencies = [], [], []
+    for label, candidates in zip(labels, all_candidates):
+        baseline.append(page_metrics(candidates[:settings["top_n"]], label["pages"]))
+
+        start = time.perf_counter()
+        selected = rerank(label["question"], [dict(c) for c in candidates], eval_config)
+        latencies.append((time.perf_counter() - start) * 1000)
+        reranked.append(page_metrics(selected, label["pages"]))
+
+    print(f"{len(labels)} questions, {settings['candidates']} candidates -> top {settings['top_n']}, "
+          f"budget {settings['budget_ms']:.0f}ms\n")
+    summarize("similarity", baseline, [], settings["budget_ms"])
+    summarize(settings["reranker"], reranked, latencies, settings["budget_ms"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+End-to-end ingest and query benchmark against the fake Azure OpenAI backend.
+
+Starts bench.fake_azure in-process, generates synthetic reports (plus any PDFs in
+bench/samples/), ingests each one through POST /process_pdf in a fresh process and
+then load-tests POST /ask:
+
+    python -m bench.run
+    python -m bench.run --embed-latency-ms 40 --chat-latency-ms 900 --rate-429 0.02 --json results.json
+    python -m bench.run --compare baseline.json --tolerance 0.2
+
+Reports pages/sec, chunks/sec, API calls per page, peak RSS, /ask p50/p95/p99 and
+cold start: time from importing the app to its first /test response, and the first
+/ask latency of a fresh process with and without app.warm_up().
+With --compare, exits non-zero when a metric regresses beyond the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import resource
+import subprocess
+import numpy as np
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+from typing import Dict, Any, List
+from bench.cold_start import install_config
+from bench.fake_azure import FakeAzureServer
+from bench.pdfs import benchmark_pdfs, SIZES, METRICS
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = [f"What was the {metric.lower()} in {period}?" for metric in METRICS for period in ("FY24", "FY23")] + [
+    "How did Retail Banking perform this year?",
+    "What does the Board say about capital allocation?",
+    "Summarise the liquidity position of the Group."
+]
+
+# Metrics compared with --compare and whether higher is better
+TRACKED_METRICS = {
+    "pages_per_sec": True,
+    "chunks_per_sec": True,
+    "api_calls_per_page": False,
+    "peak_rss_mb": False,
+    "ask_p50_ms": False,
+    "ask_p95_ms": False,
+    "ask_p99_ms": False,
+    "cold_start_ms": False,
+    "cold_first_ask_ms": False
+}
+
+def bench_config(endpoint: str, work_dir: str, overrides: Dict[str, Any]) -> Dict[str, Any]:
+    settings = {
+        "AZURE_OPENAI_API_KEY": "fake-key",
+        "AZURE_OPENAI_ENDPOINT": endpoint,
+        "AZURE_OPENAI_API_VERSION": "2024-10-21",
+        "AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT": "text-embedding-3-large",
+        "AZURE_OPENAI_VISION_DEPLOYMENT": "gpt-4o",
+        "CHROMA_DB_PATH": os.path.join(work_dir, "chroma"),
+        "DATA_DIR": os.path.join(work_dir, "data")
+    }
+    settings.update(overrides)
+    return settings
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def ingest_one(settings: Dict[str, Any], pdf_path: str, pdf_id: str) -> Dict[str, Any]:
+    """Child process: upload one PDF through the Flask route."""
+    install_config(settings)
+    from app import app
+
+    client = app.test_client()
+    start = time.perf_counter()
+    with open(pdf_path, "rb") as f:
+        response = client.post(
+            "/process_pdf",
+            data={"file": (f, os.path.basename(pdf_path)), "pdf_id": pdf_id},
+            content_type="multipart/form-data"
+        )
+    elapsed = time.perf_counter() - start
+    payload = response.get_json()
+    if response.status_code != 200:
+        raise RuntimeError(f"Ingest of {pdf_path} failed: {payload}")
+    from modules import metrics
+    return {"elapsed": elapsed, "details": payload["details"], "peak_rss_mb": peak_rss_mb(),
+            "stages": metrics.snapshot()["stages"]}
+
+def ask_load(settings: Dict[str, Any], pdf_id: str, requests: int, concurrency: int) -> Dict[str, Any]:
+    """Child process: fire /ask requests with a thread pool and collect latencies."""
+    install_config(settings)
+    from app import app
+
+    def ask(i: int) -> float:
+        client = app.test_client()
+        start = time.perf_counter()
+        response = client.post("/ask", json={"question": QUESTIONS[i % len(QUESTIONS)], "pdf_id": pdf_id})
+        latency = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f"/ask failed: {response.get_json()}")
+        return latency
+
+    ask(0)  # Warm up clients and the index
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(ask, range(requests)))
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    from modules import metrics
+    return {"ask_p50_ms": p50, "ask_p95_ms": p95, "ask_p99_ms": p99, "peak_rss_mb": peak_rss_mb(),
+            "stages": metrics.snapshot()["stages"]}
+
+def cold_start(settings: Dict[str, Any], pdf_id: str, warm: bool) -> Dict[str, Any]:
+    """
+    Time startup and the first /ask of a fresh interpreter, optionally warmed up first.
+
+    Runs bench.cold_start with subprocess rather than a spawned worker: unpickling
+    a function from this module would import numpy and PyMuPDF before the app.
+    """
+    request = json.dumps({"settings": settings, "pdf_id": pdf_id, "question": QUESTIONS[0], "warm": warm})
+    completed = subprocess.run([sys.executable, "-m", "bench.cold_start"], input=request,
+                               capture_output=True, text=True, cwd=BACKEND_DIR)
+    if completed.returncode != 0:
+        raise RuntimeError(f"bench.cold_start failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def in_child(fn, *args):
+    """Run fn in a fresh spawned process so imports, caches and peak RSS are per measurement."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(fn, *args).result()
+
+def fetch_stats(endpoint: str) -> Dict[str, Any]:
+    with urllib.request.urlopen(f"{endpoint}/stats") as response:
+        return json.load(response)
+
+def run(args) -> List[Dict[str, Any]]:
+    work_dir = tempfile.mkdtemp(prefix="docuwrangler-bench-")
+    sizes = {name: pages for name, pages in SIZES.items() if name in args.sizes.split(",")}
+    pdfs = benchmark_pdfs(args.pdf_dir, sizes)
+    results = []
+
+    with FakeAzureServer(
+        embed_latency_ms=args.embed_latency_ms,
+        chat_latency_ms=args.chat_latency_ms,
+        vision_latency_ms=args.vision_latency_ms,
+        rate_429=args.rate_429
+    ) as server:
+        settings = bench_config(server.endpoint, work_dir, json.loads(args.config))
+        try:
+            for pdf in pdfs:
+                server.state.reset()
+                ingest = in_child(ingest_one, settings, pdf["path"], pdf["name"])
+                stats = fetch_stats(server.endpoint)
+                details = ingest["details"]
+                pages = details["num_pages"]
+
+                server.state.reset()
+                ask = in_child(ask_load, settings, pdf["name"], args.ask_requests, args.concurrency)
+                cold = in_child(cold_start, settings, pdf["name"], False)
+                warmed = in_child(cold_start, settings, pdf["name"], True)
+
+                api_calls = stats["calls"]["embeddings"] + stats["calls"]["vision"]
+                results.append({
+                    "name": pdf["name"],
+                    "pages": pages,
+                    "chunks": details["num_chunks"],
+                    "ingest_sec": ingest["elapsed"],
+                    "pages_per_sec": pages / ingest["elapsed"],
+                    "chunks_per_sec": details["num_chunks"] / ingest["elapsed"],
+                    "api_calls_per_page": api_calls / pages,
+                    "embedding_inputs_per_page": stats["inputs"]["embeddings"] / pages,
+                    "vision_calls_per_page": stats["calls"]["vision"] / pages,
+                    "throttled": stats["throttled"],
+                    "peak_rss_mb": ingest["peak_rss_mb"],
+                    **{k: v for k, v in ask.items() if k.startswith("ask_")},
+                    "cold_start_ms": cold["start_ms"],
+                    "cold_first_ask_ms": cold["first_ask_ms"],
+                    "warm_up_ms": warmed["warm_up_ms"],
+                    "warmed_first_ask_ms": warmed["first_ask_ms"],
+                    "ingest_stages": ingest["stages"],
+                    "ask_stages": ask["stages"]
+                })
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def print_table(results: List[Dict[str, Any]]):
+    header = f"{'document':<22}{'pages':>6}{'pages/s':>9}{'chunks/s':>10}{'calls/pg':>10}{'429s':>6}" \
+             f"{'RSS MB':>8}{'ask p50':>9}{'p95':>8}{'p99':>8}{'start':>7}{'1st ask':>9}{'warm-up':>9}{'warmed':>8}"
+    print(header)
+    for r in results:
+        print(f"{r['name']:<22}{r['pages']:>6}{r['pages_per_sec']:>9.2f}{r['chunks_per_sec']:>10.2f}"
+              f"{r['api_calls_per_page']:>10.2f}{r['throttled']:>6}{r['peak_rss_mb']:>8.0f}"
+              f"{r['ask_p50_ms']:>9.0f}{r['ask_p95_ms']:>8.0f}{r['ask_p99_ms']:>8.0f}"
+              f"{r['cold_start_ms']:>7.0f}{r['cold_first_ask_ms']:>9.0f}{r['warm_up_ms']:>9.0f}{r['warmed_first_ask_ms']:>8.0f}")
+
+    print("\nStage breakdown (total seconds, mean ms)")
+    for r in results:
+        for phase in ("ingest_stages", "ask_stages"):
+            stages = sorted(r[phase].items(), key=lambda item: item[1]["total_sec"], reverse=True)
+            summary = ", ".join(f"{name} {s['total_sec']:.2f}s/{s['mean_ms']:.1f}ms" for name, s in stages)
+            print(f"{r['name']:<22}{phase.split('_')[0]:<8}{summary}")
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> List[str]:
+    """List metrics that regressed by more than tolerance relative to a saved run."""
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        base = baseline.get(r["name"])
+        if not base:
+            continue
+        for metric, higher_is_better in TRACKED_METRICS.items():
+            if metric not in r or metric not in base or not base[metric]:
+                continue
+            change = (r[metric] - base[metric]) / base[metric]
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{r['name']}: {metric} {base[metric]:.2f} -> {r[metric]:.2f} ({change:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(SIZES), help="Synthetic sizes to run (small,medium,large)")
+    parser.add_argument("--pdf-dir", default=os.path.join(os.path.dirname(__file__), "generated"))
+    parser.add_argument("--embed-latency-ms", type=float, default=30.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0)
+    parser.add_argument("--vision-latency-ms", type=float, default=500.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--ask-requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--config", default="{}", help="JSON object of extra config settings")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run(args)
+    print_table(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
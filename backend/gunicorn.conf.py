@@ -0,0 +1,63 @@
+# gunicorn settings for wsgi.py; GUNICORN_CMD_ARGS or command-line flags override them
+import os
+import time
+import shutil
+import subprocess
+from urllib.parse import urlparse
+
+wsgi_app = "wsgi:app"
+bind = os.environ.get("BIND", f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+workers = int(os.environ.get("WEB_CONCURRENCY", len(os.sched_getaffinity(0))))
+
+# Requests mostly wait on Azure OpenAI, so each worker serves several at once
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+preload_app = True
+# Uploads are extracted and embedded within the request
+timeout = 600
+graceful_timeout = 30
+
+# With config.CHROMA_SERVER_URL and CHROMA_SERVER_START, the master also runs the
+# vector-store server that owns CHROMA_DB_PATH for all workers (see modules.vector_store)
+_chroma_server = None
+
+def on_starting(server):
+    global _chroma_server
+    from modules import config, metrics
+    from modules.utils import get_data_dir
+    # Workers share one metrics directory so any of them can answer /metrics for all
+    metrics.enable_multiprocess(getattr(config, "METRICS_MULTIPROC_DIR", None) or get_data_dir(config, "metrics"),
+                                clear=True)
+
+    url = getattr(config, "CHROMA_SERVER_URL", None)
+    if not (url and getattr(config, "CHROMA_SERVER_START", False)):
+        return
+
+    parsed = urlparse(url)
+    _chroma_server = subprocess.Popen([
+        shutil.which("chroma") or "chroma", "run", "--path", config.CHROMA_DB_PATH,
+        "--host", parsed.hostname, "--port", str(parsed.port or 8000)
+    ])
+    import chromadb
+    deadline = time.time() + 60
+    while True:
+        try:
+            chromadb.HttpClient(host=parsed.hostname, port=parsed.port or 8000).heartbeat()
+            break
+        except Exception:
+            if _chroma_server.poll() is not None or time.time() > deadline:
+                raise RuntimeError(f"Chroma server at {url} did not start")
+            time.sleep(0.5)
+    server.log.info("Chroma server listening at %s (pid %s)", url, _chroma_server.pid)
+
+def on_exit(server):
+    if _chroma_server is not None:
+        _chroma_server.terminate()
+        _chroma_server.wait(timeout=30)
+
+def post_worker_init(worker):
+    from modules import config
+    if getattr(config, "WARM_UP", False):
+        from app import warm_up
+        warm_up()
@@ -0,0 +1,65 @@
+import time
+import multiprocessing
+from typing import Optional
+
+# Optional limit on Azure OpenAI calls shared by every process of a bulk ingest.
+# API call sites call acquire() before each request; without an installed budget
+# (the web app) it is a no-op.
+
+class ApiBudgetExhausted(RuntimeError):
+    """Raised when the total API-call budget of a run has been used up."""
+
+class SharedApiBudget:
+    """
+    Token bucket plus total cap backed by multiprocessing shared memory.
+
+    Create it in the parent and pass it to pool workers through the pool
+    initializer (install_budget) so every worker draws from the same budget.
+    """
+
+    def __init__(self, calls_per_minute: Optional[float] = None, max_calls: Optional[int] = None, context=None):
+        context = context or multiprocessing.get_context()
+        self.calls_per_minute = calls_per_minute
+        self.max_calls = max_calls
+        self._lock = context.Lock()
+        self._tokens = context.Value("d", 1.0, lock=False)
+        self._refilled_at = context.Value("d", time.time(), lock=False)
+        self._used = context.Value("q", 0, lock=False)
+
+    @property
+    def used(self) -> int:
+        return self._used.value
+
+    def acquire(self, kind: str):
+        """Block until a call is allowed; raise ApiBudgetExhausted past max_calls."""
+        while True:
+            with self._lock:
+                if self.max_calls is not None and self._used.value >= self.max_calls:
+                    raise ApiBudgetExhausted(f"API-call budget of {self.max_calls} calls is exhausted")
+                if not self.calls_per_minute:
+                    self._used.value += 1
+                    return
+
+                # Refill, allowing a burst of at most one second's worth of calls
+                now = time.time()
+                rate = self.calls_per_minute / 60.0
+                capacity = max(1.0, rate)
+                self._tokens.value = min(capacity, self._tokens.value + (now - self._refilled_at.value) * rate)
+                self._refilled_at.value = now
+                if self._tokens.value >= 1.0:
+                    self._tokens.value -= 1.0
+                    self._used.value += 1
+                    return
+                wait = (1.0 - self._tokens.value) / rate
+            time.sleep(wait)
+
+_budget: Optional[SharedApiBudget] = None
+
+def install_budget(budget: Optional[SharedApiBudget]):
+    """Use budget for every API call made by this process (pool initializer)."""
+    global _budget
+    _budget = budget
+
+def acquire(kind: str):
+    if _budget is not None:
+        _budget.acquire(kind)
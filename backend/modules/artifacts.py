@@ -0,0 +1,221 @@
+import os
+import json
+import base64
+import shutil
+import tempfile
+from typing import List, Dict, Any, Optional
+import numpy as np
+from modules.utils import get_data_dir
+from modules.vision import save_image, image_path
+
+# Per-page extraction output persisted at ingest (config.PERSIST_ARTIFACTS, on by
+# default) so documents can be re-chunked and re-embedded without PyMuPDF.
+#
+# DATA_DIR/artifacts/<aa>/<sha256>/, keyed by the PDF's content hash:
+#   meta.json    page sizes, images (hash, mime type, xref, caption) and table rows
+#   strings.bin  UTF-8 text of every block and word, addressed by (offset, length)
+#   blocks.npy   extracted content blocks (text regions and images) with bboxes
+#   words.npy    every word with its bbox and block/line/word numbers
+#   layout.npy   PyMuPDF layout blocks (bbox, block number, text/image type)
+# The .npy files are fixed-size records and are memory-mapped when read.
+
+ARTIFACT_VERSION = 1
+
+TEXT, IMAGE = 0, 1
+HALVES = {None: 0, "left": 1, "right": 2}
+HALF_NAMES = {v: k for k, v in HALVES.items()}
+
+BOX = [("x0", "<f4"), ("y0", "<f4"), ("x1", "<f4"), ("y1", "<f4")]
+STRING = [("offset", "<u8"), ("length", "<u4")]
+BLOCK_DTYPE = np.dtype([("page", "<u4"), ("kind", "u1"), *BOX, ("full_page", "i1"), ("half", "u1"),
+                        *STRING, ("image", "<i4")])
+WORD_DTYPE = np.dtype([("page", "<u4"), *BOX, ("block", "<u4"), ("line", "<u4"), ("word", "<u4"), *STRING])
+LAYOUT_DTYPE = np.dtype([("page", "<u4"), *BOX, ("block", "<u4"), ("type", "u1")])
+
+def _page_rows(rows: np.ndarray, page_num: int) -> np.ndarray:
+    """Rows of one page; records are written in page order."""
+    start, end = np.searchsorted(rows["page"], [page_num, page_num + 1])
+    return rows[start:end]
+
+def artifact_dir(config, sha256: str) -> str:
+    return os.path.join(get_data_dir(config, "artifacts", sha256[:2]), sha256)
+
+def has_artifacts(config, sha256: str) -> bool:
+    meta_path = os.path.join(artifact_dir(config, sha256), "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        return json.load(f).get("version") == ARTIFACT_VERSION
+
+def capture_page(config, page, page_idx: int, content_blocks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Collect one page's extraction output for write_artifacts.
+
+    Image bytes go to the shared image store right away, so the captured page
+    only holds their hashes (and stays small in bulk-ingest checkpoints).
+    """
+    blocks = []
+    for block in content_blocks:
+        block = {key: value for key, value in block.items() if key != "embedding"}
+        if block["type"] == "image":
+            block["image_sha256"] = save_image(config, block)
+            del block["content"]
+        blocks.append(block)
+    return {
+        "page_num": page_idx + 1,
+        "width": page.rect.width,
+        "height": page.rect.height,
+        "words": [tuple(w[:8]) for w in page.get_text("words")],
+        "layout": [(b[0], b[1], b[2], b[3], b[5], b[6]) for b in page.get_text("blocks")],
+        "blocks": blocks
+    }
+
+def write_artifacts(config, sha256: str, pages: List[Dict[str, Any]], tables: List[List[Dict[str, Any]]]):
+    """Write the captured pages of a document (and its table rows per page) atomically."""
+    strings = bytearray()
+
+    def add_string(text: str):
+        data = text.encode("utf-8")
+        offset = len(strings)
+        strings.extend(data)
+        return offset, len(data)
+
+    images, block_rows, word_rows, layout_rows = [], [], [], []
+    for page in pages:
+        page_num = page["page_num"]
+        for block in page["blocks"]:
+            position = block["position"]
+            box = (position["x0"], position["y0"], position["x1"], position["y1"])
+            if block["type"] == "image":
+                images.append({
+                    "sha256": block["image_sha256"],
+                    "mime_type": block["mime_type"],
+                    "xref": block.get("xref"),
+                    "caption": block.get("caption", "")
+                })
+                block_rows.append((page_num, IMAGE, *box, -1, 0, 0, 0, len(images) - 1))
+            else:
+                full_page = -1 if "is_full_page" not in block else int(block["is_full_page"])
+                block_rows.append((page_num, TEXT, *box, full_page, HALVES[block.get("half")],
+                                   *add_string(block["content"]), -1))
+        for x0, y0, x1, y1, text, block_no, line_no, word_no in page["words"]:
+            word_rows.append((page_num, x0, y0, x1, y1, block_no, line_no, word_no, *add_string(text)))
+        for x0, y0, x1, y1, block_no, block_type in page["layout"]:
+            layout_rows.append((page_num, x0, y0, x1, y1, block_no, block_type))
+
+    meta = {
+        "version": ARTIFACT_VERSION,
+        "sha256": sha256,
+        "num_pages": len(pages),
+        "pages": [{"width": page["width"], "height": page["height"]} for page in pages],
+        "images": images,
+        "tables": tables
+    }
+
+    target = artifact_dir(config, sha256)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(target), suffix=".tmp")
+    np.save(os.path.join(tmp_dir, "blocks.npy"), np.array(block_rows, dtype=BLOCK_DTYPE))
+    np.save(os.path.join(tmp_dir, "words.npy"), np.array(word_rows, dtype=WORD_DTYPE))
+    np.save(os.path.join(tmp_dir, "layout.npy"), np.array(layout_rows, dtype=LAYOUT_DTYPE))
+    with open(os.path.join(tmp_dir, "strings.bin"), "wb") as f:
+        f.write(strings)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+
+class DocumentArtifacts:
+    """Read access to a document's artifacts; arrays are memory-mapped."""
+
+    def __init__(self, config, sha256: str):
+        self.config = config
+        self.directory = artifact_dir(config, sha256)
+        with open(os.path.join(self.directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.blocks = np.load(os.path.join(self.directory, "blocks.npy"), mmap_mode="r")
+        self.words = np.load(os.path.join(self.directory, "words.npy"), mmap_mode="r")
+        self.layout = np.load(os.path.join(self.directory, "layout.npy"), mmap_mode="r")
+        self.strings = np.memmap(os.path.join(self.directory, "strings.bin"), dtype=np.uint8, mode="r") \
+            if os.path.getsize(os.path.join(self.directory, "strings.bin")) else np.zeros(0, dtype=np.uint8)
+
+    @property
+    def num_pages(self) -> int:
+        return self.meta["num_pages"]
+
+    def _string(self, row) -> str:
+        offset, length = int(row["offset"]), int(row["length"])
+        return bytes(self.strings[offset:offset + length]).decode("utf-8")
+
+    def page_size(self, page_num: int):
+        page = self.meta["pages"][page_num - 1]
+        return page["width"], page["height"]
+
+    def page_words(self, page_num: int) -> List[tuple]:
+        """Words of a page as PyMuPDF "words" tuples."""
+        rows = _page_rows(self.words, page_num)
+        return [(float(r["x0"]), float(r["y0"]), float(r["x1"]), float(r["y1"]), self._string(r),
+                 int(r["block"]), int(r["line"]), int(r["word"])) for r in rows]
+
+    def page_layout(self, page_num: int) -> List[tuple]:
+        """Layout blocks of a page as (x0, y0, x1, y1, block_no, block_type)."""
+        rows = _page_rows(self.layout, page_num)
+        return [(float(r["x0"]), float(r["y0"]), float(r["x1"]), float(r["y1"]), int(r["block"]), int(r["type"]))
+                for r in rows]
+
+    def page_tables(self, page_num: int) -> List[Dict[str, Any]]:
+        tables = self.meta["tables"][page_num - 1]
+        for table in tables:
+            for row in table["rows"]:
+                row["bbox"] = tuple(row["bbox"])
+        return tables
+
+    def image_block(self, row) -> Dict[str, Any]:
+        image = self.meta["images"][int(row["image"])]
+        with open(image_path(self.config, image["sha256"], image["mime_type"]), "rb") as f:
+            content = base64.b64encode(f.read()).decode("utf-8")
+        block = {
+            "type": "image",
+            "content": content,
+            "page_num": int(row["page"]),
+            "position": {"x0": float(row["x0"]), "y0": float(row["y0"]), "x1": float(row["x1"]), "y1": float(row["y1"])},
+            "mime_type": image["mime_type"],
+            "caption": image["caption"]
+        }
+        if image["xref"] is not None:
+            block["xref"] = image["xref"]
+        return block
+
+    def page_blocks(self, page_num: int, text_from_words: bool = False) -> List[Dict[str, Any]]:
+        """
+        Content blocks of a page as extract_page_content returned them at ingest.
+
+        With text_from_words, text blocks are rebuilt from the stored words instead
+        (see extract.text_blocks_from_words), for experimenting with layout heuristics.
+        """
+        rows = _page_rows(self.blocks, page_num)
+        blocks = [self.image_block(r) for r in rows if r["kind"] == IMAGE]
+        if text_from_words:
+            from modules.extract import text_blocks_from_words
+            width, height = self.page_size(page_num)
+            return blocks + text_blocks_from_words(self.page_words(page_num), self.page_layout(page_num),
+                                                   page_num - 1, width, height)
+
+        for r in rows:
+            if r["kind"] != TEXT:
+                continue
+            block = {
+                "type": "text",
+                "content": self._string(r),
+                "page_num": page_num,
+                "position": {"x0": float(r["x0"]), "y0": float(r["y0"]), "x1": float(r["x1"]), "y1": float(r["y1"])}
+            }
+            if r["full_page"] >= 0:
+                block["is_full_page"] = bool(r["full_page"])
+            if HALF_NAMES[int(r["half"])]:
+                block["half"] = HALF_NAMES[int(r["half"])]
+            blocks.append(block)
+        return blocks
+
+def load_artifacts(config, sha256: str) -> Optional[DocumentArtifacts]:
+    return DocumentArtifacts(config, sha256) if has_artifacts(config, sha256) else None
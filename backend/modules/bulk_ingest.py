@@ -0,0 +1,312 @@
+"""
+Resumable bulk ingest of report archives.
+
+Walks a directory of PDFs (or reads a JSONL manifest of {"path", "pdf_id", "tags"}
+lines) and ingests every document with the same pipeline as POST /process_pdf:
+
+    python -m modules.bulk_ingest /data/annual-reports
+    python -m modules.bulk_ingest manifest.jsonl --workers 8 --api-calls-per-minute 600
+    python -m modules.bulk_ingest /data/annual-reports --max-api-calls 20000 --retry-failed
+
+Extraction and embedding run in a process pool (one worker per core by default);
+the parent process writes to the vector index one document at a time. Progress
+is checkpointed per document (DATA_DIR/ingest.sqlite) and per page
+(DATA_DIR/checkpoints/<pdf_id>/), so re-running the same command after a crash
+or an exhausted API budget resumes where it stopped.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import pickle
+import argparse
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Optional
+import fitz  # PyMuPDF
+from modules import config
+from modules.api_budget import SharedApiBudget, ApiBudgetExhausted, install_budget
+from modules.documents import spool_upload, store_pdf_file, register_document, add_document_tags
+from modules.embeddings import get_embedding_provider
+from modules.embedding_store import get_storage_settings
+from modules.extract import extract_and_embed_pdf, store_extracted_pdf, chunk_settings
+from modules.vision import get_vision_mode
+from modules.utils import get_data_dir, connect_sqlite, write_atomic
+from modules.vector_store import get_chroma_client
+
+DONE, FAILED, PENDING = "done", "failed", "pending"
+
+class PageCheckpoints:
+    """
+    Per-page results of extract_and_embed_pdf for one document.
+
+    Checkpoints are only reused for the same file content, embedding model and
+    vision mode; anything else starts the document over.
+    """
+
+    def __init__(self, config, pdf_id: str, fingerprint: str):
+        self.directory = get_data_dir(config, "checkpoints", pdf_id)
+        meta_path = os.path.join(self.directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                if json.load(f).get("fingerprint") != fingerprint:
+                    self.clear()
+                    os.makedirs(self.directory, exist_ok=True)
+        write_atomic(meta_path, json.dumps({"fingerprint": fingerprint}))
+
+    def _path(self, page_idx: int) -> str:
+        return os.path.join(self.directory, f"page_{page_idx:05d}.pkl")
+
+    def load_page(self, page_idx: int) -> Optional[Dict[str, Any]]:
+        path = self._path(page_idx)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save_page(self, page_idx: int, page_result: Dict[str, Any]):
+        write_atomic(self._path(page_idx), pickle.dumps(page_result, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def pages_done(self) -> int:
+        return sum(1 for name in os.listdir(self.directory) if name.endswith(".pkl"))
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def clear_page_checkpoints(config, pdf_id: str):
+    shutil.rmtree(get_data_dir(config, "checkpoints", pdf_id), ignore_errors=True)
+
+@contextmanager
+def _jobs(config):
+    with connect_sqlite(config, "ingest.sqlite") as connection:
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                pdf_id TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                num_pages INTEGER,
+                status TEXT NOT NULL,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+        yield connection
+
+def _set_job(config, job: Dict[str, Any], status: str, error: Optional[str] = None):
+    with _jobs(config) as connection:
+        connection.execute("""
+            INSERT INTO ingest_jobs (pdf_id, path, size, mtime, num_pages, status, error, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(pdf_id) DO UPDATE SET
+                path = excluded.path, size = excluded.size, mtime = excluded.mtime,
+                num_pages = excluded.num_pages, status = excluded.status,
+                error = excluded.error, updated_at = excluded.updated_at
+        """, (job["pdf_id"], job["path"], job["size"], job["mtime"], job.get("num_pages"), status, error, time.time()))
+
+def pdf_id_for_path(root: str, path: str) -> str:
+    """Stable pdf_id for a file in a directory walk (its relative path, made filename-safe)."""
+    relative = os.path.splitext(os.path.relpath(path, root))[0]
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", relative)
+
+def discover_documents(source: str) -> List[Dict[str, Any]]:
+    """List the documents of a directory (recursively) or a JSONL manifest."""
+    documents = []
+    if os.path.isdir(source):
+        for directory, _, filenames in os.walk(source):
+            for filename in sorted(filenames):
+                if filename.lower().endswith(".pdf"):
+                    path = os.path.join(directory, filename)
+                    documents.append({"path": path, "pdf_id": pdf_id_for_path(source, path), "tags": []})
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                path = entry["path"] if os.path.isabs(entry["path"]) else os.path.join(base, entry["path"])
+                documents.append({
+                    "path": path,
+                    "pdf_id": entry.get("pdf_id") or pdf_id_for_path(base, path),
+                    "tags": entry.get("tags", [])
+                })
+
+    for document in sorted(documents, key=lambda d: d["path"]):
+        stat = os.stat(document["path"])
+        document["size"], document["mtime"] = stat.st_size, stat.st_mtime
+    return documents
+
+def pending_documents(config, documents: List[Dict[str, Any]], retry_failed: bool) -> List[Dict[str, Any]]:
+    """Drop documents already ingested from an unchanged file (and failed ones unless retrying)."""
+    with _jobs(config) as connection:
+        jobs = {row["pdf_id"]: dict(row) for row in connection.execute("SELECT * FROM ingest_jobs")}
+    pending = []
+    for document in documents:
+        job = jobs.get(document["pdf_id"])
+        unchanged = job and job["path"] == document["path"] and job["size"] == document["size"] \
+            and job["mtime"] == document["mtime"]
+        if unchanged and (job["status"] == DONE or (job["status"] == FAILED and not retry_failed)):
+            continue
+        pending.append(document)
+    return pending
+
+_worker_client = None
+
+def _init_worker(budget: Optional[SharedApiBudget]):
+    global _worker_client
+    from openai import AzureOpenAI
+    install_budget(budget)
+    _worker_client = AzureOpenAI(
+        api_key=config.AZURE_OPENAI_API_KEY,
+        azure_endpoint=config.AZURE_OPENAI_ENDPOINT,
+        api_version=config.AZURE_OPENAI_API_VERSION
+    )
+
+def checkpoint_fingerprint(sha256: str) -> str:
+    """Everything that shapes a checkpointed page; pages saved under other settings are redone."""
+    return json.dumps({
+        "sha256": sha256,
+        "embeddings": get_embedding_provider(config, _worker_client).cache_key,
+        "vision_mode": get_vision_mode(config),
+        "chunks": chunk_settings(config),
+        "storage": get_storage_settings(config),
+        "table_index": bool(getattr(config, "TABLE_INDEX", True))
+    }, sort_keys=True)
+
+def _extract_document(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Worker: store the original, then extract and embed it page by page."""
+    with open(document["path"], "rb") as f:
+        tmp_path, sha256, _ = spool_upload(config, f)
+    stored_path = store_pdf_file(config, tmp_path, sha256)
+    register_document(config, document["pdf_id"], sha256, filename=os.path.basename(document["path"]))
+    add_document_tags(config, document["pdf_id"], document["tags"])
+
+    checkpoint = PageCheckpoints(config, document["pdf_id"], checkpoint_fingerprint(sha256))
+    resumed_pages = checkpoint.pages_done()
+    try:
+        extracted = extract_and_embed_pdf(stored_path, document["pdf_id"], _worker_client, config, checkpoint, sha256)
+    except ApiBudgetExhausted as e:
+        return {"status": "budget", "message": str(e), "pages_done": checkpoint.pages_done()}
+    return {"status": "extracted", "sha256": sha256, "extracted": extracted, "resumed_pages": resumed_pages}
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+def count_pages(path: str) -> int:
+    doc = fitz.open(path)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+def run(source: str, workers: int, calls_per_minute: Optional[float], max_calls: Optional[int],
+        retry_failed: bool) -> Dict[str, Any]:
+    documents = discover_documents(source)
+    pending = pending_documents(config, documents, retry_failed)
+    skipped = len(documents) - len(pending)
+
+    summary = {"documents": len(documents), "skipped": skipped, "done": 0, "failed": 0,
+               "remaining": 0, "pages": 0, "resumed_pages": 0, "api_calls": 0}
+    for document in list(pending):
+        try:
+            document["num_pages"] = count_pages(document["path"])
+        except Exception as e:
+            print(f"FAILED {document['pdf_id']}: cannot open PDF: {str(e)}")
+            _set_job(config, document, FAILED, str(e))
+            pending.remove(document)
+            summary["failed"] += 1
+
+    total_pages = sum(document["num_pages"] for document in pending)
+    print(f"{len(documents)} documents, {skipped} already ingested, {len(pending)} to process "
+          f"({total_pages} pages) with {workers} workers")
+    if not pending:
+        return summary
+
+    context = multiprocessing.get_context("spawn")
+    budget = SharedApiBudget(calls_per_minute, max_calls, context=context)
+    chroma_client = get_chroma_client(config)
+    start = time.perf_counter()
+    pages_left = total_pages
+    queue = list(pending)
+    budget_exhausted = False
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(budget,)) as pool:
+        in_flight = {}
+        while queue or in_flight:
+            # Keep a bounded number of documents queued so results stream back as they finish
+            while queue and not budget_exhausted and len(in_flight) < workers * 2:
+                document = queue.pop(0)
+                _set_job(config, document, PENDING)
+                in_flight[pool.submit(_extract_document, document)] = document
+            if not in_flight:
+                break
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                document = in_flight.pop(future)
+                pages_left -= document["num_pages"]
+                try:
+                    result = future.result()
+                    if result["status"] == "budget":
+                        budget_exhausted = True
+                        summary["remaining"] += 1
+                        print(f"PAUSED {document['pdf_id']}: {result['message']} "
+                              f"({result['pages_done']}/{document['num_pages']} pages checkpointed)")
+                        continue
+
+                    # The index is written from this process only, one document at a time
+                    details = store_extracted_pdf(result["extracted"], chroma_client, config)
+                    register_document(config, document["pdf_id"], result["sha256"], num_pages=details["num_pages"])
+                    _set_job(config, document, DONE)
+                    clear_page_checkpoints(config, document["pdf_id"])
+                    summary["done"] += 1
+                    summary["pages"] += details["num_pages"]
+                    summary["resumed_pages"] += result["resumed_pages"]
+                except Exception as e:
+                    print(f"FAILED {document['pdf_id']}: {str(e)}")
+                    _set_job(config, document, FAILED, str(e))
+                    summary["failed"] += 1
+                    continue
+
+                elapsed = time.perf_counter() - start
+                rate = summary["pages"] / elapsed if elapsed else 0.0
+                eta = format_duration(pages_left / rate) if rate else "?"
+                finished_count = summary["done"] + summary["failed"]
+                print(f"[{finished_count}/{len(pending)}] {document['pdf_id']} ({details['num_pages']} pages, "
+                      f"{details['num_chunks']} chunks) - {rate:.2f} pages/s, ETA {eta}")
+
+    summary["remaining"] += len(queue)
+    summary["api_calls"] = budget.used
+    summary["elapsed_sec"] = time.perf_counter() - start
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory of PDFs or JSONL manifest")
+    available_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    parser.add_argument("--workers", type=int, default=available_cores or 1)
+    parser.add_argument("--api-calls-per-minute", type=float, help="Rate limit shared by all workers")
+    parser.add_argument("--max-api-calls", type=int, help="Stop (resumably) after this many API calls")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry documents that failed before")
+    args = parser.parse_args()
+
+    summary = run(args.source, max(1, args.workers), args.api_calls_per_minute, args.max_api_calls, args.retry_failed)
+    elapsed = summary.get("elapsed_sec", 0.0)
+    rate = summary["pages"] / elapsed if elapsed else 0.0
+    print(f"\nIngested {summary['done']} documents ({summary['pages']} pages, {summary['resumed_pages']} from "
+          f"checkpoints) in {format_duration(elapsed)} - {rate:.2f} pages/s, {summary['api_calls']} API calls. "
+          f"Skipped {summary['skipped']}, failed {summary['failed']}, remaining {summary['remaining']}.")
+    if summary["remaining"]:
+        print("Run the same command again to resume.")
+    sys.exit(1 if summary["failed"] or summary["remaining"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import time
+import sqlite3
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
+from modules.utils import get_data_dir, connect_sqlite
+
+# Original PDFs are kept in a content-addressed store (DATA_DIR/pdfs/<sha256>.pdf)
+# and a small SQLite registry maps each pdf_id to its content hash.
+
+DEFAULT_MAX_UPLOAD_BYTES = 512 * 1024 * 1024
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds config.MAX_UPLOAD_BYTES."""
+
+def pdf_path(config, sha256: str) -> str:
+    """Path of a stored PDF by content hash."""
+    return os.path.join(get_data_dir(config, "pdfs", sha256[:2]), f"{sha256}.pdf")
+
+def spool_upload(config, stream) -> Tuple[str, str, int]:
+    """
+    Copy an upload stream to a temp file in the store, hashing it on the way.
+
+    Reads SPOOL_CHUNK_BYTES at a time so memory stays flat whatever the file size.
+    Returns (temp_path, sha256, size); pass them to store_pdf_file.
+    """
+    max_bytes = int(getattr(config, "MAX_UPLOAD_BYTES", DEFAULT_MAX_UPLOAD_BYTES))
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=get_data_dir(config, "pdfs"), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = stream.read(SPOOL_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds the limit of {max_bytes} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+def store_pdf_file(config, tmp_path: str, sha256: str) -> str:
+    """
+    Move a spooled upload into the content-addressed store and return its path.
+
+    The temp file lives under the store, so this is a rename rather than a copy;
+    if the same PDF is already stored the temp file is discarded.
+    """
+    path = pdf_path(config, sha256)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+    return path
+
+@contextmanager
+def _registry(config):
+    """Open the registry, commit on success and always close the connection."""
+    with connect_sqlite(config, "documents.sqlite") as connection:
+        _create_tables(connection)
+        yield connection
+
+def _create_tables(connection: sqlite3.Connection):
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            pdf_id TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            filename TEXT,
+            num_pages INTEGER,
+            created_at REAL NOT NULL
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS document_tags (
+            pdf_id TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (pdf_id, tag)
+        )
+    """)
+
+def register_document(config, pdf_id: str, sha256: str, filename: Optional[str] = None,
+                      num_pages: Optional[int] = None):
+    """Record (or update) which stored PDF a pdf_id refers to."""
+    with _registry(config) as connection:
+        connection.execute("""
+            INSERT INTO documents (pdf_id, sha256, filename, num_pages, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(pdf_id) DO UPDATE SET
+                sha256 = excluded.sha256,
+                filename = COALESCE(excluded.filename, documents.filename),
+                num_pages = COALESCE(excluded.num_pages, documents.num_pages)
+        """, (pdf_id, sha256, filename, num_pages, time.time()))
+
+def get_document(config, pdf_id: str) -> Optional[Dict[str, Any]]:
+    """Registry entry for a pdf_id, or None if the document was never stored."""
+    with _registry(config) as connection:
+        row = connection.execute("SELECT * FROM documents WHERE pdf_id = ?", (pdf_id,)).fetchone()
+    return dict(row) if row else None
+
+def list_documents(config) -> List[Dict[str, Any]]:
+    """Every registered document, oldest first."""
+    with _registry(config) as connection:
+        rows = connection.execute("SELECT * FROM documents ORDER BY created_at, pdf_id").fetchall()
+    return [dict(row) for row in rows]
+
+def add_document_tags(config, pdf_id: str, tags: List[str]):
+    """Add collection tags (e.g. "peer-group-2024") to a document."""
+    tags = [tag.strip() for tag in tags if tag and tag.strip()]
+    with _registry(config) as connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO document_tags (pdf_id, tag) VALUES (?, ?)",
+            [(pdf_id, tag) for tag in tags]
+        )
+
+def get_documents_by_tag(config, tag: str) -> List[str]:
+    """pdf_ids carrying a collection tag, oldest first."""
+    with _registry(config) as connection:
+        rows = connection.execute("""
+            SELECT t.pdf_id FROM document_tags t
+            LEFT JOIN documents d ON d.pdf_id = t.pdf_id
+            WHERE t.tag = ?
+            ORDER BY d.created_at, t.pdf_id
+        """, (tag,)).fetchall()
+    return [row["pdf_id"] for row in rows]
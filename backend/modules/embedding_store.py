@@ -0,0 +1,314 @@
+import os
+import json
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+from modules.utils import get_data_dir, write_atomic
+from modules import metrics
+
+# Embedding storage modes (config.EMBEDDING_STORAGE_MODE):
+# - "full": index the embeddings exactly as returned by the API
+# - "dimensions": index shortened embeddings (API `dimensions` parameter)
+# - "pca": index a local PCA projection fitted on ingested chunks
+#
+# The PCA projection is fitted explicitly, over every document at once:
+#
+#     python -m modules.reindex --all --fit-pca
+#
+# Until then "pca" indexes truncated prefixes exactly like "dimensions". A new
+# projection changes every index vector, so (re)fitting always re-indexes the
+# collection; that command does both.
+STORAGE_MODES = ("full", "dimensions", "pca")
+
+# Encodings for the full-size originals kept for exact reranking
+# (config.EMBEDDING_QUANTIZATION)
+QUANTIZATIONS = ("float32", "float16", "int8")
+
+DEFAULT_REDUCED_DIMENSIONS = 256
+DEFAULT_RERANK_OVERFETCH = 4
+
+def get_storage_settings(config) -> Dict[str, Any]:
+    """Read the embedding storage settings from config, falling back to full-precision storage."""
+    mode = getattr(config, "EMBEDDING_STORAGE_MODE", "full")
+    quantization = getattr(config, "EMBEDDING_QUANTIZATION", "float16")
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown EMBEDDING_STORAGE_MODE '{mode}', expected one of {STORAGE_MODES}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown EMBEDDING_QUANTIZATION '{quantization}', expected one of {QUANTIZATIONS}")
+
+    return {
+        "mode": mode,
+        "dimensions": int(getattr(config, "EMBEDDING_DIMENSIONS", DEFAULT_REDUCED_DIMENSIONS)),
+        "quantization": quantization,
+        # Exact rerank only makes sense when the index holds reduced vectors
+        "exact_rerank": mode != "full" and bool(getattr(config, "EMBEDDING_EXACT_RERANK", False)),
+        "overfetch": int(getattr(config, "EMBEDDING_RERANK_OVERFETCH", DEFAULT_RERANK_OVERFETCH))
+    }
+
+def api_dimensions(config) -> Optional[int]:
+    """
+    Return the `dimensions` value to request from the embeddings API, or None for the model default.
+
+    Shortened embeddings are only requested when nothing needs the full vectors;
+    with exact rerank enabled the full vectors are fetched and truncated locally.
+    """
+    settings = get_storage_settings(config)
+    if settings["mode"] == "dimensions" and not settings["exact_rerank"]:
+        return settings["dimensions"]
+    return None
+
+def embedding_request_kwargs(config) -> Dict[str, Any]:
+    """Extra keyword arguments for client.embeddings.create()."""
+    dimensions = api_dimensions(config)
+    return {"dimensions": dimensions} if dimensions else {}
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize each row, leaving all-zero rows untouched."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def to_index_vectors(embeddings: np.ndarray, config) -> np.ndarray:
+    """
+    Convert embeddings (one per row) into the vectors stored in the ANN index.
+
+    Args:
+        embeddings: float32 array of shape (n, dim) as returned by the API
+        config: The configuration module
+
+    Returns:
+        float32 array of shape (n, index_dim)
+    """
+    settings = get_storage_settings(config)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+
+    if settings["mode"] == "full":
+        return embeddings
+
+    pca = load_pca(config) if settings["mode"] == "pca" else None
+    if pca is not None:
+        return project_pca(embeddings, pca)
+
+    # text-embedding-3 models are trained so that a truncated, re-normalized
+    # prefix is equivalent to requesting fewer dimensions from the API
+    return normalize_rows(embeddings[:, :settings["dimensions"]])
+
+def index_dimension(config, full_dimension: int) -> int:
+    """Dimension of the vectors stored in the ANN index for a given API embedding size."""
+    settings = get_storage_settings(config)
+    if settings["mode"] == "full":
+        return full_dimension
+    return min(settings["dimensions"], full_dimension)
+
+DEFAULT_COLLECTION = "pdf_embeddings"
+
+def get_collection_name(config) -> str:
+    """Chroma collection holding the chunk index (config.CHROMA_COLLECTION)."""
+    return getattr(config, "CHROMA_COLLECTION", DEFAULT_COLLECTION)
+
+def collection_metadata(config, full_dimension: int, embedding_model: str) -> Dict[str, Any]:
+    """Metadata recorded on the Chroma collection describing how its vectors were produced."""
+    settings = get_storage_settings(config)
+    return {
+        "hnsw:space": "cosine",
+        "embedding_dim": index_dimension(config, full_dimension),
+        "embedding_model": embedding_model,
+        "storage_mode": settings["mode"]
+    }
+
+def check_collection_compatible(collection, config):
+    """Raise if an existing collection was built with a different storage mode."""
+    metadata = collection.metadata or {}
+    stored_mode = metadata.get("storage_mode", "full")
+    configured_mode = get_storage_settings(config)["mode"]
+    if stored_mode != configured_mode:
+        raise ValueError(
+            f"Collection '{collection.name}' stores '{stored_mode}' embeddings "
+            f"but EMBEDDING_STORAGE_MODE is '{configured_mode}'"
+        )
+
+# --- PCA projection ---
+
+def fit_pca(embeddings: np.ndarray, n_components: int) -> Dict[str, np.ndarray]:
+    """Fit a PCA projection with numpy's SVD."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.shape[0] < n_components:
+        raise ValueError(
+            f"Need at least {n_components} chunks to fit a {n_components}-dim PCA projection, "
+            f"got {embeddings.shape[0]}"
+        )
+    mean = embeddings.mean(axis=0)
+    _, _, vt = np.linalg.svd(embeddings - mean, full_matrices=False)
+    return {"mean": mean, "components": vt[:n_components].astype(np.float32)}
+
+def project_pca(embeddings: np.ndarray, pca: Dict[str, np.ndarray]) -> np.ndarray:
+    """Project embeddings onto the fitted components and re-normalize for cosine search."""
+    projected = (np.asarray(embeddings, dtype=np.float32) - pca["mean"]) @ pca["components"].T
+    return normalize_rows(projected.astype(np.float32))
+
+# path -> (mtime, projection); the mtime picks up a refit done by another process
+_pca_cache: Dict[str, Tuple[float, Dict[str, np.ndarray]]] = {}
+
+def _pca_path(config) -> str:
+    # Each collection is fitted (and re-indexed) on its own; the default one keeps the flat layout
+    collection = get_collection_name(config)
+    if collection == DEFAULT_COLLECTION:
+        return os.path.join(get_data_dir(config, "embeddings"), "pca.npz")
+    return os.path.join(get_data_dir(config, "embeddings", "pca"), f"{collection}.npz")
+
+def load_pca(config) -> Optional[Dict[str, np.ndarray]]:
+    """Load the persisted PCA projection, if any."""
+    path = _pca_path(config)
+    if not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    cached = _pca_cache.get(path)
+    metrics.record_cache("pca_projection", cached is not None and cached[0] == mtime)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with np.load(path) as data:
+        pca = {"mean": data["mean"], "components": data["components"]}
+    _pca_cache[path] = (mtime, pca)
+    return pca
+
+def save_pca(config, pca: Dict[str, np.ndarray]):
+    """Persist the PCA projection shared by every document in the index (re-index after saving)."""
+    path = _pca_path(config)
+    np.savez(path, mean=pca["mean"], components=pca["components"])
+    _pca_cache[path] = (os.path.getmtime(path), pca)
+
+# --- Quantized originals for exact rerank ---
+
+def _row_dtype(quantization: str, dim: int) -> np.dtype:
+    if quantization == "int8":
+        # Symmetric per-row quantization: value = q * scale
+        return np.dtype([("scale", "<f4"), ("q", "i1", (dim,))])
+    return np.dtype([("q", "<f2" if quantization == "float16" else "<f4", (dim,))])
+
+def quantize(embeddings: np.ndarray, quantization: str) -> np.ndarray:
+    """Encode embeddings (one per row) into structured rows of the given quantization."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    rows = np.zeros(embeddings.shape[0], dtype=_row_dtype(quantization, embeddings.shape[1]))
+    if quantization == "int8":
+        scale = np.abs(embeddings).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        rows["scale"] = scale
+        rows["q"] = np.round(embeddings / scale[:, None]).astype(np.int8)
+    else:
+        rows["q"] = embeddings
+    return rows
+
+def dequantize(rows: np.ndarray) -> np.ndarray:
+    """Decode structured rows produced by quantize() back to float32."""
+    values = rows["q"].astype(np.float32)
+    if "scale" in rows.dtype.names:
+        values *= rows["scale"][:, None]
+    return values
+
+def _originals_paths(config, pdf_id: str):
+    # Chunk indices differ between collections (e.g. a re-index with another chunk
+    # size), so originals are kept per collection; the default one keeps the flat layout
+    collection = get_collection_name(config)
+    scope = () if collection == DEFAULT_COLLECTION else (collection,)
+    directory = get_data_dir(config, "embeddings", "originals", *scope)
+    return os.path.join(directory, f"{pdf_id}.bin"), os.path.join(directory, f"{pdf_id}.json")
+
+class OriginalsMismatch(ValueError):
+    """Raised when a stored originals file does not match its header or the query."""
+
+def _read_header(header_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(header_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_originals(config, pdf_id: str, start_index: int, embeddings: np.ndarray, replace: bool = False):
+    """
+    Write quantized full-size embeddings for chunks start_index.. of a document.
+
+    Rows are fixed-size and addressed by chunk index, so pages can be appended
+    in any order and the file can be memory-mapped at query time. The file is
+    rewritten from scratch when replace is set (the whole document is being
+    stored) or the quantization or dimension changed; rows not written since
+    read back as zeros, which exact_rerank treats as missing.
+    """
+    quantization = get_storage_settings(config)["quantization"]
+    rows = quantize(embeddings, quantization)
+    data_path, header_path = _originals_paths(config, pdf_id)
+
+    header = {"dim": int(embeddings.shape[1]), "quantization": quantization}
+    rewrite = replace or not os.path.exists(data_path) or _read_header(header_path) != header
+    write_atomic(header_path, json.dumps(header))
+
+    with open(data_path, "wb" if rewrite else "r+b") as f:
+        f.seek(start_index * rows.dtype.itemsize)
+        f.write(rows.tobytes())
+
+def load_originals(config, pdf_id: str, chunk_indices: List[int]) -> Optional[np.ndarray]:
+    """
+    Read and decode the stored originals for the given chunk indices, or None if absent.
+
+    Chunks past the end of the file come back as zero rows.
+    """
+    data_path, header_path = _originals_paths(config, pdf_id)
+    header = _read_header(header_path)
+    if header is None or not os.path.exists(data_path):
+        return None
+
+    dtype = _row_dtype(header["quantization"], header["dim"])
+    size = os.path.getsize(data_path)
+    if size % dtype.itemsize:
+        raise OriginalsMismatch(
+            f"{data_path} holds {size} bytes, not a whole number of "
+            f"{header['dim']}-dim {header['quantization']} rows"
+        )
+    indices = np.asarray(chunk_indices, dtype=np.int64)
+    values = np.zeros((len(indices), header["dim"]), dtype=np.float32)
+    present = indices < size // dtype.itemsize
+    if present.any():
+        values[present] = dequantize(np.memmap(data_path, dtype=dtype, mode="r")[indices[present]])
+    return values
+
+def exact_rerank(query_embedding: np.ndarray, chunks: List[Dict[str, Any]], config) -> List[Dict[str, Any]]:
+    """
+    Re-score ANN candidates with exact cosine similarity against the stored originals.
+
+    Chunks without stored originals keep their ANN similarity, as do those of a
+    document whose originals do not match (reported, not raised).
+    """
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    by_pdf: Dict[str, List[Dict[str, Any]]] = {}
+    for chunk in chunks:
+        by_pdf.setdefault(chunk["metadata"].get("pdf_id"), []).append(chunk)
+
+    for pdf_id, pdf_chunks in by_pdf.items():
+        try:
+            originals = load_originals(config, pdf_id, [c["metadata"]["chunk_id"] for c in pdf_chunks])
+            if originals is not None and originals.shape[1] != query.shape[0]:
+                raise OriginalsMismatch(
+                    f"Stored originals have {originals.shape[1]} dimensions, the query has {query.shape[0]}"
+                )
+        except OriginalsMismatch as e:
+            print(f"Exact rerank skipped for {pdf_id}: {str(e)}")
+            metrics.inc("docuwrangler_exact_rerank_errors_total")
+            continue
+        if originals is None:
+            continue
+        similarities = normalize_rows(originals) @ query
+        for chunk, original, similarity in zip(pdf_chunks, originals, similarities):
+            if original.any():
+                chunk["similarity"] = float(similarity)
+
+    chunks.sort(key=lambda x: x["similarity"], reverse=True)
+    return chunks
+
+def bytes_per_vector(config, full_dimension: int) -> Dict[str, int]:
+    """Approximate stored bytes per chunk for the configured mode (index + originals)."""
+    settings = get_storage_settings(config)
+    index_bytes = index_dimension(config, full_dimension) * 4  # Chroma stores float32
+    originals_bytes = 0
+    if settings["exact_rerank"]:
+        originals_bytes = _row_dtype(settings["quantization"], full_dimension).itemsize
+    return {"index": index_bytes, "originals": originals_bytes, "total": index_bytes + originals_bytes}
@@ -0,0 +1,211 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from modules import metrics, api_budget
+from modules.embedding_store import embedding_request_kwargs
+from modules.utils import import_optional
+
+# Embedding providers (config.EMBEDDING_PROVIDER):
+# - "azure": the Azure OpenAI embeddings deployment (default)
+# - "local": a CPU model loaded once per process (ONNX or sentence-transformers)
+PROVIDERS = ("azure", "local")
+
+DEFAULT_AZURE_BATCH_SIZE = 16
+DEFAULT_LOCAL_BATCH_SIZE = 32
+DEFAULT_QUERY_CACHE_SIZE = 1024
+
+class EmbeddingModelMismatch(ValueError):
+    """Raised when an index was built with a different embedding model than the one configured."""
+
+# Question embeddings shared by every provider instance in this process, keyed by
+# (provider cache key, text). Azure providers are created per request, so the cache
+# cannot live on the instance.
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+class EmbeddingProvider(ABC):
+    """
+    Base class for embedding backends.
+
+    Subclasses implement _embed_batch(); embed() splits inputs into batches and
+    embed_query() adds a process-wide LRU cache for repeated questions.
+    """
+
+    model_id = "unknown"
+    batch_size = DEFAULT_AZURE_BATCH_SIZE
+
+    def __init__(self, query_cache_size: int = DEFAULT_QUERY_CACHE_SIZE):
+        self._query_cache_size = query_cache_size
+
+    @property
+    def cache_key(self) -> str:
+        return self.model_id
+
+    @abstractmethod
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed one batch of at most batch_size texts."""
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts, returning a float32 array with one row per input."""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack([self._embed_batch(batch) for batch in self._batches(texts)])
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a single question, serving repeats from the in-process LRU cache."""
+        key = (self.cache_key, text)
+        with _query_cache_lock:
+            cached = _query_cache.get(key)
+            if cached is not None:
+                _query_cache.move_to_end(key)
+        metrics.record_cache("query_embedding", cached is not None)
+        if cached is not None:
+            return cached
+
+        embedding = self.embed([text])[0]
+        with _query_cache_lock:
+            _query_cache[key] = embedding
+            while len(_query_cache) > self._query_cache_size:
+                _query_cache.popitem(last=False)
+        return embedding
+
+class AzureEmbeddingProvider(EmbeddingProvider):
+    """Azure OpenAI embeddings, sending up to batch_size inputs per request."""
+
+    def __init__(self, client, config):
+        super().__init__(int(getattr(config, "QUERY_EMBEDDING_CACHE_SIZE", DEFAULT_QUERY_CACHE_SIZE)))
+        self.client = client
+        self.config = config
+        self.deployment = config.AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT
+        self.model_id = f"azure:{self.deployment}"
+        self.batch_size = int(getattr(config, "EMBEDDING_BATCH_SIZE", DEFAULT_AZURE_BATCH_SIZE))
+
+    @property
+    def cache_key(self) -> str:
+        # Shortened embeddings differ from full ones for the same deployment
+        return f"{self.model_id}:{embedding_request_kwargs(self.config).get('dimensions', 'full')}"
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        api_budget.acquire("embeddings")
+        with metrics.span("embed", provider="azure", inputs=len(texts)):
+            response = self.client.embeddings.create(
+                input=texts,
+                model=self.deployment,
+                **embedding_request_kwargs(self.config)
+            )
+        metrics.count_api_call("embeddings", response)
+        # float32 arrays are ~8x smaller than lists of Python floats
+        data = sorted(response.data, key=lambda d: d.index)
+        return np.array([d.embedding for d in data], dtype=np.float32)
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    CPU-local embedding model.
+
+    config.LOCAL_EMBEDDING_MODEL is either a directory with model.onnx and
+    tokenizer.json (run with onnxruntime, mean-pooled) or a sentence-transformers
+    model name/path. Batches run on a thread pool; onnxruntime releases the GIL.
+    """
+
+    def __init__(self, config):
+        super().__init__(int(getattr(config, "QUERY_EMBEDDING_CACHE_SIZE", DEFAULT_QUERY_CACHE_SIZE)))
+        model = config.LOCAL_EMBEDDING_MODEL
+        self.model_id = f"local:{os.path.basename(os.path.normpath(model))}"
+        self.batch_size = int(getattr(config, "LOCAL_EMBEDDING_BATCH_SIZE", DEFAULT_LOCAL_BATCH_SIZE))
+        threads = int(getattr(config, "LOCAL_EMBEDDING_THREADS", min(4, os.cpu_count() or 1)))
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="local-embed")
+
+        if os.path.exists(os.path.join(model, "model.onnx")):
+            self._load_onnx(model, int(getattr(config, "LOCAL_EMBEDDING_MAX_LENGTH", 256)))
+        else:
+            sentence_transformers = import_optional(
+                "sentence_transformers", "sentence-transformers", "LOCAL_EMBEDDING_MODEL without model.onnx"
+            )
+            self.session = None
+            self.model = sentence_transformers.SentenceTransformer(model, device="cpu")
+
+    def _load_onnx(self, model_dir: str, max_length: int):
+        onnxruntime = import_optional("onnxruntime", "onnxruntime", "EMBEDDING_PROVIDER = \"local\"")
+        Tokenizer = import_optional("tokenizers", "tokenizers", "EMBEDDING_PROVIDER = \"local\"").Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = 1  # Parallelism comes from the batch thread pool
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        with metrics.span("embed", provider="local", inputs=len(texts)):
+            if self.session is None:
+                return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+            encodings = self.tokenizer.encode_batch(texts)
+            mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            features = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": mask,
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64)
+            }
+            output = self.session.run(None, {k: v for k, v in features.items() if k in self.input_names})[0]
+            if output.ndim == 3:
+                # Mean-pool token embeddings over the attention mask
+                weights = mask[:, :, None].astype(np.float32)
+                output = (output * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(output, axis=1, keepdims=True)
+            return (output / np.clip(norms, 1e-9, None)).astype(np.float32)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        batches = self._batches(texts)
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+        return np.vstack(list(self.pool.map(self._embed_batch, batches)))
+
+_local_provider: Optional[LocalEmbeddingProvider] = None
+_local_provider_lock = threading.Lock()
+
+def get_embedding_provider(config, client=None) -> EmbeddingProvider:
+    """
+    Return the embedding provider selected by config.EMBEDDING_PROVIDER.
+
+    The local model is loaded once per process and shared; Azure providers wrap
+    the caller's client.
+    """
+    global _local_provider
+    provider = getattr(config, "EMBEDDING_PROVIDER", "azure")
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown EMBEDDING_PROVIDER '{provider}', expected one of {PROVIDERS}")
+
+    if provider == "local":
+        with _local_provider_lock:
+            if _local_provider is None:
+                _local_provider = LocalEmbeddingProvider(config)
+        return _local_provider
+
+    return AzureEmbeddingProvider(client, config)
+
+def check_index_model(collection, provider: EmbeddingProvider):
+    """Reject using an index with embeddings from a different model."""
+    index_model = (collection.metadata or {}).get("embedding_model")
+    if index_model is None:
+        # Indexes created before the model was recorded hold Azure embeddings
+        if isinstance(provider, AzureEmbeddingProvider):
+            return
+        index_model = "azure"
+    if index_model != provider.model_id:
+        raise EmbeddingModelMismatch(
+            f"Index '{collection.name}' was built with '{index_model}' embeddings "
+            f"but the configured provider is '{provider.model_id}'"
+        )
@@ -3,20 +3,40 @@ import fitz  # PyMuPDF
 import numpy as np
 from PIL import Image
 import io
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 import chromadb
 from openai import AzureOpenAI
 import os
+from modules.embedding_store import (
+    to_index_vectors, collection_metadata, check_collection_compatible,
+    get_storage_settings, get_collection_name, save_originals
+)
+from modules.embeddings import get_embedding_provider, check_index_model
+from modules.tables import extract_tables_from_page, delete_tables, index_tables
+from modules.artifacts import capture_page, write_artifacts
+from modules.page_index import index_pages, delete_pages
+from modules.vector_store import write_records
+from modules.vision import (
+    describe_image_cached, cached_description, placeholder_description, enqueue_images, get_vision_mode, save_image, PENDING
+)
+from modules import metrics
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_CHUNK_OVERLAP = 200
 
-def create_collection_if_not_exists(chroma_client, collection_name: str):
+def create_collection_if_not_exists(chroma_client, collection_name: str, metadata: Optional[Dict[str, Any]] = None):
     """Create a collection if it doesn't exist already."""
     try:
         return chroma_client.get_collection(collection_name)
     except:
-        return chroma_client.create_collection(
-            name=collection_name,
-            metadata={"hnsw:space": "cosine"}  # Using cosine similarity
-        )
+        try:
+            return chroma_client.create_collection(
+                name=collection_name,
+                metadata=metadata or {"hnsw:space": "cosine"}  # Using cosine similarity
+            )
+        except Exception:
+            # Another worker created it in the meantime
+            return chroma_client.get_collection(collection_name)
 import fitz
 import base64
 from typing import List, Dict, Any, Optional
@@ -37,16 +57,30 @@ def extract_text_and_images_from_pdf(pdf_bytes: bytes) -> List[Dict[str, Any]]:
     doc = fitz.open(stream=pdf_bytes, filetype="pdf")
     
     for page_num, page in enumerate(doc):
-        # Extract images first
-        image_blocks = extract_images_from_page(doc, page, page_num)
-        content_blocks.extend(image_blocks)
-        
-        # Extract text
-        text_blocks = extract_text_from_page(page, page_num)
-        content_blocks.extend(text_blocks)
+        content_blocks.extend(extract_page_content(doc, page, page_num))
     
     return content_blocks
 
+def extract_page_content(doc, page, page_num: int) -> List[Dict[str, Any]]:
+    """Extract the image and text blocks of one page (page_num is 0-based)."""
+    # Extract images first
+    content_blocks = extract_images_from_page(doc, page, page_num)
+    
+    # Extract text
+    content_blocks.extend(extract_text_from_page(page, page_num))
+    return content_blocks
+
+def open_pdf(pdf_source: Union[str, bytes]):
+    """
+    Open a PDF from a file path or from bytes.
+
+    A path is preferred: MuPDF reads pages from disk on demand, so memory does
+    not grow with the file size.
+    """
+    if isinstance(pdf_source, (bytes, bytearray)):
+        return fitz.open(stream=pdf_source, filetype="pdf")
+    return fitz.open(pdf_source, filetype="pdf")
+
 def extract_images_from_page(doc, page, page_num: int) -> List[Dict[str, Any]]:
     """
     Extract images from a PDF page safely.
@@ -81,7 +115,9 @@ def extract_images_from_page(doc, page, page_num: int) -> List[Dict[str, Any]]:
                     "content": base64_image,
                     "page_num": page_num + 1,
                     "position": position,
-                    "mime_type": base_image["ext"]
+                    "mime_type": base_image["ext"],
+                    "xref": xref,
+                    "caption": find_image_caption(page, position)
                 })
             except Exception as e:
                 print(f"Error extracting image with xref {xref}: {str(e)}")
@@ -109,7 +145,8 @@ def extract_images_from_page(doc, page, page_num: int) -> List[Dict[str, Any]]:
                             "content": base64_image,
                             "page_num": page_num + 1,
                             "position": position,
-                            "mime_type": "png"  # Default to PNG for inline images
+                            "mime_type": "png",  # Default to PNG for inline images
+                            "caption": find_image_caption(page, position)
                         })
                 except Exception as e:
                     print(f"Error extracting inline image: {str(e)}")
@@ -119,6 +156,21 @@ def extract_images_from_page(doc, page, page_num: int) -> List[Dict[str, Any]]:
     
     return image_blocks
 
+def find_image_caption(page, position: Dict[str, float], margin: float = 40, max_chars: int = 300) -> str:
+    """
+    Text directly above and below an image (titles, captions, axis notes).
+    Used as the image's searchable stand-in until it is described (lazy vision mode).
+    """
+    try:
+        rect = fitz.Rect(position["x0"], position["y0"] - margin, position["x1"], position["y1"] + margin)
+        # Whole words touching the band, in reading order
+        words = [w for w in page.get_text("words") if fitz.Rect(w[:4]).intersects(rect)]
+        words.sort(key=lambda w: (w[5], w[6], w[7]))
+        return " ".join(w[4] for w in words)[:max_chars]
+    except Exception as e:
+        print(f"Error finding caption text: {str(e)}")
+        return ""
+
 def find_image_position(page, xref: int) -> Dict[str, float]:
     """
     Find the position of an image on a page safely.
@@ -241,12 +293,48 @@ def extract_text_from_page(page, page_num: int) -> List[Dict[str, Any]]:
     
     return text_blocks
 
+def text_blocks_from_words(words, layout, page_num: int, page_width: float, page_height: float) -> List[Dict[str, Any]]:
+    """
+    Rebuild a page's text blocks from stored words and layout blocks, applying the
+    same full-page / two-column heuristic as extract_text_from_page.
+    
+    Full-page text is reassembled from words here rather than read with
+    get_text("text"), so line breaks can differ slightly from a fresh extraction.
+    page_num is 0-based.
+    """
+    is_full_page = len(set(int(block[0] / 100) for block in layout)) > 2
+    if is_full_page:
+        regions = [((0, 0, page_width, page_height), {"is_full_page": True})]
+    else:
+        half_width = page_width / 2
+        regions = [
+            ((0, 0, half_width, page_height), {"is_full_page": False, "half": "left"}),
+            ((half_width, 0, page_width, page_height), {"is_full_page": False, "half": "right"})
+        ]
+    
+    text_blocks = []
+    for rect, flags in regions:
+        text = words_to_text(words, rect)
+        if text.strip():
+            text_blocks.append({
+                "type": "text",
+                "content": text,
+                "page_num": page_num + 1,
+                "position": {"x0": rect[0], "y0": rect[1], "x1": rect[2], "y1": rect[3]},
+                **flags
+            })
+    return text_blocks
+
 def extract_text_from_rect(page, rect):
     """Extract text from a specific rectangle on the page."""
+    return words_to_text(page.get_text("words"), rect)
+
+def words_to_text(words, rect) -> str:
+    """
+    Rebuild the text of the words (PyMuPDF "words" tuples) inside a rectangle, line by line.
+    Works on stored word arrays too, so artifacts can be re-laid out without the PDF.
+    """
     try:
-        # Get all words on the page
-        words = page.get_text("words")
-        
         # Filter words that fall within the rectangle
         x0, y0, x1, y1 = rect
         filtered_words = [
@@ -290,7 +378,8 @@ def extract_text_from_rect(page, rect):
         return ""
 
 
-def create_intelligent_chunks(content_blocks: List[Dict[str, Any]], max_chunk_size=1000, overlap=200):
+def create_intelligent_chunks(content_blocks: List[Dict[str, Any]], max_chunk_size=DEFAULT_CHUNK_SIZE,
+                              overlap=DEFAULT_CHUNK_OVERLAP):
     """
     Create intelligent chunks from the extracted content blocks.
     This helps in creating more meaningful semantic units for embedding.
@@ -343,77 +432,102 @@ def create_intelligent_chunks(content_blocks: List[Dict[str, Any]], max_chunk_si
     
     return chunks
 
+def chunk_settings(config) -> Dict[str, int]:
+    """Chunking parameters from config.CHUNK_SIZE / config.CHUNK_OVERLAP."""
+    return {
+        "max_chunk_size": int(getattr(config, "CHUNK_SIZE", DEFAULT_CHUNK_SIZE)),
+        "overlap": int(getattr(config, "CHUNK_OVERLAP", DEFAULT_CHUNK_OVERLAP))
+    }
+
 def generate_multimodal_embeddings(content_blocks: List[Dict[str, Any]], client: AzureOpenAI, config):
     """
-    Generate embeddings for both text and images using Azure OpenAI.
+    Generate embeddings for both text and images.
+    
+    Images are first described with GPT-4o; the text of every block is then embedded
+    in batches by the configured embedding provider (see modules.embeddings).
+    In lazy vision mode images get a placeholder instead and are described later
+    (see modules.vision).
     
     Returns the original content blocks with embeddings added.
     """
+    provider = get_embedding_provider(config, client)
+    lazy_vision = get_vision_mode(config) == "lazy"
+    
+    blocks_to_embed = []
+    texts = []
     for block in content_blocks:
         if block["type"] == "text":
             # For text blocks, we'll use the text directly
-            response = client.embeddings.create(
-                input=block["content"],
-                model=config.AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT  # Your text embedding model deployment
-            )
-            block["embedding"] = response.data[0].embedding
+            texts.append(block["content"])
+            blocks_to_embed.append(block)
             
         elif block["type"] == "image":
-            # For image blocks, we'll use GPT-4o's multimodal capabilities
-            # Convert base64 back to image for processing
-            image_data = base64.b64decode(block["content"])
-            
-            # Use GPT-4o to generate a description of the image
-            messages = [
-                {"role": "system", "content": "You are an AI assistant that describes images in detail."},
-                {
-                    "role": "user", 
-                    "content": [
-                        {"type": "text", "text": "Please describe this image in detail."},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/{block['mime_type']};base64,{block['content']}",
-                                "detail": "high"
-                            }
-                        }
-                    ]
-                }
-            ]
-            
-            # Get image description from GPT-4o
-            chat_response = client.chat.completions.create(
-                model=config.AZURE_OPENAI_VISION_DEPLOYMENT,  # Your GPT-4o deployment
-                messages=messages,
-                max_tokens=300
-            )
-            
-            image_description = chat_response.choices[0].message.content
-            block["description"] = image_description
-            
-            # Now get embedding for the image description
-            response = client.embeddings.create(
-                input=image_description,
-                model=config.AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT
-            )
-            block["embedding"] = response.data[0].embedding
+            # For image blocks, embed the GPT-4o description
+            description = cached_description(config, block) if lazy_vision else None
+            if description is not None:
+                block["description"] = description
+            elif lazy_vision:
+                block["description"] = placeholder_description(block)
+                block["vision_status"] = PENDING
+            else:
+                block["description"] = describe_image_cached(block, client, config)
+            if block.get("vision_status") == PENDING:
+                # Kept in the image store for the later description
+                block["image_key"] = save_image(config, block)
+            # Pages are held (and checkpointed) until the store step; drop the base64 bytes
+            del block["content"]
+            texts.append(block["description"])
+            blocks_to_embed.append(block)
+    
+    if texts:
+        for block, embedding in zip(blocks_to_embed, provider.embed(texts)):
+            block["embedding"] = embedding
     
     return content_blocks
 
-def store_embeddings(chroma_client, pdf_id: str, content_blocks: List[Dict[str, Any]]):
-    """Store embeddings in ChromaDB with paragraph-level references."""
-    collection = create_collection_if_not_exists(chroma_client, "pdf_embeddings")
+def delete_document_chunks(chroma_client, pdf_id: str, config):
+    """Remove a document's chunks and page summaries from the index."""
+    try:
+        collection = chroma_client.get_collection(get_collection_name(config))
+    except Exception:
+        return
+    collection.delete(where={"pdf_id": pdf_id})
+    delete_pages(chroma_client, pdf_id, config)
+
+def store_embeddings(chroma_client, pdf_id: str, content_blocks: List[Dict[str, Any]], config):
+    """
+    Store embeddings in ChromaDB with paragraph-level references.
+
+    The index holds vectors in the configured storage mode (see modules.embedding_store);
+    when exact rerank is enabled the full-size originals are kept quantized on disk.
+    A document stored before is replaced, chunks and sidecars alike.
+    """
+    # Chroma's add() skips ids that already exist, so a re-ingest would keep the old chunks
+    delete_document_chunks(chroma_client, pdf_id, config)
+    if not content_blocks:
+        enqueue_images(config, pdf_id, [])
+        return {"message": f"No content to store for PDF {pdf_id}"}
+
+    full_embeddings = np.stack([block["embedding"] for block in content_blocks])
+    embedding_model = get_embedding_provider(config).model_id
+    index_metadata = collection_metadata(config, full_embeddings.shape[1], embedding_model)
+    collection = create_collection_if_not_exists(chroma_client, get_collection_name(config), metadata=index_metadata)
+    check_collection_compatible(collection, config)
+    check_index_model(collection, get_embedding_provider(config))
     
     # Prepare data for batch insertion
     ids = []
-    embeddings = []
+    embeddings = to_index_vectors(full_embeddings, config).tolist()
     metadatas = []
     documents = []
+    pending_images = []
+    
+    if get_storage_settings(config)["exact_rerank"]:
+        save_originals(config, pdf_id, 0, full_embeddings, replace=True)
     
     for i, block in enumerate(content_blocks):
         block_id = f"{pdf_id}_{i}"
         ids.append(block_id)
-        embeddings.append(block["embedding"])
         
         # Store more granular metadata for UI highlighting
         metadata = {
@@ -425,7 +539,8 @@ def store_embeddings(chroma_client, pdf_id: str, content_blocks: List[Dict[str,
             "position_x1": block["position"]["x1"],
             "position_y1": block["position"]["y1"],
             "chunk_id": i,  # Unique identifier for this chunk
-            "paragraph_index": i  # Can be used for highlighting
+            "paragraph_index": i,  # Can be used for highlighting
+            "embedding_model": embedding_model
         }
         
         # Add text-specific metadata
@@ -441,17 +556,19 @@ def store_embeddings(chroma_client, pdf_id: str, content_blocks: List[Dict[str,
         else:
             # For image blocks
             metadata["mime_type"] = block["mime_type"]
+            if block.get("vision_status") == PENDING:
+                metadata["vision_status"] = PENDING
+                pending_images.append({"chunk_id": block_id, "chunk_index": i, "block": block})
             documents.append(block["description"])
         
         metadatas.append(metadata)
     
-    # Add to collection
-    collection.add(
-        ids=ids,
-        embeddings=embeddings,
-        metadatas=metadatas,
-        documents=documents
-    )
+    # Add to collection in bounded batches
+    write_records(chroma_client, collection, config, ids=ids, embeddings=embeddings,
+                  metadatas=metadatas, documents=documents)
+    index_pages(chroma_client, pdf_id, [block["page_num"] for block in content_blocks], embeddings, documents,
+                config, index_metadata)
+    enqueue_images(config, pdf_id, pending_images)
     
     return {"message": f"Successfully stored {len(ids)} embeddings for PDF {pdf_id}"}
 
@@ -552,56 +669,121 @@ def split_pdf_bytes_to_pages(pdf_bytes: bytes) -> List[bytes]:
     doc.close()
     return page_bytes_list
     
-def process_pdf_for_rag(pdf_bytes: bytes, pdf_id: str, client: AzureOpenAI, chroma_client, config):
+def extract_and_embed_pdf(pdf_source: Union[str, bytes], pdf_id: str, client: AzureOpenAI, config,
+                          checkpoint=None, sha256: Optional[str] = None) -> Dict[str, Any]:
     """
-    Complete pipeline to process a PDF for RAG:
-    1. Split PDF into individual pages for efficient processing
-    2. Process each page separately:
-       a. Extract text and images
-       b. Create intelligent chunks
-       c. Generate embeddings
-    3. Store all embeddings under a single pdf_id for unified retrieval
+    Extract, chunk and embed every page of a PDF without touching the index.
+    
+    Pages are read one at a time from the open document, so only the current
+    page's content is held in memory besides the accumulated chunks. With a
+    checkpoint (see modules.bulk_ingest.PageCheckpoints), finished pages are
+    saved as they complete and reused instead of being processed again.
+    With the document's sha256, the extraction output is persisted as artifacts
+    (config.PERSIST_ARTIFACTS) for re-indexing without the PDF.
     """
-    # Split PDF into individual pages
-    page_bytes_list = split_pdf_bytes_to_pages(pdf_bytes)
+    with metrics.span("open", pdf_id=pdf_id):
+        doc = open_pdf(pdf_source)
+    num_pages = len(doc)
     
-    all_content_blocks = []
-    all_chunked_blocks = []
-    all_blocks_with_embeddings = []
+    pages = []
+    index_table_rows = getattr(config, "TABLE_INDEX", True)
+    persist_artifacts = sha256 is not None and getattr(config, "PERSIST_ARTIFACTS", True)
     
-    # Process each page separately for efficiency
-    for page_idx, page_bytes in enumerate(page_bytes_list):
-        # Extract content from this page
-        content_blocks = extract_text_and_images_from_pdf(page_bytes)
-        
-        # Update the page number to reflect the actual page in the document
-        for block in content_blocks:
-            block["page_num"] = page_idx + 1
-        
-        all_content_blocks.extend(content_blocks)
-        
-        # Create intelligent chunks for this page
-        chunked_blocks = create_intelligent_chunks(content_blocks)
-        all_chunked_blocks.extend(chunked_blocks)
-        
-        # Generate embeddings for this page
-        blocks_with_embeddings = generate_multimodal_embeddings(chunked_blocks, client, config)
-        all_blocks_with_embeddings.extend(blocks_with_embeddings)
-        
-        print(f"Processed page {page_idx+1}/{len(page_bytes_list)}")
+    try:
+        # Process each page separately for efficiency
+        for page_idx, page in enumerate(doc):
+            saved = checkpoint.load_page(page_idx) if checkpoint else None
+            if saved is not None:
+                pages.append(saved)
+                continue
+            
+            # Extract content from this page
+            with metrics.span("page_extract", page=page_idx + 1):
+                content_blocks = extract_page_content(doc, page, page_idx)
+            
+            # Update the page number to reflect the actual page in the document
+            for block in content_blocks:
+                block["page_num"] = page_idx + 1
+            
+            # Create intelligent chunks for this page
+            with metrics.span("chunk", page=page_idx + 1):
+                chunked_blocks = create_intelligent_chunks(content_blocks, **chunk_settings(config))
+            
+            # Generate embeddings for this page
+            blocks_with_embeddings = generate_multimodal_embeddings(chunked_blocks, client, config)
+            
+            tables = []
+            if index_table_rows:
+                with metrics.span("tables", page=page_idx + 1):
+                    tables = extract_tables_from_page(page, page_idx + 1)
+            
+            page_result = {
+                "num_text_blocks": sum(1 for block in content_blocks if block["type"] == "text"),
+                "num_image_blocks": sum(1 for block in content_blocks if block["type"] == "image"),
+                "blocks": blocks_with_embeddings,
+                "tables": tables
+            }
+            if persist_artifacts:
+                page_result["artifact"] = capture_page(config, page, page_idx, content_blocks)
+            if checkpoint:
+                checkpoint.save_page(page_idx, page_result)
+            pages.append(page_result)
+            
+            print(f"Processed page {page_idx+1}/{num_pages}")
+    finally:
+        doc.close()
+    
+    if persist_artifacts and all("artifact" in page for page in pages):
+        with metrics.span("artifacts", pdf_id=pdf_id):
+            write_artifacts(config, sha256, [page.pop("artifact") for page in pages],
+                            [page["tables"] for page in pages])
+    
+    return {"pdf_id": pdf_id, "num_pages": num_pages, "pages": pages}
+
+def store_extracted_pdf(extracted: Dict[str, Any], chroma_client, config) -> Dict[str, Any]:
+    """
+    Store the output of extract_and_embed_pdf: embeddings under a single pdf_id
+    for unified retrieval, and the document's rows in the table index.
+    """
+    pdf_id = extracted["pdf_id"]
+    pages = extracted["pages"]
+    all_blocks_with_embeddings = [block for page in pages for block in page["blocks"]]
+    all_tables = [table for page in pages for table in page["tables"]]
     
     # Store all embeddings under a single pdf_id
-    storage_result = store_embeddings(chroma_client, pdf_id, all_blocks_with_embeddings)
+    with metrics.span("store", pdf_id=pdf_id, chunks=len(all_blocks_with_embeddings)):
+        storage_result = store_embeddings(chroma_client, pdf_id, all_blocks_with_embeddings, config)
+    
+    num_table_cells = 0
+    if getattr(config, "TABLE_INDEX", True):
+        delete_tables(config, pdf_id)
+        num_table_cells = index_tables(config, pdf_id, all_tables)
     
     # Return summary of the entire process
     return {
         "pdf_id": pdf_id,
-        "num_pages": len(page_bytes_list),
-        "num_text_blocks": sum(1 for block in all_content_blocks if block["type"] == "text"),
-        "num_image_blocks": sum(1 for block in all_content_blocks if block["type"] == "image"),
-        "num_chunks": len(all_chunked_blocks),
-        "pages_processed": len(page_bytes_list),
+        "num_pages": extracted["num_pages"],
+        "num_text_blocks": sum(page["num_text_blocks"] for page in pages),
+        "num_image_blocks": sum(page["num_image_blocks"] for page in pages),
+        "num_deferred_images": sum(1 for block in all_blocks_with_embeddings if block.get("vision_status") == PENDING),
+        "num_chunks": len(all_blocks_with_embeddings),
+        "num_tables": len(all_tables),
+        "num_table_cells": num_table_cells,
+        "pages_processed": extracted["num_pages"],
         "storage_result": storage_result
     }
 
-
+def process_pdf_for_rag(pdf_source: Union[str, bytes], pdf_id: str, client: AzureOpenAI, chroma_client, config):
+    """
+    Complete pipeline to process a PDF for RAG:
+    1. Open the PDF (from a path on disk, or from bytes)
+    2. Process each page separately:
+       a. Extract text and images
+       b. Create intelligent chunks
+       c. Generate embeddings (images become placeholders in lazy vision mode)
+       d. Detect financial tables and convert them into typed rows (config.TABLE_INDEX)
+    3. Store all embeddings under a single pdf_id for unified retrieval
+    4. Replace the document's rows in the table index
+    """
+    extracted = extract_and_embed_pdf(pdf_source, pdf_id, client, config)
+    return store_extracted_pdf(extracted, chroma_client, config)
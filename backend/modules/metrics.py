@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
+
+# In-process metrics registry exposed in Prometheus text format by GET /metrics.
+#
+# Each process records into its own registry. With a multiprocess directory
+# (config.METRICS_MULTIPROC_DIR; gunicorn.conf.py sets one up for its workers)
+# every process also writes its registry to <dir>/<pid>.json, at most
+# FLUSH_INTERVAL_SEC after a change, and /metrics reports the sum over all
+# files, so a scrape of any worker covers the whole server. Files of exited
+# workers are kept so counters never go backwards.
+
+FLUSH_INTERVAL_SEC = 1.0
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "docuwrangler_stage_seconds": "Time spent in each pipeline stage",
+    "docuwrangler_http_request_seconds": "HTTP request latency by route",
+    "docuwrangler_api_calls_total": "Azure OpenAI API calls by kind",
+    "docuwrangler_api_tokens_total": "Azure OpenAI tokens by kind and type",
+    "docuwrangler_cache_requests_total": "Cache lookups by cache and result",
+    "docuwrangler_vision_descriptions_total": "Deferred image descriptions by trigger",
+    "docuwrangler_coalesced_requests_total": "Requests served from another request's in-flight computation",
+    "docuwrangler_exact_rerank_errors_total": "Documents whose stored originals could not be used for exact rerank"
+}
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Dict[str, Any]] = {}
+
+_multiproc_dir: Optional[str] = None
+_last_flush = 0.0
+_flush_timer: Optional[threading.Timer] = None
+
+_trace_log_path: Optional[str] = None
+_trace_lock = threading.Lock()
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+def configure(config):
+    """Enable JSON trace logs (config.TRACE_LOG_PATH) and multiprocess metrics (config.METRICS_MULTIPROC_DIR)."""
+    global _trace_log_path
+    _trace_log_path = getattr(config, "TRACE_LOG_PATH", None)
+    if getattr(config, "METRICS_MULTIPROC_DIR", None):
+        enable_multiprocess(config.METRICS_MULTIPROC_DIR)
+
+def enable_multiprocess(directory: str, clear: bool = False):
+    """
+    Aggregate metrics over every process writing to directory.
+
+    clear removes files left by a previous run; call it once, before workers start.
+    """
+    global _multiproc_dir
+    os.makedirs(directory, exist_ok=True)
+    if clear:
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".json"):
+                os.remove(entry.path)
+    _multiproc_dir = directory
+    flush()
+
+def _after_fork_in_child():
+    # The parent's counts stay in the parent's file; a forked worker starts from zero
+    global _lock, _flush_timer, _last_flush
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+    _flush_timer = None
+    _last_flush = 0.0
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def _process_path() -> str:
+    return os.path.join(_multiproc_dir, f"{os.getpid()}.json")
+
+def _serialize(counters, histograms) -> str:
+    return json.dumps({
+        "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+        "histograms": [[name, labels, histogram] for (name, labels), histogram in histograms.items()]
+    })
+
+def _copy_registry() -> Tuple[Dict, Dict]:
+    with _lock:
+        return dict(_counters), {k: {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]}
+                                 for k, v in _histograms.items()}
+
+def flush():
+    """Write this process's registry to the multiprocess directory, if enabled."""
+    global _last_flush, _flush_timer
+    if not _multiproc_dir:
+        return
+    from modules.utils import write_atomic
+    with _lock:
+        _last_flush = time.time()
+        _flush_timer = None
+    write_atomic(_process_path(), _serialize(*_copy_registry()))
+
+def _changed():
+    """Schedule a flush so other processes see this change within FLUSH_INTERVAL_SEC."""
+    global _flush_timer
+    if not _multiproc_dir:
+        return
+    with _lock:
+        if _flush_timer is not None:
+            return
+        delay = max(0.0, _last_flush + FLUSH_INTERVAL_SEC - time.time())
+        _flush_timer = threading.Timer(delay, flush)
+        _flush_timer.daemon = True
+    _flush_timer.start()
+
+def _registry() -> Tuple[Dict, Dict]:
+    """Counters and histograms of this process, or summed over all processes when multiprocess."""
+    counters, histograms = _copy_registry()
+    if not _multiproc_dir:
+        return counters, histograms
+
+    own = os.path.basename(_process_path())
+    for entry in os.scandir(_multiproc_dir):
+        if not entry.name.endswith(".json") or entry.name == own:
+            continue
+        try:
+            with open(entry.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        for name, labels, value in data["counters"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, other in data["histograms"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            histogram = histograms.setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+            histogram["buckets"] = [a + b for a, b in zip(histogram["buckets"], other["buckets"])]
+            histogram["sum"] += other["sum"]
+            histogram["count"] += other["count"]
+    return counters, histograms
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name: str, value: float = 1.0, **labels):
+    """Increment a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+    _changed()
+
+def observe(name: str, value: float, **labels):
+    """Record a value (in seconds) in a histogram."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+    _changed()
+
+def start_trace(trace_id: Optional[str] = None) -> str:
+    """Start a trace for the current request; spans recorded afterwards share its id."""
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    _trace_id.set(trace_id)
+    return trace_id
+
+def trace_event(event: Dict[str, Any]):
+    """Append one JSON line to the trace log, if enabled."""
+    if not _trace_log_path:
+        return
+    record = {"ts": round(time.time(), 6), "trace_id": _trace_id.get(), **event}
+    line = json.dumps(record, default=str)
+    with _trace_lock:
+        with open(_trace_log_path, "a") as f:
+            f.write(line + "\n")
+
+@contextmanager
+def span(stage: str, **attributes):
+    """
+    Time a pipeline stage.
+
+    Records docuwrangler_stage_seconds{stage=...} and, when tracing is enabled,
+    writes a JSON trace line with the duration and any attributes.
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        observe("docuwrangler_stage_seconds", duration, stage=stage)
+        trace_event({"stage": stage, "duration_ms": round(duration * 1000, 3), "status": status, **attributes})
+
+def count_api_call(kind: str, response=None):
+    """Count an API call and, when the response reports usage, its tokens."""
+    inc("docuwrangler_api_calls_total", kind=kind)
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    if prompt_tokens:
+        inc("docuwrangler_api_tokens_total", prompt_tokens, kind=kind, type="prompt")
+    if completion_tokens:
+        inc("docuwrangler_api_tokens_total", completion_tokens, kind=kind, type="completion")
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup."""
+    inc("docuwrangler_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def render_prometheus() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    counters, histograms = _registry()
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', f'{bound:g}'),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+def snapshot() -> Dict[str, Any]:
+    """JSON-friendly summary: per-stage totals, API calls, tokens and cache hit rates."""
+    counters, histograms = _registry()
+
+    stages = {}
+    for (name, labels), histogram in histograms.items():
+        if name == "docuwrangler_stage_seconds":
+            stage = dict(labels)["stage"]
+            stages[stage] = {
+                "count": histogram["count"],
+                "total_sec": round(histogram["sum"], 6),
+                "mean_ms": round(histogram["sum"] / histogram["count"] * 1000, 3) if histogram["count"] else 0.0
+            }
+
+    api_calls, tokens, caches = {}, {}, {}
+    for (name, labels), value in counters.items():
+        labels = dict(labels)
+        if name == "docuwrangler_api_calls_total":
+            api_calls[labels["kind"]] = value
+        elif name == "docuwrangler_api_tokens_total":
+            tokens[f"{labels['kind']}_{labels['type']}"] = value
+        elif name == "docuwrangler_cache_requests_total":
+            cache = caches.setdefault(labels["cache"], {"hit": 0.0, "miss": 0.0})
+            cache[labels["result"]] = value
+
+    for cache in caches.values():
+        lookups = cache["hit"] + cache["miss"]
+        cache["hit_rate"] = round(cache["hit"] / lookups, 4) if lookups else 0.0
+
+    return {"stages": stages, "api_calls": api_calls, "tokens": tokens, "caches": caches}
+
+def reset():
+    """Clear all metrics (used by benchmarks between runs)."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+    flush()
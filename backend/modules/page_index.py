@@ -0,0 +1,135 @@
+import numpy as np
+from typing import List, Dict, Any, Optional
+from modules import metrics
+from modules.embedding_store import normalize_rows, get_collection_name
+from modules.vector_store import write_records
+
+# Coarse per-page index for two-stage retrieval (config.PAGE_INDEX, on by default).
+#
+# Each page is summarized by the normalized centroid of its chunks' index vectors
+# and stored in a second, much smaller collection "<CHROMA_COLLECTION>_pages".
+# Single-document queries first pick the HIERARCHICAL_PAGES most similar pages
+# there and then search only those pages' chunks, so query cost grows with the
+# number of selected pages rather than the size of the document. Documents
+# indexed before the page index existed (or with it disabled) are searched flat;
+# `python -m modules.reindex` adds their pages.
+
+DEFAULT_HIERARCHICAL_PAGES = 5
+DIGEST_CHARS = 500
+
+def get_page_index_settings(config) -> Dict[str, Any]:
+    return {
+        "enabled": bool(getattr(config, "PAGE_INDEX", True)),
+        # Pages searched per query; 0 searches every chunk of the document
+        "pages": int(getattr(config, "HIERARCHICAL_PAGES", DEFAULT_HIERARCHICAL_PAGES))
+    }
+
+def get_page_collection_name(config) -> str:
+    return f"{get_collection_name(config)}_pages"
+
+def get_page_collection(chroma_client, config):
+    """The page collection, or None when it doesn't exist or hierarchical search is off."""
+    if get_page_index_settings(config)["pages"] <= 0:
+        return None
+    try:
+        return chroma_client.get_collection(get_page_collection_name(config))
+    except Exception:
+        return None
+
+def page_summaries(pdf_id: str, page_nums: List[int], vectors: np.ndarray,
+                   documents: List[str]) -> Dict[str, Any]:
+    """
+    Summarize chunks (their page numbers, index vectors and texts) into one entry per page.
+
+    Returns the ids, centroid embeddings, metadatas and text digests for the page collection.
+    """
+    page_nums = np.asarray(page_nums)
+    pages = sorted(set(page_nums.tolist()))
+    centroids = normalize_rows(np.stack([vectors[page_nums == page].mean(axis=0) for page in pages]))
+
+    digests = {page: "" for page in pages}
+    for page, text in zip(page_nums.tolist(), documents):
+        if len(digests[page]) < DIGEST_CHARS:
+            digests[page] = f"{digests[page]} {text}".strip()[:DIGEST_CHARS]
+
+    return {
+        "ids": [f"{pdf_id}_page_{page}" for page in pages],
+        "embeddings": centroids.tolist(),
+        "metadatas": [{"pdf_id": pdf_id, "page_num": page, "num_chunks": int((page_nums == page).sum())}
+                      for page in pages],
+        "documents": [digests[page] for page in pages]
+    }
+
+def delete_pages(chroma_client, pdf_id: str, config):
+    try:
+        collection = chroma_client.get_collection(get_page_collection_name(config))
+    except Exception:
+        return
+    collection.delete(where={"pdf_id": pdf_id})
+
+def index_pages(chroma_client, pdf_id: str, page_nums: List[int], vectors: np.ndarray,
+                documents: List[str], config, metadata: Dict[str, Any]):
+    """Replace a document's entries in the page collection (created with the chunk collection's metadata)."""
+    if not get_page_index_settings(config)["enabled"]:
+        return
+    with metrics.span("page_index"):
+        collection = chroma_client.get_or_create_collection(get_page_collection_name(config), metadata=metadata)
+        collection.delete(where={"pdf_id": pdf_id})
+        write_records(chroma_client, collection, config,
+                      **page_summaries(pdf_id, page_nums, np.asarray(vectors, dtype=np.float32), documents))
+
+def refresh_pages(chroma_client, chunk_collection, pdf_id: str, pages: List[int], config):
+    """Recompute page summaries after some of their chunks were re-embedded (deferred images)."""
+    if not pages or not get_page_index_settings(config)["enabled"]:
+        return
+    try:
+        collection = chroma_client.get_collection(get_page_collection_name(config))
+    except Exception:
+        return
+    chunks = chunk_collection.get(
+        where={"$and": [{"pdf_id": pdf_id}, {"page_num": {"$in": sorted(set(pages))}}]},
+        include=["embeddings", "metadatas", "documents"]
+    )
+    if not len(chunks["ids"]):
+        return
+    # Chunk ids end in their chunk index; keep ingestion order so digests match index_pages
+    order = sorted(range(len(chunks["ids"])), key=lambda i: chunks["metadatas"][i]["chunk_id"])
+    write_records(chroma_client, collection, config, upsert=True, **page_summaries(
+        pdf_id,
+        [chunks["metadatas"][i]["page_num"] for i in order],
+        np.asarray(chunks["embeddings"], dtype=np.float32)[order],
+        [chunks["documents"][i] for i in order]
+    ))
+
+def select_pages(page_collection, index_embedding: np.ndarray, pdf_id: str, top_k: int,
+                 config) -> Optional[List[int]]:
+    """
+    Stage one: the document's pages most similar to the question.
+
+    Takes the HIERARCHICAL_PAGES best pages, then further pages in rank order
+    until they hold at least top_k chunks. Returns None (search every chunk)
+    when the document has no page entries or the selection would cover all of it.
+    """
+    n_pages = get_page_index_settings(config)["pages"]
+    n_results = n_pages + top_k  # Every page holds at least one chunk
+    with metrics.span("page_select", n_results=n_results):
+        results = page_collection.query(
+            query_embeddings=[index_embedding.tolist()],
+            n_results=n_results,
+            where={"pdf_id": pdf_id},
+            include=["metadatas"]
+        )
+    ranked = results["metadatas"][0]
+    if not ranked:
+        return None
+
+    selected, num_chunks = [], 0
+    for metadata in ranked:
+        if len(selected) >= n_pages and num_chunks >= top_k:
+            break
+        selected.append(metadata["page_num"])
+        num_chunks += metadata["num_chunks"]
+
+    if len(selected) == len(ranked) and len(ranked) < n_results:
+        return None
+    return selected
@@ -1,9 +1,25 @@
 import os
+import numpy as np
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional, Tuple
 from openai import AzureOpenAI
-import chromadb
-from chromadb.config import Settings
 from modules import config
+from modules.embedding_store import (
+    to_index_vectors, get_storage_settings, get_collection_name, exact_rerank, load_pca
+)
+from modules.embeddings import get_embedding_provider, check_index_model, EmbeddingModelMismatch
+from modules.rerank import get_rerank_settings, get_cross_encoder, rerank
+from modules.page_index import get_page_collection, select_pages
+from modules.vector_store import get_chroma_client
+from modules import metrics
+from modules.documents import get_document, get_documents_by_tag
+from modules.tables import lookup_table_rows, direct_answer, format_pinned_rows, asks_for_figures
+from modules.vision import get_vision_mode, resolve_pending_images
+
+DEFAULT_MULTI_DOC_MAX_CHUNKS = 8
+DEFAULT_MULTI_DOC_MAX_REFERENCES = 5
+DEFAULT_TABLE_PINNED_CHUNKS = 1
 
 def initialize_clients():
     """Initialize and return Azure OpenAI and ChromaDB clients."""
@@ -14,10 +30,8 @@ def initialize_clients():
         api_version=config.AZURE_OPENAI_API_VERSION
     )
     
-    # Initialize ChromaDB client
-    chroma_client = chromadb.PersistentClient(
-        path=config.CHROMA_DB_PATH
-    )
+    # Shared ChromaDB client (embedded, or the vector-store server in CHROMA_SERVER_URL)
+    chroma_client = get_chroma_client(config)
     
     return azure_client, chroma_client
 
@@ -28,18 +42,17 @@ def get_last_pdf_id(chroma_client) -> Optional[str]:
     """
     try:
         # Get the collection
-        collection = chroma_client.get_collection("pdf_embeddings")
+        collection = chroma_client.get_collection(get_collection_name(config))
         
-        # Query to get all documents
-        results = collection.query(
-            query_embeddings=[[0.0] * 3072],  # Dummy embedding
-            n_results=1,
+        # Fetch a single record; no query embedding needed, so this works for any index dimension
+        results = collection.get(
+            limit=1,
             include=["metadatas"]
         )
         
-        if results and results["metadatas"] and results["metadatas"][0]:
+        if results and results["metadatas"]:
             # Extract PDF ID from metadata
-            return results["metadatas"][0][0].get("pdf_id")
+            return results["metadatas"][0].get("pdf_id")
         return None
     except Exception as e:
         print(f"Error retrieving last PDF ID: {str(e)}")
@@ -55,60 +68,178 @@ def get_last_pdf_id(chroma_client) -> Optional[str]:
         except:
             return None
 
-def query_vector_db(question: str, pdf_id: str, azure_client: AzureOpenAI, 
-                   chroma_client, top_k: int = 5) -> List[Dict[str, Any]]:
+def warm_index(chroma_client):
     """
-    Query the vector database for relevant chunks with paragraph-level references.
+    Load what the first question would otherwise pay for: the collection's ANN
+    index, the PCA projection and any local embedding or reranking model.
     """
-    try:
-        # Get the collection
-        collection = chroma_client.get_collection("pdf_embeddings")
-        
-        # Generate embedding for the question
-        embedding_response = azure_client.embeddings.create(
-            input=question,
-            model=config.AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT
-        )
-        question_embedding = embedding_response.data[0].embedding
-        
-        # Query the collection with pdf_id filter
+    with metrics.span("warm_index"):
+        if getattr(config, "EMBEDDING_PROVIDER", "azure") == "local":
+            get_embedding_provider(config)
+        if get_rerank_settings(config)["reranker"] == "cross_encoder":
+            get_cross_encoder(config)
+        if get_storage_settings(config)["mode"] == "pca":
+            load_pca(config)
+
+        try:
+            collection = chroma_client.get_collection(get_collection_name(config))
+        except Exception:
+            return  # Nothing indexed yet
+        # Chroma loads a segment's HNSW index on its first query
+        sample = collection.get(limit=1, include=["embeddings"])
+        if len(sample["ids"]):
+            for index in (collection, get_page_collection(chroma_client, config)):
+                if index is not None:
+                    index.query(query_embeddings=[list(sample["embeddings"][0])], n_results=1, include=[])
+
+def embed_question(question: str, azure_client: AzureOpenAI, collection):
+    """
+    Embed a question with the provider the index was built with.
+    Returns (full_embedding, index_embedding).
+    """
+    provider = get_embedding_provider(config, azure_client)
+    check_index_model(collection, provider)
+    with metrics.span("query_embed"):
+        question_embedding = provider.embed_query(question)
+    return question_embedding, to_index_vectors(question_embedding[None, :], config)[0]
+
+def search_collection(collection, question_embedding, index_embedding, pdf_id: Optional[str],
+                      top_k: int, page_collection=None) -> List[Dict[str, Any]]:
+    """
+    Run the ANN search for one document (or the whole index when pdf_id is None).
+    
+    With a page collection, a document's search is limited to the pages most
+    similar to the question (see modules.page_index).
+    """
+    # Over-fetch from the reduced index when the candidates are re-scored exactly
+    storage_settings = get_storage_settings(config)
+    n_results = top_k * storage_settings["overfetch"] if storage_settings["exact_rerank"] else top_k
+    
+    where = {"pdf_id": pdf_id} if pdf_id else None
+    pages = select_pages(page_collection, index_embedding, pdf_id, n_results, config) \
+        if pdf_id and page_collection is not None else None
+    if pages:
+        where = {"$and": [where, {"page_num": {"$in": pages}}]}
+    
+    # Query the collection with pdf_id (and page) filter
+    with metrics.span("ann_search", n_results=n_results):
         results = collection.query(
-            query_embeddings=[question_embedding],
-            n_results=top_k,
-            where={"pdf_id": pdf_id} if pdf_id else None,
+            query_embeddings=[index_embedding.tolist()],
+            n_results=n_results,
+            where=where,
             include=["documents", "metadatas", "distances"]
         )
-        
-        # Process results
-        relevant_chunks = []
-        for i in range(len(results["ids"][0])):
-            # Include paragraph reference for UI highlighting
-            metadata = results["metadatas"][0][i]
-            relevant_chunks.append({
-                "id": results["ids"][0][i],
-                "content": results["documents"][0][i],
-                "metadata": metadata,
-                "similarity": 1.0 - results["distances"][0][i],  # Convert distance to similarity
-                "highlight_info": {
-                    "page": metadata.get("page_num"),
-                    "paragraph_index": metadata.get("paragraph_index"),
-                    "position": {
-                        "x0": metadata.get("position_x0"),
-                        "y0": metadata.get("position_y0"),
-                        "x1": metadata.get("position_x1"),
-                        "y1": metadata.get("position_y1")
-                    }
+    
+    # Process results
+    relevant_chunks = []
+    for i in range(len(results["ids"][0])):
+        # Include paragraph reference for UI highlighting
+        metadata = results["metadatas"][0][i]
+        relevant_chunks.append({
+            "id": results["ids"][0][i],
+            "content": results["documents"][0][i],
+            "metadata": metadata,
+            "similarity": 1.0 - results["distances"][0][i],  # Convert distance to similarity
+            "highlight_info": {
+                "pdf_id": metadata.get("pdf_id"),
+                "page": metadata.get("page_num"),
+                "paragraph_index": metadata.get("paragraph_index"),
+                "position": {
+                    "x0": metadata.get("position_x0"),
+                    "y0": metadata.get("position_y0"),
+                    "x1": metadata.get("position_x1"),
+                    "y1": metadata.get("position_y1")
                 }
-            })
-        
-        # Sort by similarity (highest first)
+            }
+        })
+    
+    # Sort by similarity (highest first)
+    if storage_settings["exact_rerank"]:
+        with metrics.span("exact_rerank"):
+            relevant_chunks = exact_rerank(question_embedding, relevant_chunks, config)
+    else:
         relevant_chunks.sort(key=lambda x: x["similarity"], reverse=True)
-        
-        return relevant_chunks
     
+    return relevant_chunks[:top_k]
+
+def query_vector_db(question: str, pdf_id: str, azure_client: AzureOpenAI, 
+                   chroma_client, top_k: int = 5) -> List[Dict[str, Any]]:
+    """
+    Query the vector database for relevant chunks with paragraph-level references.
+    """
+    try:
+        # Get the collection
+        collection = chroma_client.get_collection(get_collection_name(config))
+        question_embedding, index_embedding = embed_question(question, azure_client, collection)
+        return search_collection(collection, question_embedding, index_embedding, pdf_id, top_k,
+                                 page_collection=get_page_collection(chroma_client, config))
+    
+    except EmbeddingModelMismatch:
+        raise
+    except Exception as e:
+        print(f"Error querying vector database: {str(e)}")
+        return []
+
+def query_documents(question: str, pdf_ids: List[str], azure_client: AzureOpenAI,
+                    chroma_client, top_k_per_doc: int) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Retrieve candidates from several documents concurrently.
+    The question is embedded once; one ANN search per document runs on a thread pool.
+    Returns {pdf_id: chunks}.
+    """
+    try:
+        collection = chroma_client.get_collection(get_collection_name(config))
+        question_embedding, index_embedding = embed_question(question, azure_client, collection)
+        page_collection = get_page_collection(chroma_client, config)
+    except EmbeddingModelMismatch:
+        raise
     except Exception as e:
         print(f"Error querying vector database: {str(e)}")
+        return {pdf_id: [] for pdf_id in pdf_ids}
+    
+    def search(pdf_id: str) -> List[Dict[str, Any]]:
+        try:
+            return search_collection(collection, question_embedding, index_embedding, pdf_id, top_k_per_doc,
+                                     page_collection=page_collection)
+        except Exception as e:
+            print(f"Error querying document {pdf_id}: {str(e)}")
+            return []
+    
+    workers = min(len(pdf_ids), int(getattr(config, "MULTI_DOC_MAX_WORKERS", 8)))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return dict(zip(pdf_ids, pool.map(search, pdf_ids)))
+
+def merge_document_candidates(question: str, candidates_by_doc: Dict[str, List[Dict[str, Any]]],
+                              max_chunks: int) -> List[Dict[str, Any]]:
+    """
+    Merge per-document candidates into one prompt context.
+    
+    Each document's candidates are reranked on their own, then their scores are
+    z-normalized within the document so that a report that matches everything
+    slightly better cannot crowd out the others. Every document with candidates
+    gets an equal quota first; remaining slots go to the best normalized scores.
+    """
+    ranked_by_doc = {}
+    for pdf_id, candidates in candidates_by_doc.items():
+        if not candidates:
+            continue
+        ranked = rerank(question, candidates, config, top_n=len(candidates))
+        scores = np.array([c.get("rerank_score", c["similarity"]) for c in ranked], dtype=np.float32)
+        spread = float(scores.std()) or 1.0
+        for chunk, score in zip(ranked, scores):
+            chunk["normalized_score"] = float((score - scores.mean()) / spread)
+        ranked_by_doc[pdf_id] = ranked
+    
+    if not ranked_by_doc:
         return []
+    
+    quota = max(1, max_chunks // len(ranked_by_doc))
+    selected = [chunk for ranked in ranked_by_doc.values() for chunk in ranked[:quota]]
+    leftovers = sorted((chunk for ranked in ranked_by_doc.values() for chunk in ranked[quota:]),
+                       key=lambda c: c["normalized_score"], reverse=True)
+    selected.extend(leftovers[:max(0, max_chunks - len(selected))])
+    selected.sort(key=lambda c: c["normalized_score"], reverse=True)
+    return selected[:max(max_chunks, len(ranked_by_doc))]
 
 def extract_confidence_and_references(answer_text: str) -> Tuple[float, List[Dict[str, Any]]]:
     """
@@ -181,21 +312,27 @@ def extract_confidence_and_references(answer_text: str) -> Tuple[float, List[Dic
     return confidence, references
 
 def generate_answer(question: str, relevant_chunks: List[Dict[str, Any]], 
-                   azure_client: AzureOpenAI) -> Tuple[str, float, List[Dict[str, Any]]]:
+                   azure_client: AzureOpenAI, document_labels: Optional[Dict[str, str]] = None,
+                   max_references: int = 3, pinned_rows: Optional[str] = None) -> Tuple[str, float, List[Dict[str, Any]]]:
     """
     Generate an answer with page references in text but paragraph-level info for UI.
+    When document_labels is given, context and references are qualified by document.
+    pinned_rows (exact table rows from the table index) are placed before the chunks.
     """
-    if not relevant_chunks:
+    if not relevant_chunks and not pinned_rows:
         return "I couldn't find any relevant information to answer your question.", 0.0, []
     
     # Prepare context from relevant chunks
-    context_parts = []
+    context_parts = [pinned_rows] if pinned_rows else []
     for chunk in relevant_chunks:
         metadata = chunk["metadata"]
         page_num = metadata.get("page_num", "unknown")
         
-        # Add source information (only page number for the prompt)
-        source_info = f"--- Content from page {page_num}"
+        # Add source information (only document and page number for the prompt)
+        if document_labels:
+            source_info = f"--- Content from {document_labels.get(metadata.get('pdf_id'), metadata.get('pdf_id'))}, page {page_num}"
+        else:
+            source_info = f"--- Content from page {page_num}"
         if "half" in metadata:
             source_info += f", {metadata['half']} half"
         source_info += " ---"
@@ -205,9 +342,12 @@ def generate_answer(question: str, relevant_chunks: List[Dict[str, Any]],
     
     context = "\n\n".join(context_parts)
     
+    source_description = "several PDF documents" if document_labels else "a PDF document"
+    reference_format = "list of documents and page numbers used" if document_labels else "list of page numbers used"
+    
     # Prepare the prompt - only mention page numbers
     prompt = f"""
-    Based on the following information from a PDF document, please answer the query.
+    Based on the following information from {source_description}, please answer the query.
     
     Query: {question}
     
@@ -225,32 +365,42 @@ def generate_answer(question: str, relevant_chunks: List[Dict[str, Any]],
     
     Confidence: [score between 0 and 1]
     
-    References: [list of page numbers used]
+    References: [{reference_format}]
     """
     
     # Generate response
-    response = azure_client.chat.completions.create(
-        model=config.AZURE_OPENAI_VISION_DEPLOYMENT,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that answers questions based on provided document context."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.3,
-        max_tokens=800
-    )
+    with metrics.span("completion", chunks=len(relevant_chunks), pinned_rows=bool(pinned_rows)):
+        response = azure_client.chat.completions.create(
+            model=config.AZURE_OPENAI_VISION_DEPLOYMENT,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that answers questions based on provided document context."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.3,
+            max_tokens=800
+        )
+    metrics.count_api_call("chat", response)
     
     answer_text = response.choices[0].message.content
     
     # Extract confidence and references from the answer
     confidence, page_references = extract_confidence_and_references(answer_text)
     
-    # Create detailed references with paragraph info for UI highlighting
+    # Create detailed references with paragraph info for UI highlighting:
+    # the best chunk of each of the top max_references pages
     detailed_references = []
-    for chunk in relevant_chunks[:3]:  # Use top 3 chunks
+    seen_pages = set()
+    for chunk in relevant_chunks:
+        if len(detailed_references) >= max_references:
+            break
         highlight_info = chunk.get("highlight_info", {})
         page_num = highlight_info.get("page", "unknown")
+        if (highlight_info.get("pdf_id"), page_num) in seen_pages:
+            continue
+        seen_pages.add((highlight_info.get("pdf_id"), page_num))
         
         detailed_references.append({
+            "pdf_id": highlight_info.get("pdf_id"),
             "page": page_num,
             "paragraph_index": highlight_info.get("paragraph_index"),
             "position": highlight_info.get("position", {}),
@@ -264,13 +414,105 @@ def generate_answer(question: str, relevant_chunks: List[Dict[str, Any]],
     
     return answer_text, confidence, detailed_references
 
-def answer_question(question: str, pdf_id: Optional[str] = None) -> Dict[str, Any]:
+def document_label(pdf_id: str) -> str:
+    """Human-readable document name for prompts and references."""
+    document = get_document(config, pdf_id)
+    if document and document.get("filename"):
+        return os.path.splitext(document["filename"])[0]
+    return pdf_id
+
+def document_labels(pdf_ids: List[str]) -> Dict[str, str]:
+    """Labels for the documents of one question; names shared by several documents get their pdf_id appended."""
+    labels = {pdf_id: document_label(pdf_id) for pdf_id in pdf_ids}
+    counts = Counter(labels.values())
+    return {pdf_id: f"{label} ({pdf_id})" if counts[label] > 1 and label != pdf_id else label
+            for pdf_id, label in labels.items()}
+
+def answer_across_documents(question: str, pdf_ids: List[str], azure_client: AzureOpenAI,
+                            chroma_client) -> Dict[str, Any]:
+    """
+    Answer one question over several documents with a single GPT-4o call.
+    """
+    rerank_settings = get_rerank_settings(config)
+    per_doc_candidates = max(rerank_settings["top_n"], rerank_settings["candidates"] // len(pdf_ids))
+    try:
+        candidates_by_doc = query_documents(question, pdf_ids, azure_client, chroma_client, per_doc_candidates)
+    except EmbeddingModelMismatch as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    
+    max_chunks = int(getattr(config, "MULTI_DOC_MAX_CHUNKS", DEFAULT_MULTI_DOC_MAX_CHUNKS))
+    with metrics.span("rerank", candidates=sum(len(c) for c in candidates_by_doc.values())):
+        relevant_chunks = merge_document_candidates(question, candidates_by_doc, max_chunks)
+    if get_vision_mode(config) == "lazy":
+        relevant_chunks = resolve_pending_images(config, azure_client, chroma_client, relevant_chunks)
+    
+    labels = document_labels(pdf_ids)
+    answer_text, confidence, detailed_references = generate_answer(
+        question=question,
+        relevant_chunks=relevant_chunks,
+        azure_client=azure_client,
+        document_labels=labels,
+        max_references=int(getattr(config, "MULTI_DOC_MAX_REFERENCES", DEFAULT_MULTI_DOC_MAX_REFERENCES))
+    )
+    
+    return {
+        "status": "success",
+        "answer": answer_text,
+        "confidence": round(confidence, 2),
+        "references": [f"{labels.get(ref['pdf_id'], ref['pdf_id'])}, Page {ref['page']}" for ref in detailed_references],
+        "highlight_info": detailed_references,
+        "pdf_id": None,
+        "pdf_ids": pdf_ids
+    }
+
+def table_answer_response(table_answer: Dict[str, Any], pdf_id: str) -> Dict[str, Any]:
+    """Build an /ask response for an answer read directly from the table index."""
+    row = table_answer["row"]
+    return {
+        "status": "success",
+        "answer": table_answer["answer"],
+        "confidence": 0.95,
+        "references": [f"Page {row['page_num']}"],
+        "highlight_info": [{
+            "pdf_id": row["pdf_id"],
+            "page": row["page_num"],
+            "paragraph_index": None,
+            "position": row["position"],
+            "preview": format_pinned_rows([row]).split("\n", 1)[1],
+            "similarity": 1.0
+        }],
+        "pdf_id": pdf_id,
+        "source": "table_index"
+    }
+
+def answer_question(question: str, pdf_id: Optional[str] = None, pdf_ids: Optional[List[str]] = None,
+                    collection: Optional[str] = None) -> Dict[str, Any]:
     """
     Main function to answer a question with paragraph-level references for UI highlighting.
+    Accepts a single pdf_id, a list of pdf_ids, or a collection tag; several documents
+    are searched concurrently and answered with one generation.
     """
     # Initialize clients
     azure_client, chroma_client = initialize_clients()
     
+    # Resolve a collection tag to its documents
+    if collection:
+        pdf_ids = get_documents_by_tag(config, collection)
+        if not pdf_ids:
+            return {
+                "status": "error",
+                "message": f"No PDF documents found in collection '{collection}'."
+            }
+    
+    if pdf_ids:
+        pdf_ids = list(dict.fromkeys(pdf_ids))
+        if len(pdf_ids) > 1:
+            return answer_across_documents(question, pdf_ids, azure_client, chroma_client)
+        pdf_id = pdf_ids[0]
+    
     # If pdf_id is not provided, get the last PDF ID
     if not pdf_id:
         pdf_id = get_last_pdf_id(chroma_client)
@@ -280,20 +522,51 @@ def answer_question(question: str, pdf_id: Optional[str] = None) -> Dict[str, An
                 "message": "No PDF documents found in the database."
             }
     
-    # Query the vector database
-    relevant_chunks = query_vector_db(
-        question=question,
-        pdf_id=pdf_id,
-        azure_client=azure_client,
-        chroma_client=chroma_client,
-        top_k=5
-    )
+    # Plain numeric questions about a table row are answered from the table index;
+    # other questions that merely mention a row label ("tax risks") are left alone
+    table_matches = []
+    if getattr(config, "TABLE_INDEX", True) and asks_for_figures(question):
+        with metrics.span("table_lookup"):
+            table_matches = lookup_table_rows(config, question, [pdf_id])
+        table_answer = direct_answer(question, table_matches)
+        metrics.record_cache("table_answer", table_answer is not None)
+        if table_answer:
+            return table_answer_response(table_answer, pdf_id)
+    
+    # Query the vector database for a wide candidate set
+    rerank_settings = get_rerank_settings(config)
+    try:
+        candidates = query_vector_db(
+            question=question,
+            pdf_id=pdf_id,
+            azure_client=azure_client,
+            chroma_client=chroma_client,
+            top_k=rerank_settings["candidates"]
+        )
+    except EmbeddingModelMismatch as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    
+    # Keep only the best few chunks for the prompt
+    with metrics.span("rerank", candidates=len(candidates)):
+        relevant_chunks = rerank(question, candidates, config)
+    
+    # Matched table rows go into the prompt verbatim and replace most of the chunks
+    if table_matches:
+        relevant_chunks = relevant_chunks[:int(getattr(config, "TABLE_PINNED_CHUNKS", DEFAULT_TABLE_PINNED_CHUNKS))]
+    
+    # Describe placeholder images that made it into the prompt (lazy vision mode)
+    if get_vision_mode(config) == "lazy":
+        relevant_chunks = resolve_pending_images(config, azure_client, chroma_client, relevant_chunks)
     
     # Generate answer
     answer_text, confidence, detailed_references = generate_answer(
         question=question,
         relevant_chunks=relevant_chunks,
-        azure_client=azure_client
+        azure_client=azure_client,
+        pinned_rows=format_pinned_rows(table_matches) if table_matches else None
     )
     
     # Format simple page references for display in the answer
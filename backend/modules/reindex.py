@@ -0,0 +1,138 @@
+"""
+Re-chunk and re-embed stored documents from their extraction artifacts.
+
+Reads the per-page output persisted at ingest (see modules.artifacts) instead of
+re-parsing the PDFs, so chunking and layout experiments only pay for embeddings:
+
+    python -m modules.reindex --all
+    python -m modules.reindex --pdf-id annual_2023 --chunk-size 1500 --chunk-overlap 300
+    python -m modules.reindex --all --collection chunks_1500 --chunk-size 1500
+    python -m modules.reindex --all --text-from-words
+    python -m modules.reindex --all --fit-pca
+
+Each document's chunks are replaced in the target collection (CHROMA_COLLECTION
+unless --collection is given). Image descriptions come from the description
+cache, so they are only requested again for images never described before.
+
+With EMBEDDING_STORAGE_MODE = "pca", --fit-pca fits the projection on the chunks
+of every document re-indexed (at least EMBEDDING_DIMENSIONS of them) before
+storing any; pass --all so the whole collection uses the new projection.
+"""
+import sys
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any
+from modules import config, metrics
+from modules.artifacts import load_artifacts
+from modules.documents import get_document, list_documents
+from modules.embedding_store import get_collection_name, get_storage_settings, fit_pca, save_pca
+from modules.extract import create_intelligent_chunks, chunk_settings, generate_multimodal_embeddings, store_extracted_pdf
+from modules.qna import initialize_clients
+
+def rebuild_document(pdf_id: str, azure_client, text_from_words: bool = False) -> Dict[str, Any]:
+    """Chunk and embed a document from its artifacts, returning extract_and_embed_pdf-shaped output."""
+    document = get_document(config, pdf_id)
+    if not document:
+        raise ValueError(f"Unknown pdf_id '{pdf_id}'")
+    artifacts = load_artifacts(config, document["sha256"])
+    if artifacts is None:
+        raise ValueError(f"No extraction artifacts for '{pdf_id}'; upload or bulk-ingest it again to create them")
+
+    pages, all_chunks = [], []
+    for page_num in range(1, artifacts.num_pages + 1):
+        content_blocks = artifacts.page_blocks(page_num, text_from_words)
+        with metrics.span("chunk", page=page_num):
+            chunks = create_intelligent_chunks(content_blocks, **chunk_settings(config))
+        all_chunks.extend(chunks)
+        pages.append({
+            "num_text_blocks": sum(1 for block in content_blocks if block["type"] == "text"),
+            "num_image_blocks": sum(1 for block in content_blocks if block["type"] == "image"),
+            "blocks": chunks,
+            "tables": artifacts.page_tables(page_num)
+        })
+
+    # One call for the whole document so embedding batches are full
+    generate_multimodal_embeddings(all_chunks, azure_client, config)
+    return {"pdf_id": pdf_id, "num_pages": artifacts.num_pages, "pages": pages}
+
+def fit_projection(extracted: List[Dict[str, Any]]):
+    """Fit and save the PCA projection on the chunk embeddings of the rebuilt documents."""
+    embeddings = np.stack([block["embedding"] for document in extracted
+                           for page in document["pages"] for block in page["blocks"]])
+    with metrics.span("fit_pca", chunks=len(embeddings)):
+        save_pca(config, fit_pca(embeddings, get_storage_settings(config)["dimensions"]))
+    print(f"Fitted the PCA projection on {len(embeddings)} chunks")
+
+def run(pdf_ids: List[str], workers: int, text_from_words: bool, refit_pca: bool = False) -> Dict[str, Any]:
+    azure_client, chroma_client = initialize_clients()
+    summary = {"documents": 0, "failed": 0, "pages": 0, "chunks": 0}
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(rebuild_document, pdf_id, azure_client, text_from_words): pdf_id for pdf_id in pdf_ids}
+        completed = as_completed(futures)
+        if refit_pca:
+            # Every document is embedded before the projection exists, so all are stored with it
+            completed = list(completed)
+            fit_projection([future.result() for future in completed if future.exception() is None])
+        for future in completed:
+            pdf_id = futures[future]
+            try:
+                # Index writes stay on this thread, one document at a time
+                extracted = future.result()
+                details = store_extracted_pdf(extracted, chroma_client, config)
+            except Exception as e:
+                print(f"FAILED {pdf_id}: {str(e)}")
+                summary["failed"] += 1
+                continue
+            summary["documents"] += 1
+            summary["pages"] += details["num_pages"]
+            summary["chunks"] += details["num_chunks"]
+            print(f"[{summary['documents'] + summary['failed']}/{len(pdf_ids)}] {pdf_id}: "
+                  f"{details['num_chunks']} chunks from {details['num_pages']} pages")
+
+    summary["elapsed_sec"] = time.perf_counter() - start
+    summary["api_calls"] = metrics.snapshot()["api_calls"]
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--pdf-id", action="append", help="Document to re-index (repeatable)")
+    target.add_argument("--all", action="store_true", help="Re-index every registered document")
+    parser.add_argument("--chunk-size", type=int, help="Overrides CHUNK_SIZE")
+    parser.add_argument("--chunk-overlap", type=int, help="Overrides CHUNK_OVERLAP")
+    parser.add_argument("--collection", help="Write to this Chroma collection instead of CHROMA_COLLECTION")
+    parser.add_argument("--text-from-words", action="store_true",
+                        help="Rebuild text blocks from the stored words instead of the stored blocks")
+    parser.add_argument("--fit-pca", action="store_true",
+                        help="Fit the PCA projection on these documents first (EMBEDDING_STORAGE_MODE = \"pca\")")
+    parser.add_argument("--workers", type=int, default=4, help="Documents prepared concurrently")
+    args = parser.parse_args()
+
+    if args.chunk_size is not None:
+        config.CHUNK_SIZE = args.chunk_size
+    if args.chunk_overlap is not None:
+        config.CHUNK_OVERLAP = args.chunk_overlap
+    if args.collection:
+        config.CHROMA_COLLECTION = args.collection
+
+    if args.fit_pca and get_storage_settings(config)["mode"] != "pca":
+        parser.error('--fit-pca needs EMBEDDING_STORAGE_MODE = "pca"')
+
+    pdf_ids = [document["pdf_id"] for document in list_documents(config)] if args.all else args.pdf_id
+    try:
+        summary = run(pdf_ids, max(1, args.workers), args.text_from_words, args.fit_pca)
+    except ValueError as e:
+        # Too few chunks to fit the projection; nothing has been stored
+        sys.exit(f"Not re-indexed: {e}")
+    calls = ", ".join(f"{int(v)} {k}" for k, v in summary["api_calls"].items()) or "no"
+    print(f"\nRe-indexed {summary['documents']} documents ({summary['pages']} pages, {summary['chunks']} chunks) "
+          f"into '{get_collection_name(config)}' in {summary['elapsed_sec']:.1f}s with {calls} API calls; "
+          f"failed {summary['failed']}.")
+    sys.exit(1 if summary["failed"] else 0)
+
+if __name__ == "__main__":
+    main()
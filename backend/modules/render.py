@@ -0,0 +1,148 @@
+import io
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Iterable
+import fitz  # PyMuPDF
+from modules import metrics
+from modules.documents import get_document, pdf_path
+from modules.utils import get_data_dir, write_atomic
+
+FORMATS = {"png": "image/png", "webp": "image/webp"}
+
+DEFAULT_ZOOM = 1.5
+MIN_ZOOM, MAX_ZOOM = 0.25, 4.0
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_PRERENDER_WORKERS = 2
+# What the citation panel requests (CitationSidePanel: ?format=webp at the default zoom)
+DEFAULT_PRERENDER_FORMAT = "webp"
+
+class RenderError(ValueError):
+    """Raised for render requests that cannot be served (bad page, zoom, format or bbox)."""
+
+class DocumentNotStored(RenderError):
+    """Raised when no original PDF is stored for a pdf_id."""
+
+def _cache_dir(config) -> str:
+    return get_data_dir(config, "renders")
+
+def render_key(sha256: str, page: int, zoom: float, fmt: str, bbox: Optional[Tuple[float, ...]]) -> str:
+    """Stable cache key and ETag for one rendering of a stored PDF."""
+    bbox_part = ",".join(f"{v:.1f}" for v in bbox) if bbox else "page"
+    raw = f"{sha256}:{page}:{zoom:.3f}:{fmt}:{bbox_part}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def rasterize(path: str, page: int, zoom: float, fmt: str, bbox: Optional[Tuple[float, ...]]) -> bytes:
+    """Render a page (1-based), or a bbox crop of it, to PNG or WebP bytes."""
+    doc = fitz.open(path)
+    try:
+        if page < 1 or page > len(doc):
+            raise RenderError(f"Page {page} is out of range (document has {len(doc)} pages)")
+        pdf_page = doc[page - 1]
+        clip = None
+        if bbox:
+            clip = fitz.Rect(*bbox) & pdf_page.rect
+            if clip.is_empty:
+                raise RenderError(f"bbox {bbox} does not intersect page {page}")
+        pixmap = pdf_page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+        if fmt == "png":
+            return pixmap.tobytes("png")
+
+        from PIL import Image
+        image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+        output = io.BytesIO()
+        image.save(output, format="WEBP", quality=85)
+        return output.getvalue()
+    finally:
+        doc.close()
+
+def _evict(config, cache_dir: str):
+    """Delete least recently used renders until the cache fits RENDER_CACHE_MAX_BYTES."""
+    max_bytes = int(getattr(config, "RENDER_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+    entries = []
+    total = 0
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    if total <= max_bytes:
+        return
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        if total <= max_bytes:
+            break
+
+def render(config, pdf_id: str, page: int, zoom: float = DEFAULT_ZOOM, fmt: str = "png",
+           bbox: Optional[Tuple[float, ...]] = None) -> Tuple[bytes, str]:
+    """
+    Return (image bytes, etag) of a rendering, from the cache or rasterized on a miss.
+
+    Cached files are touched on every hit, so eviction by mtime is LRU. The bytes
+    are returned rather than the cache path because another request may evict
+    the file before it is sent.
+    """
+    if fmt not in FORMATS:
+        raise RenderError(f"Unsupported format '{fmt}', expected one of {sorted(FORMATS)}")
+    if not MIN_ZOOM <= zoom <= MAX_ZOOM:
+        raise RenderError(f"zoom must be between {MIN_ZOOM} and {MAX_ZOOM}")
+    if bbox is not None and len(bbox) != 4:
+        raise RenderError("bbox must be x0,y0,x1,y1")
+
+    document = get_document(config, pdf_id)
+    if not document or not os.path.exists(pdf_path(config, document["sha256"])):
+        raise DocumentNotStored(f"No stored PDF for pdf_id '{pdf_id}'")
+
+    key = render_key(document["sha256"], page, zoom, fmt, bbox)
+    cache_dir = _cache_dir(config)
+    path = os.path.join(cache_dir, f"{key}.{fmt}")
+
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        metrics.record_cache("render", True)
+        return data, key
+    except FileNotFoundError:
+        pass
+
+    metrics.record_cache("render", False)
+    with metrics.span("render", page=page, zoom=zoom, crop=bbox is not None):
+        data = rasterize(pdf_path(config, document["sha256"]), page, zoom, fmt, bbox)
+
+    write_atomic(path, data)
+    _evict(config, cache_dir)
+    return data, key
+
+_prerender_pool: Optional[ThreadPoolExecutor] = None
+_prerender_lock = threading.Lock()
+
+def prerender_pages(config, pdf_id: str, pages: Iterable[int], zoom: float = DEFAULT_ZOOM, fmt: Optional[str] = None):
+    """
+    Render cited pages in the background so the first citation click is a cache hit.
+
+    Renders are cached per format and zoom, so these must match what the frontend
+    requests: RENDER_PRERENDER_FORMAT (default webp) at the default zoom.
+
+    Failures are logged and otherwise ignored; the endpoint renders on demand anyway.
+    """
+    global _prerender_pool
+    fmt = fmt or getattr(config, "RENDER_PRERENDER_FORMAT", DEFAULT_PRERENDER_FORMAT)
+    with _prerender_lock:
+        if _prerender_pool is None:
+            workers = int(getattr(config, "RENDER_PRERENDER_WORKERS", DEFAULT_PRERENDER_WORKERS))
+            _prerender_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prerender")
+
+    def _render(page: int):
+        try:
+            render(config, pdf_id, page, zoom, fmt)
+        except Exception as e:
+            print(f"Error pre-rendering page {page} of {pdf_id}: {str(e)}")
+
+    for page in sorted(set(pages)):
+        _prerender_pool.submit(_render, page)
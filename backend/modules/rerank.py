@@ -0,0 +1,180 @@
+import re
+import math
+import time
+import threading
+import numpy as np
+from collections import Counter
+from typing import List, Dict, Any, Optional
+from modules.utils import import_optional
+
+# Reranker backends (config.RERANKER):
+# - "features": CPU-only scorer combining similarity, term overlap and page priors
+# - "cross_encoder": a small ONNX cross-encoder refines the feature ranking
+# - "none": keep the vector-similarity order
+RERANKERS = ("features", "cross_encoder", "none")
+
+DEFAULT_RETRIEVAL_CANDIDATES = 30
+DEFAULT_RERANK_TOP_N = 3
+DEFAULT_RERANK_BUDGET_MS = 50.0
+
+# Weights of the feature scorer; similarity is the dominant signal
+FEATURE_WEIGHTS = {
+    "similarity": 1.0,
+    "term_overlap": 0.35,
+    "page_support": 0.1,
+    "numeric_match": 0.05,
+    "toc_penalty": -0.2
+}
+
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "and", "or", "is", "are", "was", "were",
+    "what", "which", "who", "how", "when", "where", "why", "did", "does", "do", "by", "with",
+    "this", "that", "these", "those", "from", "at", "as", "be", "it", "its", "our", "their"
+}
+
+NUMERIC_QUESTION = re.compile(r"\b(how (much|many)|what (was|is|were) the|percentage|ratio|margin|total|amount)\b|%")
+
+def get_rerank_settings(config) -> Dict[str, Any]:
+    """Read the reranking settings from config."""
+    reranker = getattr(config, "RERANKER", "features")
+    if reranker not in RERANKERS:
+        raise ValueError(f"Unknown RERANKER '{reranker}', expected one of {RERANKERS}")
+    return {
+        "reranker": reranker,
+        "candidates": int(getattr(config, "RETRIEVAL_CANDIDATES", DEFAULT_RETRIEVAL_CANDIDATES)),
+        "top_n": int(getattr(config, "RERANK_TOP_N", DEFAULT_RERANK_TOP_N)),
+        "budget_ms": float(getattr(config, "RERANK_BUDGET_MS", DEFAULT_RERANK_BUDGET_MS))
+    }
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokens without stopwords."""
+    return [t for t in re.findall(r"[a-z0-9]+(?:\.[0-9]+)?", text.lower()) if t not in STOPWORDS]
+
+def term_overlap_scores(question: str, contents: List[str]) -> np.ndarray:
+    """
+    IDF-weighted fraction of question terms present in each candidate.
+
+    IDF is computed over the candidate set, so terms that appear everywhere
+    in the retrieved context (e.g. the company name) carry little weight.
+    """
+    query_terms = set(tokenize(question))
+    if not query_terms or not contents:
+        return np.zeros(len(contents), dtype=np.float32)
+
+    doc_terms = [set(tokenize(content)) for content in contents]
+    n = len(contents)
+    idf = {t: math.log(1 + n / (1 + sum(t in terms for terms in doc_terms))) for t in query_terms}
+    total = sum(idf.values()) or 1.0
+    return np.array([sum(idf[t] for t in query_terms if t in terms) / total for terms in doc_terms],
+                    dtype=np.float32)
+
+def is_toc_like(text: str) -> bool:
+    """Heuristic for tables of contents and index pages: mostly short lines ending in page numbers."""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) < 5:
+        return False
+    numbered = sum(1 for line in lines if re.search(r"(\.{3,}|\s)\d{1,3}$", line))
+    return numbered / len(lines) > 0.5
+
+def feature_scores(question: str, candidates: List[Dict[str, Any]]) -> np.ndarray:
+    """Score candidates by similarity, term overlap and page priors."""
+    contents = [c["content"] or "" for c in candidates]
+    similarity = np.array([c["similarity"] for c in candidates], dtype=np.float32)
+    overlap = term_overlap_scores(question, contents)
+
+    # Pages contributing several candidates are more likely to hold the answer
+    page_counts = Counter((c["metadata"].get("pdf_id"), c["metadata"].get("page_num")) for c in candidates)
+    support = np.array([
+        (page_counts[(c["metadata"].get("pdf_id"), c["metadata"].get("page_num"))] - 1) / len(candidates)
+        for c in candidates
+    ], dtype=np.float32)
+
+    numeric = np.zeros(len(candidates), dtype=np.float32)
+    if NUMERIC_QUESTION.search(question.lower()):
+        numeric = np.array([1.0 if re.search(r"\d", text) else 0.0 for text in contents], dtype=np.float32)
+
+    toc = np.array([1.0 if is_toc_like(text) else 0.0 for text in contents], dtype=np.float32)
+
+    return (FEATURE_WEIGHTS["similarity"] * similarity
+            + FEATURE_WEIGHTS["term_overlap"] * overlap
+            + FEATURE_WEIGHTS["page_support"] * support
+            + FEATURE_WEIGHTS["numeric_match"] * numeric
+            + FEATURE_WEIGHTS["toc_penalty"] * toc)
+
+class CrossEncoder:
+    """ONNX cross-encoder (e.g. an exported ms-marco MiniLM) scored on CPU with onnxruntime."""
+
+    def __init__(self, model_path: str, tokenizer_path: str, max_length: int = 256, batch_size: int = 8):
+        onnxruntime = import_optional("onnxruntime", "onnxruntime", "RERANKER = \"cross_encoder\"")
+        Tokenizer = import_optional("tokenizers", "tokenizers", "RERANKER = \"cross_encoder\"").Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = 1  # Requests are served concurrently; one core each
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+    def score(self, question: str, passages: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch([(question, p) for p in passages])
+        features = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64)
+        }
+        logits = self.session.run(None, {k: v for k, v in features.items() if k in self.input_names})[0]
+        return np.asarray(logits, dtype=np.float32).reshape(len(passages), -1)[:, -1]
+
+_cross_encoder: Optional[CrossEncoder] = None
+_cross_encoder_lock = threading.Lock()
+
+def get_cross_encoder(config) -> CrossEncoder:
+    """Load the cross-encoder once per process."""
+    global _cross_encoder
+    with _cross_encoder_lock:
+        if _cross_encoder is None:
+            _cross_encoder = CrossEncoder(
+                model_path=config.RERANK_ONNX_MODEL,
+                tokenizer_path=config.RERANK_TOKENIZER,
+                max_length=int(getattr(config, "RERANK_MAX_LENGTH", 256))
+            )
+    return _cross_encoder
+
+def rerank(question: str, candidates: List[Dict[str, Any]], config,
+           top_n: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Rerank retrieved candidates and return the best top_n for the prompt.
+
+    The feature scorer always runs (well under a millisecond for 30 candidates).
+    The cross-encoder then refines the head of that ranking batch by batch until
+    RERANK_BUDGET_MS is spent; candidates it did not reach keep the feature order.
+
+    Each returned chunk gets a "rerank_score" field.
+    """
+    settings = get_rerank_settings(config)
+    top_n = top_n or settings["top_n"]
+    if not candidates or settings["reranker"] == "none":
+        return candidates[:top_n]
+
+    start = time.perf_counter()
+    scores = feature_scores(question, candidates)
+    for chunk, score in zip(candidates, scores):
+        chunk["rerank_score"] = float(score)
+    ranked = sorted(candidates, key=lambda c: c["rerank_score"], reverse=True)
+
+    if settings["reranker"] == "cross_encoder":
+        encoder = get_cross_encoder(config)
+        scored = []
+        for i in range(0, len(ranked), encoder.batch_size):
+            if (time.perf_counter() - start) * 1000 > settings["budget_ms"] and len(scored) >= top_n:
+                break
+            batch = ranked[i:i + encoder.batch_size]
+            for chunk, score in zip(batch, encoder.score(question, [c["content"] or "" for c in batch])):
+                chunk["rerank_score"] = float(score)
+            scored.extend(batch)
+        scored.sort(key=lambda c: c["rerank_score"], reverse=True)
+        ranked = scored + ranked[len(scored):]
+
+    return ranked[:top_n]
@@ -0,0 +1,181 @@
+import os
+import time
+import pickle
+import hashlib
+import threading
+import uuid
+from typing import Any, Callable, Dict, Tuple
+from modules import metrics
+from modules.utils import get_data_dir, write_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process variant is available
+    fcntl = None
+
+# Single-flight coalescing of identical concurrent work (config.SINGLE_FLIGHT, on by
+# default): the first caller for a key runs the computation and every caller that
+# arrives while it is in flight receives the same result (or exception).
+#
+# With config.SINGLE_FLIGHT_FILE_LOCKS, the leader of each process also takes an
+# flock on DATA_DIR/singleflight/<key>.lock, so leaders in other worker processes
+# on the host wait for it instead of recomputing. The result is handed over through
+# a file named after the flight's generation, written only when another process is
+# waiting and removed by the last one to read it; a caller that arrives after the
+# flight has ended runs its own.
+
+FLIGHT_POLL_SEC = 0.01
+# Files left behind by a process that died mid-flight
+STALE_FILE_SEC = 3600.0
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key across the threads of a process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run fn once for all concurrent callers of key; returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+_flight = SingleFlight()
+
+def _key_path(config, key: str, suffix: str) -> str:
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(get_data_dir(config, "singleflight"), f"{digest}{suffix}")
+
+def _evict_stale(directory: str):
+    now = time.time()
+    for entry in os.scandir(directory):
+        if entry.name.endswith((".result", ".readers")):
+            try:
+                if now - entry.stat().st_mtime > STALE_FILE_SEC:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+
+def _remove(*paths: str):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _lead(config, key: str, fn: Callable[[], Any]) -> Any:
+    """Run fn as this key's flight (the key lock is held) and hand the result to waiting processes."""
+    generation = uuid.uuid4().hex
+    flight_path = _key_path(config, key, ".flight")
+    write_atomic(flight_path, generation)
+    try:
+        result = fn()
+        readers_path = _key_path(config, f"{key}:{generation}", ".readers")
+        with open(readers_path, "a") as readers:
+            if _try_flock(readers, fcntl.LOCK_EX):
+                # Nobody is waiting for this flight
+                _remove(readers_path)
+            else:
+                write_atomic(_key_path(config, f"{key}:{generation}", ".result"),
+                             pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        return result
+    finally:
+        write_atomic(flight_path, "")
+        _evict_stale(os.path.dirname(flight_path))
+
+def _await(config, key: str, generation: str, lock_file) -> Tuple[bool, Any]:
+    """Wait for another process's flight; returns (True, result), or (False, None) if it left none."""
+    result_path = _key_path(config, f"{key}:{generation}", ".result")
+    readers_path = _key_path(config, f"{key}:{generation}", ".readers")
+    with open(readers_path, "a") as readers:
+        fcntl.flock(readers, fcntl.LOCK_SH)
+        fcntl.flock(lock_file, fcntl.LOCK_SH)  # Granted once the flight releases the key lock
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        try:
+            with open(result_path, "rb") as f:
+                found, result = True, pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            found, result = False, None
+        fcntl.flock(readers, fcntl.LOCK_UN)
+        if _try_flock(readers, fcntl.LOCK_EX):
+            # Last reader of this flight
+            _remove(result_path, readers_path)
+    return found, result
+
+def _try_flock(f, operation: int) -> bool:
+    try:
+        fcntl.flock(f, operation | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+def _run_with_file_lock(config, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+    """Serialize key across processes; returns (result, shared) like SingleFlight.do."""
+    flight_path = _key_path(config, key, ".flight")
+    with open(_key_path(config, key, ".lock"), "w") as lock_file:
+        while True:
+            if _try_flock(lock_file, fcntl.LOCK_EX):
+                try:
+                    return _lead(config, key, fn), False
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+            try:
+                with open(flight_path) as f:
+                    generation = f.read()
+            except FileNotFoundError:
+                generation = ""
+            if not generation:
+                # The flight is starting or has just ended
+                time.sleep(FLIGHT_POLL_SEC)
+                continue
+            found, result = _await(config, key, generation, lock_file)
+            if found:
+                return result, True
+            # The flight failed or finished without seeing us; run (or wait for) the next one
+
+def coalesce(config, kind: str, key: str, fn: Callable[[], Any]) -> Any:
+    """
+    Run fn, sharing the result with identical concurrent calls (same kind and key).
+
+    Callers must treat the result as read-only: waiters receive the same object.
+    """
+    if not getattr(config, "SINGLE_FLIGHT", True):
+        return fn()
+
+    full_key = f"{kind}:{key}"
+    if getattr(config, "SINGLE_FLIGHT_FILE_LOCKS", False) and fcntl is not None:
+        leader_fn = lambda: _run_with_file_lock(config, full_key, fn)
+    else:
+        leader_fn = lambda: (fn(), False)
+
+    (result, shared_across_processes), shared = _flight.do(full_key, leader_fn)
+    if shared or shared_across_processes:
+        metrics.inc("docuwrangler_coalesced_requests_total", kind=kind)
+    return result
@@ -0,0 +1,302 @@
+import re
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
+from modules.utils import connect_sqlite
+from modules.rerank import NUMERIC_QUESTION
+
+# Financial tables detected with PyMuPDF are stored as typed cells in a local SQLite
+# index (DATA_DIR/tables.sqlite) keyed by pdf_id, page, row label and period, so plain
+# numeric questions can be answered (or their exact row pinned into the prompt)
+# without relying on character-sliced text chunks.
+
+# FY24, FY2024, FY 2023-24, 2023-24, 2024/25, 2024, Q1 FY24, H1 2024 ...
+PERIOD_PATTERN = re.compile(
+    r"\b(?:(?P<prefix>Q[1-4]|H[12])\s*)?"
+    r"(?:(?P<fy>FY)\s*'?)?"
+    r"(?P<start>(?:19|20)?\d{2})"
+    r"(?:\s*[-/–]\s*(?P<end>(?:19|20)?\d{2}))?\b",
+    re.IGNORECASE
+)
+
+NUMBER_PATTERN = re.compile(r"^\(?-?[\d,]*\.?\d+\)?$")
+CURRENCY_SYMBOLS = "$€£₹¥"
+EMPTY_CELLS = {"", "-", "–", "—", "n/a", "na", "nm"}
+
+STOPWORDS = {
+    "what", "was", "is", "were", "are", "the", "a", "an", "of", "in", "for", "during", "and", "our",
+    "how", "much", "many", "did", "does", "do", "company", "group", "year", "fiscal", "financial",
+    "total", "reported", "report", "value", "figure", "amount", "s"
+}
+
+DIRECT_QUESTION = re.compile(r"^\s*(what|how much|how many)\b.*\b(was|is|were|are|did)\b", re.IGNORECASE)
+
+def normalize_period(text: str) -> Optional[str]:
+    """
+    Normalize a period label to a comparable key, or None if it is not a period.
+
+    Fiscal years are keyed by their end year ("FY24", "FY2023-24", "2023-24" -> "2024");
+    quarters and halves keep their prefix ("Q1 FY24" -> "Q1 2024").
+    """
+    # Dates put days and months before the year ("Year ended 31 March 2024", "31.03.2024")
+    for match in PERIOD_PATTERN.finditer(text.strip()):
+        period = _match_period(match)
+        if period:
+            return period
+    return None
+
+def _match_period(match) -> Optional[str]:
+    start, end = match.group("start"), match.group("end")
+    # A bare two-digit number is only a period when marked as fiscal ("FY24")
+    if len(start) == 2 and not match.group("fy") and not end:
+        return None
+    start_year = int(start if len(start) == 4 else f"20{start}")
+    if end:
+        end_year = int(end) if len(end) == 4 else start_year - start_year % 100 + int(end)
+        if end_year < start_year and len(end) == 2:
+            end_year += 100  # "1999-00"
+        # A range is a fiscal year ("2023-24"), not a day and month ("31-03")
+        if end_year != start_year + 1:
+            return None
+    year = end_year if end else start_year
+    if not 1990 <= year <= 2100:
+        return None
+    prefix = match.group("prefix")
+    return f"{prefix.upper()} {year}" if prefix else str(year)
+
+def parse_number(cell: Optional[str]) -> Tuple[Optional[float], Optional[str]]:
+    """
+    Parse a financial table cell into (value, unit).
+
+    Handles thousands separators, parentheses for negatives, percentages and
+    currency symbols; returns (None, None) for text and empty cells.
+    """
+    if cell is None:
+        return None, None
+    text = cell.strip().replace("−", "-")
+    if text.lower() in EMPTY_CELLS:
+        return None, None
+
+    unit = None
+    if text.endswith("%"):
+        unit = "%"
+        text = text[:-1].strip()
+    if text and text[0] in CURRENCY_SYMBOLS:
+        unit = text[0]
+        text = text[1:].strip()
+
+    if not NUMBER_PATTERN.match(text.replace(" ", "")):
+        return None, None
+    negative = text.startswith("(") and text.endswith(")")
+    value = float(text.strip("()").replace(",", "").replace(" ", ""))
+    return (-value if negative else value), unit
+
+def label_tokens(text: str) -> List[str]:
+    return [t for t in re.findall(r"[a-z]+", text.lower()) if t not in STOPWORDS]
+
+def normalize_label(text: str) -> str:
+    return " ".join(label_tokens(text))
+
+def extract_tables_from_page(page, page_num: int) -> List[Dict[str, Any]]:
+    """
+    Detect tables on a page and convert them into typed rows.
+
+    A column is a period column when its header normalizes to a period; the row
+    label is the first non-numeric cell. Tables without period columns are skipped.
+    """
+    tables = []
+    try:
+        found = page.find_tables()
+    except Exception as e:
+        print(f"Error detecting tables on page {page_num}: {str(e)}")
+        return tables
+
+    for table_index, table in enumerate(found.tables):
+        rows = table.extract()
+        if len(rows) < 2:
+            continue
+        header = [cell or "" for cell in rows[0]]
+        periods = {i: normalize_period(cell) for i, cell in enumerate(header)}
+        periods = {i: p for i, p in periods.items() if p}
+        if not periods:
+            continue
+
+        # Scale hints such as "(in millions)" usually sit in the header's first cell
+        scale = next((cell for cell in header if re.search(r"\b(thousand|million|billion|crore|lakh)s?\b", cell, re.I)), None)
+
+        typed_rows = []
+        for row_index, row in enumerate(rows[1:], start=1):
+            label = next((cell.strip() for cell in row if cell and parse_number(cell)[0] is None
+                          and cell.strip().lower() not in EMPTY_CELLS), None)
+            if not label or not normalize_label(label):
+                continue
+            cells = []
+            for column, period in periods.items():
+                raw = row[column] if column < len(row) else None
+                value, unit = parse_number(raw)
+                if value is not None:
+                    cells.append({"period": header[column].strip(), "period_norm": period,
+                                  "value": value, "raw": raw.strip(), "unit": unit})
+            if cells:
+                bbox = table.rows[row_index].bbox if row_index < len(table.rows) else table.bbox
+                typed_rows.append({"row_index": row_index, "label": label, "cells": cells, "bbox": tuple(bbox)})
+
+        if typed_rows:
+            tables.append({
+                "page_num": page_num,
+                "table_index": table_index,
+                "bbox": tuple(table.bbox),
+                "header": header,
+                "scale": scale,
+                "rows": typed_rows
+            })
+    return tables
+
+@contextmanager
+def _table_index(config):
+    with connect_sqlite(config, "tables.sqlite") as connection:
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS table_cells (
+                pdf_id TEXT NOT NULL,
+                page_num INTEGER NOT NULL,
+                table_index INTEGER NOT NULL,
+                row_index INTEGER NOT NULL,
+                row_label TEXT NOT NULL,
+                row_label_norm TEXT NOT NULL,
+                period TEXT NOT NULL,
+                period_norm TEXT NOT NULL,
+                value REAL NOT NULL,
+                raw TEXT NOT NULL,
+                unit TEXT,
+                scale TEXT,
+                x0 REAL, y0 REAL, x1 REAL, y1 REAL
+            )
+        """)
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_table_cells_lookup ON table_cells (pdf_id, period_norm, row_label_norm)"
+        )
+        yield connection
+
+def delete_tables(config, pdf_id: str):
+    """Remove a document's rows (before re-indexing it)."""
+    with _table_index(config) as connection:
+        connection.execute("DELETE FROM table_cells WHERE pdf_id = ?", (pdf_id,))
+
+def index_tables(config, pdf_id: str, tables: List[Dict[str, Any]]) -> int:
+    """Store typed table rows; returns the number of cells written."""
+    records = []
+    for table in tables:
+        for row in table["rows"]:
+            for cell in row["cells"]:
+                records.append((
+                    pdf_id, table["page_num"], table["table_index"], row["row_index"],
+                    row["label"], normalize_label(row["label"]), cell["period"], cell["period_norm"],
+                    cell["value"], cell["raw"], cell["unit"], table["scale"], *row["bbox"]
+                ))
+    if records:
+        with _table_index(config) as connection:
+            connection.executemany(
+                "INSERT INTO table_cells VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records
+            )
+    return len(records)
+
+def question_periods(question: str) -> List[str]:
+    return list(dict.fromkeys(
+        period for period in (normalize_period(m.group(0)) for m in PERIOD_PATTERN.finditer(question)) if period
+    ))
+
+def question_terms(question: str) -> set:
+    """Content terms of a question, without its periods."""
+    return set(label_tokens(re.sub(PERIOD_PATTERN, " ", question)))
+
+def asks_for_figures(question: str) -> bool:
+    """Whether a question is about table figures: it names a period or asks for a number."""
+    return bool(question_periods(question)) or bool(NUMERIC_QUESTION.search(question.lower()))
+
+def _label_score(question_terms: set, row_label_norm: str) -> float:
+    """Share of the row label's terms that appear in the question (1.0 = every term)."""
+    terms = set(row_label_norm.split())
+    if not terms:
+        return 0.0
+    return len(terms & question_terms) / len(terms)
+
+def lookup_table_rows(config, question: str, pdf_ids: List[str], limit: int = 3) -> List[Dict[str, Any]]:
+    """
+    Find the table rows a question refers to.
+
+    Rows are scored by how completely their label's terms appear in the question;
+    ties prefer longer (more specific) labels. Each result holds every period of
+    the row plus the cell for the period the question asks about, if any.
+    """
+    if not pdf_ids:
+        return []
+    terms = question_terms(question)
+    if not terms:
+        return []
+    periods = question_periods(question)
+
+    placeholders = ",".join("?" for _ in pdf_ids)
+    with _table_index(config) as connection:
+        rows = connection.execute(
+            f"SELECT * FROM table_cells WHERE pdf_id IN ({placeholders}) ORDER BY rowid", list(pdf_ids)
+        ).fetchall()
+
+    grouped: Dict[Tuple, Dict[str, Any]] = {}
+    for cell in rows:
+        score = _label_score(terms, cell["row_label_norm"])
+        if score < 1.0:
+            continue
+        key = (cell["pdf_id"], cell["page_num"], cell["table_index"], cell["row_index"])
+        row = grouped.setdefault(key, {
+            "pdf_id": cell["pdf_id"],
+            "page_num": cell["page_num"],
+            "row_label": cell["row_label"],
+            "row_label_norm": cell["row_label_norm"],
+            "scale": cell["scale"],
+            "score": score + 0.01 * len(cell["row_label_norm"].split()),
+            "position": {"x0": cell["x0"], "y0": cell["y0"], "x1": cell["x1"], "y1": cell["y1"]},
+            "cells": []
+        })
+        row["cells"].append({k: cell[k] for k in ("period", "period_norm", "value", "raw", "unit")})
+
+    matches = sorted(grouped.values(), key=lambda r: r["score"], reverse=True)
+    for row in matches:
+        row["requested"] = [c for c in row["cells"] if c["period_norm"] in periods]
+    return matches[:limit]
+
+def direct_answer(question: str, matches: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Answer a plain numeric question straight from the table index, or return None.
+
+    Only used when the question names exactly one period, asks for nothing beyond
+    the best row's label ("revenue growth" is not "revenue"), the row matches
+    unambiguously, and no other row with the same label disagrees on the value.
+    """
+    if not matches or not DIRECT_QUESTION.search(question) or len(question_periods(question)) != 1:
+        return None
+    best = matches[0]
+    if len(best["requested"]) != 1 or not question_terms(question) <= set(best["row_label_norm"].split()):
+        return None
+    cell = best["requested"][0]
+    for other in matches[1:]:
+        if other["score"] >= best["score"] and other["row_label"].lower() != best["row_label"].lower():
+            return None
+        if other["row_label"].lower() == best["row_label"].lower() and \
+                any(c["period_norm"] == cell["period_norm"] and c["value"] != cell["value"] for c in other["requested"]):
+            return None
+
+    scale = f" ({best['scale'].strip('()')})" if best["scale"] and cell["unit"] != "%" else ""
+    return {
+        "answer": f"{best['row_label']} for {cell['period']} was {cell['raw']}{scale}, "
+                  f"as reported in the table on page {best['page_num']}.",
+        "row": best,
+        "cell": cell
+    }
+
+def format_pinned_rows(matches: List[Dict[str, Any]]) -> str:
+    """Render matched rows as compact prompt context."""
+    lines = []
+    for row in matches:
+        values = ", ".join(f"{c['period']}: {c['raw']}" for c in row["cells"])
+        scale = f" {row['scale']}" if row["scale"] else ""
+        lines.append(f"--- Table row from page {row['page_num']} ---\n{row['row_label']}{scale}: {values}")
+    return "\n\n".join(lines)
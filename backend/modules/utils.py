@@ -1,10 +1,16 @@
 import os
-from openai import AzureOpenAI
-import chromadb
-from chromadb.config import Settings
-import config  # Your configuration file
+import sqlite3
+import tempfile
+import importlib
+from contextlib import contextmanager
+from typing import Union
+from modules import config  # Your configuration file
 
 def initialize_clients():
+    # Imported here so modules that only need get_data_dir stay cheap to import
+    from openai import AzureOpenAI
+    from modules.vector_store import get_chroma_client
+    
     # Initialize Azure OpenAI client
     azure_client = AzureOpenAI(
         api_key=config.AZURE_OPENAI_API_KEY,  # From your config file
@@ -12,11 +18,58 @@ def initialize_clients():
         api_version="2024-10-21"  # Latest available version as of April 2025
     )
     
-    # Initialize ChromaDB client (persistent local storage)
-    chroma_client = chromadb.PersistentClient(
-        path=config.CHROMA_DB_PATH,  # Path from your config file
-        settings=Settings()
-    )
+    # Shared ChromaDB client (embedded, or the vector-store server in CHROMA_SERVER_URL)
+    chroma_client = get_chroma_client(config)
     
     return azure_client, chroma_client
 
+def get_data_dir(config, *parts: str) -> str:
+    """
+    Return (and create) a directory for local artifacts that live next to the vector DB.
+
+    Uses config.DATA_DIR when set, otherwise a "data" directory beside CHROMA_DB_PATH.
+    """
+    base_dir = getattr(config, "DATA_DIR", None)
+    if not base_dir:
+        chroma_path = os.path.abspath(config.CHROMA_DB_PATH)
+        base_dir = os.path.join(os.path.dirname(chroma_path), "data")
+
+    path = os.path.join(base_dir, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+@contextmanager
+def connect_sqlite(config, filename: str):
+    """
+    Open a SQLite database in the data directory, commit on success and always close it.
+
+    Rows come back as sqlite3.Row; callers create their tables inside the block.
+    """
+    connection = sqlite3.connect(os.path.join(get_data_dir(config), filename), timeout=30)
+    connection.row_factory = sqlite3.Row
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def write_atomic(path: str, data: Union[bytes, str]):
+    """Write a file through a temp file and a rename, so readers never see a partial one."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def import_optional(module: str, package: str, feature: str):
+    """Import a dependency from requirements-local.txt, naming the missing package when it is absent."""
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        raise ImportError(
+            f"{feature} needs the '{package}' package; install it with "
+            f"'pip install -r requirements-local.txt' (or 'pip install {package}')"
+        ) from e
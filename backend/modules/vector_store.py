@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+from typing import List, Any, Optional
+from urllib.parse import urlparse
+from modules import metrics
+
+# One Chroma client per process, shared by every request thread.
+#
+# By default it is an embedded PersistentClient on CHROMA_DB_PATH: fine for a
+# single process, but every worker then loads its own copy of the index and
+# writes to the same directory. With config.CHROMA_SERVER_URL set (for example
+# "http://127.0.0.1:8000") a single Chroma server owns the index instead:
+#
+#     chroma run --path <CHROMA_DB_PATH> --host 127.0.0.1 --port 8000
+#
+# Workers then reach it through an HttpClient whose connection pool is sized
+# by CHROMA_HTTP_MAX_CONNECTIONS, so memory stays flat as workers are added.
+# Writes go out in batches of at most CHROMA_WRITE_BATCH_SIZE records and
+# return once they are readable (see write_records).
+
+DEFAULT_HTTP_MAX_CONNECTIONS = 16
+DEFAULT_WRITE_BATCH_SIZE = 1000
+DEFAULT_VISIBILITY_TIMEOUT_SEC = 10.0
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def server_url(config) -> Optional[str]:
+    return getattr(config, "CHROMA_SERVER_URL", None) or None
+
+def _create_client(config):
+    import chromadb
+    from chromadb.config import Settings
+
+    url = server_url(config)
+    if not url:
+        return chromadb.PersistentClient(path=config.CHROMA_DB_PATH)
+
+    parsed = urlparse(url)
+    ssl = parsed.scheme == "https"
+    max_connections = int(getattr(config, "CHROMA_HTTP_MAX_CONNECTIONS", DEFAULT_HTTP_MAX_CONNECTIONS))
+    return chromadb.HttpClient(
+        host=parsed.hostname,
+        port=parsed.port or (443 if ssl else 8000),
+        ssl=ssl,
+        settings=Settings(
+            chroma_http_max_connections=max_connections,
+            chroma_http_max_keepalive_connections=max_connections,
+            anonymized_telemetry=False
+        )
+    )
+
+def get_chroma_client(config):
+    """
+    The process-wide Chroma client, created on first use.
+
+    Creation is serialized: concurrent first requests would otherwise race
+    while Chroma sets up its tenant and database. A process forked after the
+    client was created gets its own.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = _create_client(config)
+            _client_pid = os.getpid()
+        return _client
+
+def write_batch_size(chroma_client, config) -> int:
+    configured = int(getattr(config, "CHROMA_WRITE_BATCH_SIZE", DEFAULT_WRITE_BATCH_SIZE))
+    return max(1, min(configured, chroma_client.get_max_batch_size()))
+
+def wait_until_visible(collection, ids: List[str], config):
+    """
+    Block until the last written record can be read back.
+
+    Chroma applies writes before acknowledging them, so this normally returns
+    after one request; it guards against servers that acknowledge first.
+    """
+    timeout = float(getattr(config, "CHROMA_VISIBILITY_TIMEOUT_SEC", DEFAULT_VISIBILITY_TIMEOUT_SEC))
+    deadline = time.time() + timeout
+    delay = 0.01
+    while not collection.get(ids=ids[-1:], include=[])["ids"]:
+        if time.time() >= deadline:
+            raise TimeoutError(f"Records written to '{collection.name}' were not readable after {timeout:.0f}s")
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+def write_records(chroma_client, collection, config, upsert: bool = False, **records: List[Any]):
+    """
+    Add (or upsert) records in batches; returns once they are readable.
+
+    records are the usual Chroma columns (ids, embeddings, metadatas, documents).
+    """
+    ids = records["ids"]
+    if not ids:
+        return
+    batch_size = write_batch_size(chroma_client, config)
+    write = collection.upsert if upsert else collection.add
+    with metrics.span("vector_store_write", records=len(ids)):
+        for start in range(0, len(ids), batch_size):
+            write(**{column: values[start:start + batch_size] for column, values in records.items()})
+        if server_url(config):
+            wait_until_visible(collection, ids, config)
@@ -0,0 +1,332 @@
+import os
+import time
+import base64
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from openai import AzureOpenAI
+from modules import metrics, api_budget
+from modules.embedding_store import (
+    to_index_vectors, get_storage_settings, get_collection_name, save_originals
+)
+from modules.embeddings import get_embedding_provider
+from modules.page_index import refresh_pages
+from modules.utils import get_data_dir, connect_sqlite, write_atomic
+
+# Vision modes (config.VISION_MODE):
+# - "eager": every image is described with GPT-4o during ingest (default)
+# - "lazy": images are indexed as placeholders built from local features (page,
+#   bbox, nearby caption text); the description and its embedding are produced
+#   when a query puts the image in the prompt, or by a low-priority backfill.
+VISION_MODES = ("eager", "lazy")
+
+DEFAULT_LAZY_MAX_PER_QUERY = 4
+DEFAULT_BACKFILL_DELAY_SEC = 1.0
+# Claims older than this are taken over (the process holding them died mid-description)
+DEFAULT_CLAIM_TIMEOUT_SEC = 600.0
+
+PENDING, RUNNING, DONE = "pending", "running", "done"
+
+def get_vision_mode(config) -> str:
+    mode = getattr(config, "VISION_MODE", "eager")
+    if mode not in VISION_MODES:
+        raise ValueError(f"Unknown VISION_MODE '{mode}', expected one of {VISION_MODES}")
+    return mode
+
+def describe_image(block: Dict[str, Any], client: AzureOpenAI, config) -> str:
+    """Describe an image block with GPT-4o's multimodal capabilities."""
+    messages = [
+        {"role": "system", "content": "You are an AI assistant that describes images in detail."},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "Please describe this image in detail."},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/{block['mime_type']};base64,{block['content']}",
+                        "detail": "high"
+                    }
+                }
+            ]
+        }
+    ]
+
+    # Get image description from GPT-4o
+    api_budget.acquire("vision")
+    with metrics.span("vision", page=block["page_num"]):
+        chat_response = client.chat.completions.create(
+            model=config.AZURE_OPENAI_VISION_DEPLOYMENT,  # Your GPT-4o deployment
+            messages=messages,
+            max_tokens=300
+        )
+    metrics.count_api_call("vision", chat_response)
+
+    return chat_response.choices[0].message.content
+
+def image_key(block: Dict[str, Any]) -> str:
+    """Content hash of an image block's bytes."""
+    return hashlib.sha256(base64.b64decode(block["content"])).hexdigest()
+
+def _description_path(config, key: str) -> str:
+    return os.path.join(get_data_dir(config, "images", key[:2]), f"{key}.{config.AZURE_OPENAI_VISION_DEPLOYMENT}.txt")
+
+def cached_description(config, block: Dict[str, Any], key: Optional[str] = None) -> Optional[str]:
+    """A previous description of the same image bytes by the configured vision deployment, if any."""
+    path = _description_path(config, key or image_key(block))
+    if not os.path.exists(path):
+        metrics.record_cache("image_description", False)
+        return None
+    metrics.record_cache("image_description", True)
+    with open(path) as f:
+        return f.read()
+
+def describe_image_cached(block: Dict[str, Any], client: AzureOpenAI, config) -> str:
+    """
+    describe_image with a content-addressed cache, so re-ingesting or re-indexing a
+    document (or another report reusing the same chart or logo) costs no vision call.
+    """
+    key = image_key(block)
+    description = cached_description(config, block, key)
+    if description is None:
+        description = describe_image(block, client, config)
+        write_atomic(_description_path(config, key), description)
+    return description
+
+def placeholder_description(block: Dict[str, Any]) -> str:
+    """Stand-in text indexed for an image until it has been described."""
+    caption = block.get("caption", "").strip()
+    text = f"Image on page {block['page_num']}."
+    return f"{text} Nearby text: {caption}" if caption else text
+
+def image_path(config, key: str, mime_type: str) -> str:
+    return os.path.join(get_data_dir(config, "images", key[:2]), f"{key}.{mime_type}")
+
+def save_image(config, block: Dict[str, Any]) -> str:
+    """Keep the (base64) image bytes for later description; identical images share one file."""
+    data = base64.b64decode(block["content"])
+    key = hashlib.sha256(data).hexdigest()
+    path = image_path(config, key, block["mime_type"])
+    if not os.path.exists(path):
+        write_atomic(path, data)
+    return key
+
+@contextmanager
+def _queue(config):
+    with connect_sqlite(config, "vision.sqlite") as connection:
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS pending_images (
+                collection TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                pdf_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                page_num INTEGER NOT NULL,
+                image_key TEXT NOT NULL,
+                mime_type TEXT NOT NULL,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (collection, chunk_id)
+            )
+        """)
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_pending_images_page "
+            "ON pending_images (collection, pdf_id, status, page_num)"
+        )
+        yield connection
+
+def enqueue_images(config, pdf_id: str, entries: List[Dict[str, Any]]):
+    """
+    Replace a document's deferred images with entries of (chunk_id, chunk_index, block).
+
+    Blocks carry the image_key of their saved image (or, from older checkpoints, its content).
+
+    Always called on ingest, so a re-ingest never leaves stale entries pointing
+    at chunk ids that now hold other content.
+    """
+    collection = get_collection_name(config)
+    records = [
+        (collection, entry["chunk_id"], pdf_id, entry["chunk_index"], entry["block"]["page_num"],
+         entry["block"].get("image_key") or save_image(config, entry["block"]), entry["block"]["mime_type"],
+         PENDING, time.time())
+        for entry in entries
+    ]
+    with _queue(config) as connection:
+        connection.execute("DELETE FROM pending_images WHERE collection = ? AND pdf_id = ?", (collection, pdf_id))
+        connection.executemany("INSERT INTO pending_images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+
+def _claimable(config) -> Tuple[str, List[Any]]:
+    """SQL condition (and its parameters) for pending images and stale claims."""
+    timeout = float(getattr(config, "VISION_CLAIM_TIMEOUT_SEC", DEFAULT_CLAIM_TIMEOUT_SEC))
+    return "(status = ? OR (status = ? AND updated_at < ?))", [PENDING, RUNNING, time.time() - timeout]
+
+def pending_chunk_ids(config, pdf_id: str, pages: Optional[List[int]] = None,
+                      limit: Optional[int] = None) -> List[str]:
+    """Undescribed images of a document, optionally only on the given pages (all of them without a limit)."""
+    claimable, claimable_params = _claimable(config)
+    query = f"SELECT chunk_id FROM pending_images WHERE collection = ? AND pdf_id = ? AND {claimable}"
+    params: List[Any] = [get_collection_name(config), pdf_id, *claimable_params]
+    if pages:
+        query += f" AND page_num IN ({','.join('?' for _ in pages)})"
+        params.extend(pages)
+    query += " ORDER BY page_num, chunk_index"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    with _queue(config) as connection:
+        return [row["chunk_id"] for row in connection.execute(query, params).fetchall()]
+
+def _claim(config, chunk_ids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Mark images as running; entries claimed by another request or the backfill are
+    skipped unless the claim is older than VISION_CLAIM_TIMEOUT_SEC.
+    """
+    collection = get_collection_name(config)
+    claimable, claimable_params = _claimable(config)
+    claimed = []
+    with _queue(config) as connection:
+        for chunk_id in chunk_ids:
+            cursor = connection.execute(
+                "UPDATE pending_images SET status = ?, updated_at = ? "
+                f"WHERE collection = ? AND chunk_id = ? AND {claimable}",
+                (RUNNING, time.time(), collection, chunk_id, *claimable_params)
+            )
+            if cursor.rowcount:
+                row = connection.execute("SELECT * FROM pending_images WHERE collection = ? AND chunk_id = ?",
+                                         (collection, chunk_id)).fetchone()
+                claimed.append(dict(row))
+    return claimed
+
+def _set_status(config, chunk_ids: List[str], status: str):
+    collection = get_collection_name(config)
+    with _queue(config) as connection:
+        connection.executemany(
+            "UPDATE pending_images SET status = ?, updated_at = ? WHERE collection = ? AND chunk_id = ?",
+            [(status, time.time(), collection, chunk_id) for chunk_id in chunk_ids]
+        )
+
+def describe_pending(config, client: AzureOpenAI, chroma_client, chunk_ids: List[str],
+                     trigger: str = "query") -> Dict[str, str]:
+    """
+    Describe deferred images and replace their placeholders in the index.
+
+    The description is embedded and written over the placeholder's document,
+    vector and metadata (and its exact-rerank original). Returns chunk_id ->
+    description for the images this call processed; failed images go back to
+    pending.
+    """
+    entries = _claim(config, chunk_ids)
+    if not entries:
+        return {}
+
+    def _describe(entry: Dict[str, Any]) -> Optional[str]:
+        try:
+            with open(image_path(config, entry["image_key"], entry["mime_type"]), "rb") as f:
+                content = base64.b64encode(f.read()).decode("utf-8")
+            block = {"content": content, "mime_type": entry["mime_type"], "page_num": entry["page_num"]}
+            return describe_image_cached(block, client, config)
+        except Exception as e:
+            print(f"Error describing image {entry['chunk_id']}: {str(e)}")
+            return None
+
+    if len(entries) == 1:
+        descriptions = [_describe(entries[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(entries)) as pool:
+            descriptions = list(pool.map(_describe, entries))
+
+    described = [(entry, text) for entry, text in zip(entries, descriptions) if text]
+    failed = [entry["chunk_id"] for entry, text in zip(entries, descriptions) if not text]
+    if failed:
+        _set_status(config, failed, PENDING)
+    if not described:
+        return {}
+
+    try:
+        collection = chroma_client.get_collection(get_collection_name(config))
+        ids = [entry["chunk_id"] for entry, _ in described]
+        existing = collection.get(ids=ids, include=["metadatas"])
+        metadata_by_id = dict(zip(existing["ids"], existing["metadatas"]))
+
+        full_embeddings = get_embedding_provider(config, client).embed([text for _, text in described])
+        metadatas = []
+        for entry, text in described:
+            metadata = dict(metadata_by_id.get(entry["chunk_id"]) or {})
+            metadata["vision_status"] = DONE
+            metadata["preview"] = text[:50] + "..." if len(text) > 50 else text
+            metadatas.append(metadata)
+
+        collection.update(
+            ids=ids,
+            embeddings=to_index_vectors(full_embeddings, config).tolist(),
+            documents=[text for _, text in described],
+            metadatas=metadatas
+        )
+        if get_storage_settings(config)["exact_rerank"]:
+            for (entry, _), embedding in zip(described, full_embeddings):
+                save_originals(config, entry["pdf_id"], entry["chunk_index"], embedding[None, :])
+        for pdf_id in {entry["pdf_id"] for entry, _ in described}:
+            refresh_pages(chroma_client, collection, pdf_id,
+                          [entry["page_num"] for entry, _ in described if entry["pdf_id"] == pdf_id], config)
+    except Exception as e:
+        print(f"Error updating described images: {str(e)}")
+        _set_status(config, [entry["chunk_id"] for entry, _ in described], PENDING)
+        return {}
+
+    _set_status(config, ids, DONE)
+    metrics.inc("docuwrangler_vision_descriptions_total", len(described), trigger=trigger)
+    return {entry["chunk_id"]: text for entry, text in described}
+
+def resolve_pending_images(config, client: AzureOpenAI, chroma_client,
+                           chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Describe placeholder images that made it into a prompt before generating.
+
+    At most VISION_LAZY_MAX_PER_QUERY images are described inline. Other
+    undescribed images on the retrieved pages are queued for the backfill so
+    the next question about those pages finds real descriptions.
+    """
+    pending = [chunk for chunk in chunks if chunk["metadata"].get("vision_status") == PENDING]
+    max_inline = int(getattr(config, "VISION_LAZY_MAX_PER_QUERY", DEFAULT_LAZY_MAX_PER_QUERY))
+    if pending and max_inline > 0:
+        with metrics.span("vision_lazy", images=min(len(pending), max_inline)):
+            descriptions = describe_pending(config, client, chroma_client,
+                                            [chunk["id"] for chunk in pending[:max_inline]])
+        for chunk in pending:
+            if chunk["id"] in descriptions:
+                chunk["content"] = descriptions[chunk["id"]]
+                chunk["metadata"]["vision_status"] = DONE
+
+    pages_by_doc: Dict[str, set] = {}
+    for chunk in chunks:
+        pages_by_doc.setdefault(chunk["metadata"].get("pdf_id"), set()).add(chunk["metadata"].get("page_num"))
+    for pdf_id, pages in pages_by_doc.items():
+        if pdf_id and pending_chunk_ids(config, pdf_id, sorted(pages), limit=1):
+            schedule_backfill(config, client, chroma_client, pdf_id, pages=sorted(pages))
+    return chunks
+
+_backfill_pool: Optional[ThreadPoolExecutor] = None
+_backfill_lock = threading.Lock()
+
+def _backfill(config, client: AzureOpenAI, chroma_client, pdf_id: str, pages: Optional[List[int]]):
+    delay = float(getattr(config, "VISION_BACKFILL_DELAY_SEC", DEFAULT_BACKFILL_DELAY_SEC))
+    try:
+        for chunk_id in pending_chunk_ids(config, pdf_id, pages):
+            describe_pending(config, client, chroma_client, [chunk_id], trigger="backfill")
+            time.sleep(delay)
+    except Exception as e:
+        print(f"Error backfilling image descriptions for {pdf_id}: {str(e)}")
+
+def schedule_backfill(config, client: AzureOpenAI, chroma_client, pdf_id: str, pages: Optional[List[int]] = None):
+    """
+    Describe a document's deferred images (or those on some pages) in the background.
+
+    A single worker thread handles one image at a time with VISION_BACKFILL_DELAY_SEC
+    between calls, leaving API quota and CPU to interactive requests.
+    """
+    global _backfill_pool
+    with _backfill_lock:
+        if _backfill_pool is None:
+            _backfill_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vision-backfill")
+    _backfill_pool.submit(_backfill, config, client, chroma_client, pdf_id, pages)
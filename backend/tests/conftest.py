@@ -0,0 +1,18 @@
+import os
+import sys
+import types
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from modules import config  # noqa: F401
+except ImportError:
+    # config.py holds credentials and is not committed; the tests only need its module
+    import modules
+    modules.config = sys.modules["modules.config"] = types.ModuleType("modules.config")
+
+@pytest.fixture
+def data_config(tmp_path):
+    """A config whose local data (SQLite indexes, caches) lives in a temporary directory."""
+    return types.SimpleNamespace(DATA_DIR=str(tmp_path / "data"), CHROMA_DB_PATH=str(tmp_path / "chroma"))
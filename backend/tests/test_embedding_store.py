@@ -0,0 +1,68 @@
+import os
+import numpy as np
+import pytest
+from modules.embedding_store import (
+    quantize, dequantize, save_originals, load_originals, OriginalsMismatch, _originals_paths
+)
+
+@pytest.fixture
+def embeddings():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(6, 32)).astype(np.float32)
+    vectors[3] = 0.0
+    return vectors
+
+def test_float32_round_trip_is_exact(embeddings):
+    np.testing.assert_array_equal(dequantize(quantize(embeddings, "float32")), embeddings)
+
+def test_float16_round_trip(embeddings):
+    np.testing.assert_allclose(dequantize(quantize(embeddings, "float16")), embeddings, rtol=1e-3, atol=1e-3)
+
+def test_int8_round_trip_is_within_half_a_step(embeddings):
+    rows = quantize(embeddings, "int8")
+    assert rows["q"].dtype == np.int8
+    step = np.abs(embeddings).max(axis=1, keepdims=True) / 127.0
+    assert np.all(np.abs(dequantize(rows) - embeddings) <= step / 2 + 1e-6)
+    np.testing.assert_array_equal(dequantize(rows)[3], 0.0)
+
+@pytest.mark.parametrize("quantization, itemsize", [("float32", 128), ("float16", 64), ("int8", 36)])
+def test_row_size(embeddings, quantization, itemsize):
+    assert quantize(embeddings, quantization).dtype.itemsize == itemsize
+
+def test_originals_are_addressed_by_chunk_index(data_config, embeddings):
+    data_config.EMBEDDING_QUANTIZATION = "float32"
+    save_originals(data_config, "report", 2, embeddings[2:4])
+    save_originals(data_config, "report", 0, embeddings[0:2])
+    np.testing.assert_array_equal(load_originals(data_config, "report", [3, 0, 1]), embeddings[[3, 0, 1]])
+
+def test_missing_originals(data_config, embeddings):
+    data_config.EMBEDDING_QUANTIZATION = "float32"
+    assert load_originals(data_config, "report", [0]) is None
+    save_originals(data_config, "report", 0, embeddings[:2])
+    # Chunks past the end of the file read back as zero rows
+    np.testing.assert_array_equal(load_originals(data_config, "report", [1, 5])[1], 0.0)
+
+def test_replace_drops_rows_of_the_previous_ingest(data_config, embeddings):
+    data_config.EMBEDDING_QUANTIZATION = "float32"
+    save_originals(data_config, "report", 0, embeddings)
+    save_originals(data_config, "report", 0, embeddings[:2], replace=True)
+    data_path, _ = _originals_paths(data_config, "report")
+    assert os.path.getsize(data_path) == 2 * 128
+
+def test_layout_change_rewrites_the_file(data_config, embeddings):
+    data_config.EMBEDDING_QUANTIZATION = "float32"
+    save_originals(data_config, "report", 0, embeddings)
+    data_config.EMBEDDING_QUANTIZATION = "int8"
+    save_originals(data_config, "report", 0, embeddings[:2])
+    data_path, _ = _originals_paths(data_config, "report")
+    assert os.path.getsize(data_path) == 2 * 36
+    assert load_originals(data_config, "report", [0, 1]).shape == (2, 32)
+
+def test_file_that_does_not_match_its_header(data_config, embeddings):
+    data_config.EMBEDDING_QUANTIZATION = "float32"
+    save_originals(data_config, "report", 0, embeddings)
+    data_path, _ = _originals_paths(data_config, "report")
+    with open(data_path, "ab") as f:
+        f.write(b"\0" * 10)
+    with pytest.raises(OriginalsMismatch):
+        load_originals(data_config, "report", [0])
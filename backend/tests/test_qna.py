@@ -0,0 +1,54 @@
+import types
+import pytest
+from modules import qna
+from modules.qna import merge_document_candidates
+
+@pytest.fixture(autouse=True)
+def rank_by_similarity(monkeypatch):
+    # Keep each document's candidates in retrieval order so the tests only exercise the merge
+    monkeypatch.setattr(qna, "config", types.SimpleNamespace(RERANKER="none"))
+
+def _candidates(pdf_id, similarities):
+    return [{"id": f"{pdf_id}_{i}", "content": f"chunk {i}", "similarity": similarity,
+             "metadata": {"pdf_id": pdf_id, "page_num": i + 1}}
+            for i, similarity in enumerate(similarities)]
+
+def _ids(chunks):
+    return sorted(chunk["id"] for chunk in chunks)
+
+def test_every_document_gets_its_quota():
+    merged = merge_document_candidates("revenue", {
+        "strong": _candidates("strong", [0.95, 0.94, 0.93, 0.92]),
+        "weak": _candidates("weak", [0.40, 0.30, 0.20, 0.10])
+    }, max_chunks=4)
+    assert _ids(merged) == ["strong_0", "strong_1", "weak_0", "weak_1"]
+
+def test_scores_are_normalized_within_each_document():
+    merged = merge_document_candidates("revenue", {
+        "strong": _candidates("strong", [0.95, 0.90]),
+        "weak": _candidates("weak", [0.40, 0.30])
+    }, max_chunks=4)
+    scores = {chunk["id"]: chunk["normalized_score"] for chunk in merged}
+    # Normalization runs in float32
+    for pdf_id in ("strong", "weak"):
+        assert scores[f"{pdf_id}_0"] == pytest.approx(1.0, abs=1e-5)
+        assert scores[f"{pdf_id}_1"] == pytest.approx(-1.0, abs=1e-5)
+    assert [chunk["normalized_score"] for chunk in merged] == sorted(scores.values(), reverse=True)
+
+def test_leftover_slots_go_to_the_best_normalized_scores():
+    merged = merge_document_candidates("revenue", {
+        "long": _candidates("long", [0.9, 0.8, 0.7, 0.1]),
+        "short": _candidates("short", [0.5])
+    }, max_chunks=4)
+    assert _ids(merged) == ["long_0", "long_1", "long_2", "short_0"]
+
+def test_each_document_keeps_one_chunk_when_there_are_more_documents_than_slots():
+    merged = merge_document_candidates("revenue", {
+        pdf_id: _candidates(pdf_id, [0.9, 0.8]) for pdf_id in ("a", "b", "c")
+    }, max_chunks=2)
+    assert _ids(merged) == ["a_0", "b_0", "c_0"]
+
+def test_documents_without_candidates_are_skipped():
+    assert merge_document_candidates("revenue", {"a": [], "b": []}, max_chunks=4) == []
+    merged = merge_document_candidates("revenue", {"a": _candidates("a", [0.9, 0.8, 0.7]), "b": []}, max_chunks=2)
+    assert _ids(merged) == ["a_0", "a_1"]
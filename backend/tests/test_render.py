@@ -0,0 +1,76 @@
+import os
+import pytest
+from modules import config, render as render_module
+from modules.documents import pdf_path, register_document
+from modules.render import render, RenderError, DocumentNotStored
+
+SHA256 = "ab" * 32
+
+@pytest.fixture
+def stored(data_config, monkeypatch):
+    """A registered document whose rasterizer counts its calls instead of drawing pages."""
+    with open(pdf_path(data_config, SHA256), "wb") as f:
+        f.write(b"%PDF-1.4")
+    register_document(data_config, "report", SHA256)
+    calls = []
+
+    def rasterize(path, page, zoom, fmt, bbox):
+        calls.append((page, zoom, fmt, bbox))
+        return f"{page}:{zoom}:{fmt}:{bbox}".encode()
+
+    monkeypatch.setattr(render_module, "rasterize", rasterize)
+    return calls
+
+def test_second_request_is_served_from_the_cache(data_config, stored):
+    first = render(data_config, "report", 2)
+    assert render(data_config, "report", 2) == first
+    assert len(stored) == 1
+
+def test_etag_identifies_the_rendering(data_config, stored):
+    _, etag = render(data_config, "report", 2)
+    variants = [render(data_config, "report", 3), render(data_config, "report", 2, zoom=2.0),
+                render(data_config, "report", 2, fmt="webp"), render(data_config, "report", 2, bbox=(0, 0, 100, 100))]
+    assert len({etag, *(tag for _, tag in variants)}) == 5
+
+def test_etag_changes_when_the_document_is_replaced(data_config, stored):
+    _, etag = render(data_config, "report", 2)
+    other = "cd" * 32
+    with open(pdf_path(data_config, other), "wb") as f:
+        f.write(b"%PDF-1.4")
+    register_document(data_config, "report", other)
+    assert render(data_config, "report", 2)[1] != etag
+    assert len(stored) == 2
+
+def test_eviction_keeps_the_cache_under_its_limit(data_config, stored):
+    data_config.RENDER_CACHE_MAX_BYTES = 1
+    data, _ = render(data_config, "report", 2)
+    # The rendering is returned even though it was evicted right after being written
+    assert data == b"2:1.5:png:None"
+    assert os.listdir(render_module._cache_dir(data_config)) == []
+
+@pytest.mark.parametrize("kwargs", [{"fmt": "gif"}, {"zoom": 100.0}, {"bbox": (0, 0, 1)}])
+def test_invalid_requests(data_config, stored, kwargs):
+    with pytest.raises(RenderError):
+        render(data_config, "report", 2, **kwargs)
+
+def test_unknown_document(data_config, stored):
+    with pytest.raises(DocumentNotStored):
+        render(data_config, "missing", 1)
+
+def test_endpoint_honours_if_none_match(data_config, stored, monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "CHROMA_DB_PATH", str(tmp_path / "chroma"), raising=False)
+    import app as app_module
+    monkeypatch.setattr(app_module, "config", data_config)
+    client = app_module.app.test_client()
+
+    response = client.get("/render/report/2")
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert response.data == b"2:1.5:png:None"
+    etag = response.headers["ETag"]
+
+    response = client.get("/render/report/2", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert client.get("/render/report/2?zoom=2", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/render/missing/2").status_code == 404
+    assert client.get("/render/report/2?format=gif").status_code == 400
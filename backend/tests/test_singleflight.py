@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+import pytest
+from modules import singleflight
+from modules.singleflight import SingleFlight, coalesce, _key_path, _run_with_file_lock
+
+def _run_concurrently(target, n):
+    results = [None] * n
+    errors = [None] * n
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.005)
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {"answer": 42}
+
+    threads, results, errors = _run_concurrently(lambda: flight.do("key", compute), 5)
+    _wait_until(lambda: calls and sum(t.is_alive() for t in threads) == 5)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert errors == [None] * 5
+    assert all(result is results[0][0] for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+
+def test_errors_are_shared_and_not_kept():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    threads, _, errors = _run_concurrently(lambda: flight.do("key", fail), 3)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert flight.do("key", lambda: "ok") == ("ok", False)
+
+def test_finished_calls_are_not_cached(data_config):
+    values = iter(range(10))
+    assert coalesce(data_config, "ask", "q", lambda: next(values)) == 0
+    assert coalesce(data_config, "ask", "q", lambda: next(values)) == 1
+
+@pytest.mark.skipif(singleflight.fcntl is None, reason="file locks need fcntl")
+def test_file_lock_hands_the_result_to_a_waiting_process(data_config):
+    # flock locks belong to the open file, so two threads opening the lock file contend like two processes
+    key = "ask:q"
+    calls = []
+    follower_threads = []
+
+    def compute():
+        calls.append(1)
+        if len(calls) == 1:
+            with open(_key_path(data_config, key, ".flight")) as f:
+                generation = f.read()
+            follower_threads.extend(_run_concurrently(
+                lambda: _run_with_file_lock(data_config, key, lambda: "recomputed"), 1)[:2])
+            _wait_until(lambda: os.path.exists(_key_path(data_config, f"{key}:{generation}", ".readers")))
+            time.sleep(0.05)
+        return "first"
+
+    assert _run_with_file_lock(data_config, key, compute) == ("first", False)
+    threads, results = follower_threads
+    threads[0].join()
+    assert results == [("first", True)]
+    assert len(calls) == 1
+
+    leftovers = [name for name in os.listdir(os.path.dirname(_key_path(data_config, key, ".lock")))
+                 if name.endswith((".result", ".readers"))]
+    assert leftovers == []
+
+@pytest.mark.skipif(singleflight.fcntl is None, reason="file locks need fcntl")
+def test_file_lock_result_is_not_reused_after_the_flight(data_config):
+    assert _run_with_file_lock(data_config, "ask:q", lambda: 1) == (1, False)
+    assert _run_with_file_lock(data_config, "ask:q", lambda: 2) == (2, False)
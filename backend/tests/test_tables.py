@@ -0,0 +1,102 @@
+import pytest
+from modules.tables import normalize_period, parse_number, index_tables, lookup_table_rows, direct_answer
+
+@pytest.mark.parametrize("text, expected", [
+    ("FY24", "2024"),
+    ("FY 23", "2023"),
+    ("FY2023-24", "2024"),
+    ("2023-24", "2024"),
+    ("2024/25", "2025"),
+    ("1999-00", "2000"),
+    ("2024", "2024"),
+    ("Q1 FY24", "Q1 2024"),
+    ("H1 2024", "H1 2024"),
+    ("Year ended 31 March 2024", "2024"),
+    ("As at March 31, 2024", "2024"),
+    ("31.03.2024", "2024"),
+    ("31-03-2024", "2024"),
+    ("Dec 31 2023", "2023"),
+])
+def test_normalize_period(text, expected):
+    assert normalize_period(text) == expected
+
+@pytest.mark.parametrize("text", ["", "Notes", "12", "Note 31", "Revenue", "1850"])
+def test_normalize_period_rejects_non_periods(text):
+    assert normalize_period(text) is None
+
+@pytest.mark.parametrize("cell, expected", [
+    ("1,234", (1234.0, None)),
+    ("(56.7)", (-56.7, None)),
+    ("-12", (-12.0, None)),
+    ("−3.5", (-3.5, None)),
+    ("12.5%", (12.5, "%")),
+    ("$ 1,000", (1000.0, "$")),
+    ("€42", (42.0, "€")),
+    ("1 234", (1234.0, None)),
+])
+def test_parse_number(cell, expected):
+    assert parse_number(cell) == expected
+
+@pytest.mark.parametrize("cell", [None, "", "-", "—", "n/a", "NM", "Revenue", "12a"])
+def test_parse_number_rejects_text_and_empty_cells(cell):
+    assert parse_number(cell) == (None, None)
+
+def _row(row_index, label, cells, page_num=2):
+    return {"row_index": row_index, "label": label, "bbox": (10.0, 20.0 * row_index, 500.0, 20.0 * row_index + 12),
+            "cells": [{"period": period, "period_norm": normalize_period(period), "value": parse_number(raw)[0],
+                       "raw": raw, "unit": parse_number(raw)[1]} for period, raw in cells]}
+
+@pytest.fixture
+def indexed(data_config):
+    index_tables(data_config, "report", [{
+        "page_num": 2, "table_index": 0, "scale": "(in millions)", "rows": [
+            _row(1, "Revenue", [("FY24", "500"), ("FY23", "450")]),
+            _row(2, "Net revenue", [("FY24", "480"), ("FY23", "430")]),
+            _row(3, "Tax", [("FY24", "50"), ("FY23", "45")]),
+            _row(4, "Operating margin", [("FY24", "12.5%"), ("FY23", "11.0%")])
+        ]
+    }])
+    return data_config
+
+def test_lookup_table_rows_prefers_the_most_specific_label(indexed):
+    matches = lookup_table_rows(indexed, "What was net revenue in FY24?", ["report"])
+    assert [m["row_label"] for m in matches] == ["Net revenue", "Revenue"]
+    assert [c["raw"] for c in matches[0]["requested"]] == ["480"]
+
+def test_lookup_table_rows_requires_every_label_term(indexed):
+    matches = lookup_table_rows(indexed, "What was the operating profit in FY24?", ["report"])
+    assert matches == []
+
+def test_lookup_table_rows_is_scoped_to_documents(indexed):
+    assert lookup_table_rows(indexed, "What was revenue in FY24?", ["other"]) == []
+
+def test_direct_answer(indexed):
+    question = "What was the Group's revenue in FY24?"
+    answer = direct_answer(question, lookup_table_rows(indexed, question, ["report"]))
+    assert answer["answer"] == "Revenue for FY24 was 500 (in millions), as reported in the table on page 2."
+    assert answer["cell"]["value"] == 500.0
+
+def test_direct_answer_omits_scale_for_percentages(indexed):
+    question = "What was the operating margin in FY23?"
+    answer = direct_answer(question, lookup_table_rows(indexed, question, ["report"]))
+    assert answer["answer"].startswith("Operating margin for FY23 was 11.0%,")
+
+@pytest.mark.parametrize("question", [
+    "What was the revenue growth rate in FY24?",
+    "What was the percentage change in revenue in FY24?",
+    "What was revenue per employee in FY24?",
+    "How much did revenue grow in FY24?",
+    "What was revenue in FY23 and FY24?",
+    "What was revenue?",
+    "Summarise revenue in FY24",
+])
+def test_direct_answer_defers_to_generation(indexed, question):
+    assert direct_answer(question, lookup_table_rows(indexed, question, ["report"])) is None
+
+def test_direct_answer_rejects_conflicting_rows(data_config):
+    index_tables(data_config, "report", [
+        {"page_num": page, "table_index": 0, "scale": None, "rows": [_row(1, "Revenue", [("FY24", raw)], page)]}
+        for page, raw in ((2, "500"), (7, "520"))
+    ])
+    question = "What was revenue in FY24?"
+    assert direct_answer(question, lookup_table_rows(data_config, question, ["report"])) is None
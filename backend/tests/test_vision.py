@@ -0,0 +1,70 @@
+import time
+import pytest
+from modules import vision
+from modules.vision import enqueue_images, pending_chunk_ids, _claim, _set_status, _backfill, PENDING, DONE
+
+def _entries(pdf_id, pages):
+    return [{"chunk_id": f"{pdf_id}_{i}", "chunk_index": i,
+             "block": {"page_num": page, "image_key": f"{pdf_id}-{i}", "mime_type": "png"}}
+            for i, page in enumerate(pages)]
+
+@pytest.fixture
+def queued(data_config):
+    enqueue_images(data_config, "report", _entries("report", [3, 1, 2, 1]))
+    return data_config
+
+def test_pending_images_in_page_order(queued):
+    assert pending_chunk_ids(queued, "report") == ["report_1", "report_3", "report_2", "report_0"]
+    assert pending_chunk_ids(queued, "report", pages=[2, 3]) == ["report_2", "report_0"]
+    assert pending_chunk_ids(queued, "report", limit=1) == ["report_1"]
+    assert pending_chunk_ids(queued, "other") == []
+
+def test_reingest_replaces_the_queue(queued):
+    enqueue_images(queued, "report", _entries("report", [5]))
+    assert pending_chunk_ids(queued, "report") == ["report_0"]
+    enqueue_images(queued, "report", [])
+    assert pending_chunk_ids(queued, "report") == []
+
+def test_queues_are_scoped_by_collection(queued):
+    queued.CHROMA_COLLECTION = "chunks_1500"
+    assert pending_chunk_ids(queued, "report") == []
+    enqueue_images(queued, "report", _entries("report", [1]))
+    del queued.CHROMA_COLLECTION
+    assert len(pending_chunk_ids(queued, "report")) == 4
+
+def test_an_image_is_claimed_once(queued):
+    claimed = _claim(queued, ["report_0", "report_1"])
+    assert [entry["chunk_id"] for entry in claimed] == ["report_0", "report_1"]
+    assert claimed[0]["image_key"] == "report-0"
+    assert _claim(queued, ["report_0", "report_2"])[0]["chunk_id"] == "report_2"
+    assert pending_chunk_ids(queued, "report") == ["report_3"]
+
+def test_stale_claims_are_reclaimed(queued):
+    queued.VISION_CLAIM_TIMEOUT_SEC = 0.01
+    _claim(queued, ["report_0"])
+    time.sleep(0.02)
+    assert "report_0" in pending_chunk_ids(queued, "report")
+    assert len(_claim(queued, ["report_0"])) == 1
+
+def test_failed_images_go_back_to_pending(queued):
+    _claim(queued, ["report_0"])
+    _set_status(queued, ["report_0"], PENDING)
+    assert "report_0" in pending_chunk_ids(queued, "report")
+    _set_status(queued, ["report_0"], DONE)
+    assert _claim(queued, ["report_0"]) == []
+
+def test_backfill_describes_every_image_of_the_document(data_config, monkeypatch):
+    data_config.VISION_BACKFILL_DELAY_SEC = 0
+    enqueue_images(data_config, "report", _entries("report", [1] * 150))
+    described = []
+
+    def describe_pending(config, client, chroma_client, chunk_ids, trigger="query"):
+        entries = _claim(config, chunk_ids)
+        _set_status(config, [entry["chunk_id"] for entry in entries], DONE)
+        described.extend(entry["chunk_id"] for entry in entries)
+        return {}
+
+    monkeypatch.setattr(vision, "describe_pending", describe_pending)
+    _backfill(data_config, None, None, "report", None)
+    assert len(described) == 150
+    assert pending_chunk_ids(data_config, "report") == []
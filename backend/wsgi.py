@@ -0,0 +1,18 @@
+"""
+Production entry point: a prefork gunicorn server.
+
+    gunicorn -c gunicorn.conf.py
+
+The master imports the app and every route dependency once (preload_app), then
+forks the workers, so the imported code and module-level read-only state are
+shared copy-on-write. Clients, thread pools and the vector index are per worker:
+each worker runs app.warm_up() before serving when config.WARM_UP is set.
+"""
+import gc
+from app import app, preload_modules
+
+preload_modules()
+
+# Move everything imported so far out of the garbage collector's generations, so
+# collections in the workers don't write to (and un-share) those pages
+gc.freeze()
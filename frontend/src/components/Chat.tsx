@@ -38,7 +38,8 @@ const Chat: React.FC = () => {
         highlights: data.highlight_info.map((highlight: any) => ({
           page: highlight.page,
           paragraph: highlight.paragraph_index,
-          preview: highlight.preview
+          preview: highlight.preview,
+          pdfId: highlight.pdf_id || data.pdf_id
         })),
       };      
 
@@ -43,6 +43,14 @@ const CitationSidePanel: React.FC<Props> = ({
                   {h.preview && (
                     <p className="text-sm italic text-gray-300 mt-1">"{h.preview}"</p>
                   )}
+                  {h.pdfId && (
+                    <img
+                      src={`http://localhost:5000/render/${encodeURIComponent(h.pdfId)}/${h.page}?format=webp`}
+                      alt={`Page ${h.page}`}
+                      loading="lazy"
+                      className="mt-2 w-full rounded-md bg-white"
+                    />
+                  )}
                 </li>
               ))}
             </ul>
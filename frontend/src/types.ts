@@ -6,6 +6,7 @@ export interface Message {
       page: number;
       paragraph: number;
       preview: string;
+      pdfId?: string;
     }[];
   }
   
\ No newline at end of file